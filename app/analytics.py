@@ -91,6 +91,118 @@ class Analytics:
             )
             self._gauge_timestamps.labels(activity="app_started").set_to_current_time()
 
+            self._counter_generation_jobs = Counter(
+                'imggen_generation_jobs',
+                'number of generation jobs handled by the scheduler',
+                labelnames=('status',)
+            )
+            self._counter_generation_jobs.labels('')
+
+            self._gauge_generation_queue = Gauge(
+                'imggen_generation_queue_length',
+                'Amount of generation jobs waiting in the queue'
+            )
+            self._gauge_generation_queue.set(0)
+
+            self._histogram_generation_wait = Histogram(
+                'imggen_generation_queue_wait_seconds',
+                'Time generation jobs waited in the queue before they started',
+                buckets=(1, 5, 10, 30, 60, 120, 300, 600)
+            )
+
+            self._histogram_generation_batch = Histogram(
+                'imggen_generation_batch_images',
+                'Amount of images generated together in one batched pipeline call',
+                buckets=(2, 3, 4, 6, 8, 12, 16)
+            )
+            self._counter_batched_jobs = Counter(
+                'imggen_generation_batched_jobs',
+                'number of generation jobs executed as part of a batch'
+            )
+
+            self._gauge_model_readiness = Gauge(
+                'imggen_model_readiness',
+                'Current readiness state of the generation model (1 = active state)',
+                labelnames=('state',)
+            )
+            self._gauge_model_preload = Gauge(
+                'imggen_model_preload_seconds',
+                'Duration of the model preload and warmup at server start'
+            )
+
+            self._counter_cache_requests = Counter(
+                'imggen_cache_requests',
+                'number of cache lookups by cache and result (hit or miss)',
+                labelnames=('cache', 'result')
+            )
+            self._gauge_cache_size = Gauge(
+                'imggen_cache_size_bytes',
+                'Current size of the cache content in bytes',
+                labelnames=('cache',)
+            )
+            self._gauge_cache_entries = Gauge(
+                'imggen_cache_entries',
+                'Current amount of entries in the cache',
+                labelnames=('cache',)
+            )
+
+            self._histogram_upload_analysis = Histogram(
+                'imggen_upload_analysis_seconds',
+                'Duration of the checks of uploaded images by stage (total = until the verdict)',
+                labelnames=('stage',),
+                buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+            )
+
+            self._counter_prompt_checks = Counter(
+                'imggen_prompt_check_decisions',
+                'number of NSFW decisions of prompts by tier (lexical, classifier, cache, llm) and verdict',
+                labelnames=('tier', 'verdict')
+            )
+            self._histogram_prompt_checks = Histogram(
+                'imggen_prompt_check_seconds',
+                'Duration of the NSFW check of prompts by tier',
+                labelnames=('tier',),
+                buckets=(0.0001, 0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30)
+            )
+
+            self._counter_prompt_rewrites = Counter(
+                'imggen_prompt_rewrites',
+                'number of NSFW prompt rewrites by outcome (sfw, budget_exhausted or llm_unavailable)',
+                labelnames=('outcome',)
+            )
+            self._histogram_prompt_rewrite_iterations = Histogram(
+                'imggen_prompt_rewrite_iterations',
+                'Rewrite iterations of a NSFW prompt',
+                buckets=(1, 2, 3, 5, 10)
+            )
+            self._histogram_prompt_rewrite_calls = Histogram(
+                'imggen_prompt_rewrite_llm_calls',
+                'LLM calls of a NSFW prompt rewrite incl. the NSFW checks',
+                buckets=(1, 2, 4, 6, 8, 12, 20)
+            )
+            self._histogram_prompt_rewrite_tokens = Histogram(
+                'imggen_prompt_rewrite_tokens',
+                'LLM tokens (prompt and answer) of a NSFW prompt rewrite',
+                buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000)
+            )
+            self._histogram_prompt_rewrite_seconds = Histogram(
+                'imggen_prompt_rewrite_seconds',
+                'Duration of a NSFW prompt rewrite',
+                buckets=(0.5, 1, 2, 5, 10, 20, 30, 60)
+            )
+
+            self._histogram_llm_calls = Histogram(
+                'imggen_llm_call_seconds',
+                'Duration of the calls to the Ollama server by outcome (success, timeout, error, rejected)',
+                labelnames=('outcome',),
+                buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+            )
+            self._gauge_llm_circuit_state = Gauge(
+                'imggen_llm_circuit_state',
+                'Current state of the circuit breaker of the Ollama server (1 = active state)',
+                labelnames=('state',)
+            )
+
             # Start Prometheus HTTP server on port 9101
             start_http_server(9101)
         except Exception as e:
@@ -275,6 +387,176 @@ class Analytics:
             logger.warning(f"Failed to record a prompt usage: {e}")
             raise e
 
+    def record_generation_job(self, status: str, wait_seconds: Optional[float] = None) -> None:
+        """
+        Record a state change of a generation job in the scheduler.
+
+        Args:
+            status (str): queued, rejected, completed, failed or cancelled
+            wait_seconds (float): time the job waited in the queue (only for started jobs)
+        """
+        try:
+            self._counter_generation_jobs.labels(status=status).inc()
+            if wait_seconds is not None:
+                self._histogram_generation_wait.observe(wait_seconds)
+        except Exception as e:
+            logger.warning(f"Failed to record generation job: {e}")
+
+    def record_generation_batch(self, job_count: int, image_count: int) -> None:
+        """
+        Record a batched pipeline call which combined multiple generation jobs.
+
+        Args:
+            job_count (int): Amount of jobs in the batch
+            image_count (int): Amount of images generated by the batch
+        """
+        try:
+            self._counter_batched_jobs.inc(amount=job_count)
+            self._histogram_generation_batch.observe(image_count)
+        except Exception as e:
+            logger.warning(f"Failed to record generation batch: {e}")
+
+    def update_generation_queue_length(self, length: int) -> None:
+        """
+        Update the amount of waiting generation jobs.
+
+        Args:
+            length (int): Current number of jobs in the queue
+        """
+        try:
+            self._gauge_generation_queue.set(length)
+        except Exception as e:
+            logger.warning(f"Failed to update generation queue length: {e}")
+
+    def update_model_readiness(self, state: str) -> None:
+        """
+        Update the readiness state of the generation model.
+
+        Args:
+            state (str): cold, loading, warming, ready or failed
+        """
+        try:
+            for known_state in ("cold", "loading", "warming", "ready", "failed"):
+                self._gauge_model_readiness.labels(state=known_state).set(1 if known_state == state else 0)
+        except Exception as e:
+            logger.warning(f"Failed to update model readiness: {e}")
+
+    def record_model_preload(self, duration_seconds: float) -> None:
+        """
+        Record the duration of the model preload and warmup.
+
+        Args:
+            duration_seconds (float): Time from preload start until the model was ready
+        """
+        try:
+            self._gauge_model_preload.set(duration_seconds)
+        except Exception as e:
+            logger.warning(f"Failed to record model preload: {e}")
+
+    def record_cache_access(self, cache: str, hit: bool) -> None:
+        """
+        Record a cache lookup.
+
+        Args:
+            cache (str): Name of the cache
+            hit (bool): True if the entry was found
+        """
+        try:
+            self._counter_cache_requests.labels(cache=cache, result="hit" if hit else "miss").inc()
+        except Exception as e:
+            logger.warning(f"Failed to record cache access: {e}")
+
+    def update_cache_size(self, cache: str, entries: int, size_bytes: Optional[int] = None) -> None:
+        """
+        Update the size of a cache.
+
+        Args:
+            cache (str): Name of the cache
+            entries (int): Current amount of cached entries
+            size_bytes (int): Current size of the cached content, None if the cache doesn't know it
+        """
+        try:
+            if size_bytes is not None:
+                self._gauge_cache_size.labels(cache=cache).set(size_bytes)
+            self._gauge_cache_entries.labels(cache=cache).set(entries)
+        except Exception as e:
+            logger.warning(f"Failed to update cache size: {e}")
+
+    def record_upload_analysis(self, stage: str, duration_seconds: float) -> None:
+        """
+        Record the duration of a check of an uploaded image.
+
+        Args:
+            stage (str): Name of the check, 'total' for the time until the verdict
+            duration_seconds (float): Duration of the check
+        """
+        try:
+            self._histogram_upload_analysis.labels(stage=stage).observe(duration_seconds)
+        except Exception as e:
+            logger.warning(f"Failed to record upload analysis: {e}")
+
+    def record_prompt_check(self, tier: str, verdict: str, duration_seconds: float) -> None:
+        """
+        Record a decision of the NSFW check of a prompt.
+
+        Args:
+            tier (str): Stage which decided, e.g. 'lexical', 'classifier', 'cache' or 'llm'
+            verdict (str): 'nsfw', 'sfw' or 'ambiguous' if the next tier has to decide
+            duration_seconds (float): Duration of the tier
+        """
+        try:
+            self._counter_prompt_checks.labels(tier=tier, verdict=verdict).inc()
+            self._histogram_prompt_checks.labels(tier=tier).observe(duration_seconds)
+        except Exception as e:
+            logger.warning(f"Failed to record prompt check: {e}")
+
+    def record_prompt_rewrite(self, outcome: str, iterations: int, llm_calls: int, tokens: int,
+                              duration_seconds: float) -> None:
+        """
+        Record a rewrite of a NSFW prompt.
+
+        Args:
+            outcome (str): 'sfw', 'budget_exhausted' or 'llm_unavailable' if the rewrite was stopped
+            iterations (int): Rewrite iterations
+            llm_calls (int): LLM calls incl. the NSFW checks
+            tokens (int): LLM tokens of all calls
+            duration_seconds (float): Duration of the rewrite
+        """
+        try:
+            self._counter_prompt_rewrites.labels(outcome=outcome).inc()
+            self._histogram_prompt_rewrite_iterations.observe(iterations)
+            self._histogram_prompt_rewrite_calls.observe(llm_calls)
+            self._histogram_prompt_rewrite_tokens.observe(tokens)
+            self._histogram_prompt_rewrite_seconds.observe(duration_seconds)
+        except Exception as e:
+            logger.warning(f"Failed to record prompt rewrite: {e}")
+
+    def record_llm_call(self, outcome: str, duration_seconds: float) -> None:
+        """
+        Record a call to the Ollama server.
+
+        Args:
+            outcome (str): success, timeout, error or rejected by the circuit breaker
+            duration_seconds (float): Duration of the call
+        """
+        try:
+            self._histogram_llm_calls.labels(outcome=outcome).observe(duration_seconds)
+        except Exception as e:
+            logger.warning(f"Failed to record llm call: {e}")
+
+    def update_llm_circuit_state(self, state: str) -> None:
+        """
+        Update the state of the circuit breaker of the Ollama server.
+
+        Args:
+            state (str): closed, open or half_open
+        """
+        try:
+            for known_state in ("closed", "open", "half_open"):
+                self._gauge_llm_circuit_state.labels(state=known_state).set(1 if known_state == state else 0)
+        except Exception as e:
+            logger.warning(f"Failed to update llm circuit state: {e}")
+
     def update_active_sessions(self, sessioncount: int) -> None:
         """
         Update the count of active sessions.
@@ -23,8 +23,78 @@ class AppConfig:
         self.modelconfig_json = os.getenv("MODELCONFIG", "./modelconfig.json")
 
         self.selected_model = os.getenv("GENERATION_MODEL", "default")
+        # additional models the user can choose from (comma separated), the selected model is always available
+        self.selectable_models = [m.strip() for m in os.getenv("SELECTABLE_MODELS", "").split(",") if m.strip()]
         self.model_cache_dir = os.getenv("MODEL_DIRECTORY", "./models/")
         self.free_memory_after_minutes_inactivity = int(os.getenv("FREE_MEMORY_AFTER_MINUTES_INACTIVITY", 15))
+        # idle models are moved to CPU memory after the inactivity time and to disk after additional minutes,
+        # if turned off the models are completely unloaded after the inactivity time
+        self.pipeline_offload_enabled = self.getbool("PIPELINE_OFFLOAD_ENABLED", True)
+        self.pipeline_offload_disk_after_minutes = int(os.getenv("PIPELINE_OFFLOAD_DISK_AFTER_MINUTES", 30))
+        # load and warm up the selected model in the background at server start (0 warmup steps = only load)
+        self.preload_model = self.getbool("PRELOAD_MODEL", True)
+        self.preload_warmup_steps = int(os.getenv("PRELOAD_WARMUP_STEPS", 2))
+        self.pipeline_offload_directory = os.getenv("PIPELINE_OFFLOAD_DIRECTORY", os.path.join(self.model_cache_dir, "offload"))
+
+        # scheduler in front of the generator, jobs are rejected if the queue is full
+        self.generation_queue_max_size = int(os.getenv("GENERATION_QUEUE_MAX_SIZE", 20))
+        self.generation_queue_max_jobs_per_session = int(os.getenv("GENERATION_QUEUE_MAX_JOBS_PER_SESSION", 1))
+        # compatible jobs (same resolution, steps, guidance) are combined to one pipeline call
+        self.generation_batch_max_images = int(os.getenv("GENERATION_BATCH_MAX_IMAGES", 4))
+        self.generation_batch_window_ms = int(os.getenv("GENERATION_BATCH_WINDOW_MS", 250))
+        # generation requests are cancelled after this time incl. waiting in the queue (0 = no timeout)
+        self.generation_timeout_seconds = int(os.getenv("GENERATION_TIMEOUT_SECONDS", 300))
+        # intermediate preview images every n denoising steps (0 = only step progress)
+        self.generation_preview_steps = int(os.getenv("GENERATION_PREVIEW_STEPS", 5))
+        # encoded prompts are cached to skip the text encoders for repeated prompts (0 = disabled)
+        self.prompt_embedding_cache_mb = float(os.getenv("PROMPT_EMBEDDING_CACHE_MB", 256))
+        # generated images of identical requests are served from disk without the GPU (0 = disabled),
+        # requests without seed are only cached if RESULT_CACHE_SEEDED_ONLY is turned off
+        self.result_cache_mb = float(os.getenv("RESULT_CACHE_MB", 1024))
+        self.result_cache_directory = os.getenv("RESULT_CACHE_DIRECTORY", os.path.join(self.model_cache_dir, "results"))
+        self.result_cache_seeded_only = self.getbool("RESULT_CACHE_SEEDED_ONLY", True)
+        # results of the NSFW, face and AI-image checks per image content (0 entries = disabled)
+        self.analysis_cache_max_entries = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 1024))
+        self.analysis_cache_ttl_minutes = float(os.getenv("ANALYSIS_CACHE_TTL_MINUTES", 60))
+        # worker pool of the parallel checks of uploaded images (face, AI-image and NSFW detection)
+        self.upload_analysis_workers = int(os.getenv("UPLOAD_ANALYSIS_WORKERS", 3))
+        # uploads analyzed at the same time in the background, the credits are received with the next token check
+        self.upload_job_workers = int(os.getenv("UPLOAD_JOB_WORKERS", 2))
+        # face analysis sessions used in parallel by the upload checks (0 = cpu cores / threads per session)
+        self.face_detector_pool_size = int(os.getenv("FACE_DETECTOR_POOL_SIZE", 0))
+        self.face_detector_threads = int(os.getenv("FACE_DETECTOR_THREADS", 2))
+        # maximum Hamming distance of the perceptual hashes of near-duplicate uploads (0 = only identical images)
+        self.image_duplicate_distance = int(os.getenv("IMAGE_DUPLICATE_DISTANCE", 6))
+        # NSFW verdicts of prompts, persistent across restarts and dropped if OLLAMA_MODEL changes (0 entries = disabled)
+        self.prompt_verdict_cache_max_entries = int(os.getenv("PROMPT_VERDICT_CACHE_MAX_ENTRIES", 10000))
+        self.prompt_verdict_cache_ttl_hours = float(os.getenv("PROMPT_VERDICT_CACHE_TTL_HOURS", 168))
+        self.prompt_verdict_cache_path = os.getenv("PROMPT_VERDICT_CACHE_PATH", os.path.join(self.model_cache_dir, "prompt_verdicts.db"))
+        # 'structured' asks all NSFW checks of a prompt in one LLM call, 'per_question' one check per call
+        self.prompt_check_mode = os.getenv("PROMPT_CHECK_MODE", "structured").strip().lower()
+        # local pre-filter of the prompt NSFW check, only prompts it can't decide are checked by the LLM
+        self.prompt_prefilter_enabled = self.getbool("PROMPT_PREFILTER", True)
+        self.prompt_prefilter_terms = os.getenv("PROMPT_PREFILTER_TERMS", "")  # empty = built-in term list
+        self.prompt_prefilter_classifier = os.getenv("PROMPT_PREFILTER_CLASSIFIER", "")  # empty = no classifier
+        self.prompt_prefilter_safe_below = float(os.getenv("PROMPT_PREFILTER_SAFE_BELOW", 0.1))
+        self.prompt_prefilter_unsafe_above = float(os.getenv("PROMPT_PREFILTER_UNSAFE_ABOVE", 0.95))
+        # prompts without any term of the list are safe without asking the LLM, if there is no classifier
+        self.prompt_prefilter_lexical_safe = self.getbool("PROMPT_PREFILTER_LEXICAL_SAFE", True)
+        # budget of the rewrite of a NSFW prompt, the last rewrite is used if it's exhausted
+        self.prompt_rewrite_max_iterations = int(os.getenv("PROMPT_REWRITE_MAX_ITERATIONS", 3))
+        self.prompt_rewrite_max_calls = int(os.getenv("PROMPT_REWRITE_MAX_CALLS", 10))
+        self.prompt_rewrite_timeout_seconds = float(os.getenv("PROMPT_REWRITE_TIMEOUT_SECONDS", 30))
+        # access to the Ollama server, calls are rejected for OLLAMA_BREAKER_RESET_SECONDS after consecutive failures
+        self.ollama_server = os.getenv("OLLAMA_SERVER", None)
+        self.ollama_model = os.getenv("OLLAMA_MODEL", "llava").strip()
+        self.ollama_timeout_seconds = float(os.getenv("OLLAMA_TIMEOUT_SECONDS", 20))
+        self.ollama_max_concurrency = int(os.getenv("OLLAMA_MAX_CONCURRENCY", 4))
+        self.ollama_breaker_failures = int(os.getenv("OLLAMA_BREAKER_FAILURES", 3))
+        self.ollama_breaker_reset_seconds = float(os.getenv("OLLAMA_BREAKER_RESET_SECONDS", 30))
+        # pre-rendered examples created by tools/render_examples.py
+        self.example_gallery_directory = os.getenv("EXAMPLE_GALLERY_DIRECTORY", "./examples/gallery")
+        # amount of pipelines kept in memory at the same time, least recently used is evicted (0 = no memory budget)
+        self.pipeline_pool_max_models = int(os.getenv("PIPELINE_POOL_MAX_MODELS", 1))
+        self.pipeline_pool_memory_budget_gb = float(os.getenv("PIPELINE_POOL_MEMORY_BUDGET_GB", 0))
 
         self.initial_token = int(os.getenv("INITIAL_GENERATION_TOKEN", 0))
         self.feature_generation_credits_enabled = self.initial_token > 0
@@ -2,6 +2,19 @@ from .generation_params import GenerationParameters
 from .fluxgenerator import FluxGenerator
 from .diffusion_generator import StabelDiffusionGenerator
 from .modelconfig import ModelConfig
+from .pipeline_pool import PipelinePool
+from .embedding_cache import PromptEmbeddingCache
+from .result_cache import GenerationResultCache, example_seed, cleanup_prompt
+from .example_gallery import ExampleGallery, load_examples
+from .generator_factory import get_generator
+from .scheduler import GenerationScheduler, JobPriority, JobState, QueueFullException, SessionLimitException
+from .preloader import ModelPreloader, ReadinessState
+from .cancellation import CancellationToken, GenerationCancelledException
 # from .OllamaImageAnalyzer import OllamaImageAnalyzer
 
-__all__ = ["FluxGenerator", "GenerationParameters", "StabelDiffusionGenerator" "ModelConfig"]
+__all__ = ["FluxGenerator", "GenerationParameters", "StabelDiffusionGenerator", "ModelConfig",
+           "PipelinePool", "PromptEmbeddingCache", "GenerationResultCache", "example_seed", "cleanup_prompt",
+           "ExampleGallery", "load_examples",
+           "get_generator", "GenerationScheduler", "JobPriority", "JobState", "QueueFullException",
+           "SessionLimitException",
+           "ModelPreloader", "ReadinessState", "CancellationToken", "GenerationCancelledException"]
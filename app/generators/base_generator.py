@@ -24,6 +24,10 @@ from typing import List
 from PIL import Image, ImageDraw
 import threading
 from .modelconfig import ModelConfig
+from .pipeline_pool import PipelinePool
+from .latent_preview import get_latent_format, latents_to_images
+from .cancellation import CancellationToken, GenerationCancelledException
+from .embedding_cache import PromptEmbeddingCache
 from ..appconfig import AppConfig
 from . import GenerationParameters
 
@@ -55,7 +59,8 @@ class BaseGenerator():
         appconfig (AppConfig): Application-wide configuration
         device (str): Computing device ('cuda' or 'cpu')
         torch_dtype: PyTorch data type for tensor operations
-        _cached_generation_pipeline: Cached model pipeline (defined by concrete implementations)
+        _pipeline_pool (PipelinePool): Pool of loaded pipelines shared by all generators
+        _embedding_cache (PromptEmbeddingCache): Cache of encoded prompts shared by all generators
         _generation_lock (threading.Lock): Thread lock for generation operations
         _hftoken (str): HuggingFace API token
 
@@ -83,7 +88,12 @@ class BaseGenerator():
         self.torch_dtype = torch.float16 if self.device == "cuda" else torch.float32
         logger.info(f"Set device for generation to {self.device}")
 
-        self._cached_generation_pipeline = None
+        self._pipeline_pool = PipelinePool(
+            max_models=self.appconfig.pipeline_pool_max_models,
+            memory_budget_gb=self.appconfig.pipeline_pool_memory_budget_gb,
+            offload_directory=self.appconfig.pipeline_offload_directory
+        )
+        self._embedding_cache = PromptEmbeddingCache(max_megabytes=self.appconfig.prompt_embedding_cache_mb)
         self._generation_lock = threading.Lock()
 
         logger.info(f"using cache directory '{self.appconfig.model_cache_dir}'")
@@ -113,6 +123,38 @@ class BaseGenerator():
         # implemented in nsfw_check in image_generator, because of advanced logic
         return x_image, False
 
+    @property
+    def is_model_loaded(self) -> bool:
+        """True if the pipeline of the current model is resident in the pipeline pool"""
+        return self.modelconfig is not None and self._pipeline_pool.contains(self.modelconfig)
+
+    def change_model(self, modelconfig: ModelConfig):
+        """
+        Change the current generation model to a new one.
+
+        The pipeline of the previous model stays in the pipeline pool (until it is
+        evicted), so switching back and forth between models doesn't require a reload.
+
+        Args:
+            modelconfig (ModelConfig): Configuration for the new model
+
+        Raises:
+            Exception: If the modelconfig is not of type ModelConfig
+            Exception: If loading the new model fails
+        """
+        logger.info("Change generation model to %s", modelconfig.model)
+        if not isinstance(modelconfig, ModelConfig):
+            raise Exception("type of modelconfig must be ModelConfig")
+
+        try:
+            with self._generation_lock:
+                self.modelconfig = modelconfig
+                if not self.appconfig.NO_AI:
+                    self._load_model()
+        except Exception as e:
+            logger.error(f"Error while changing text2img model: {e}")
+            raise Exception(f"Loading new model '{self.modelconfig.model}' failed") from e
+
     def warmup(self) -> None:
         """
         Prepare the model for execution by loading it into memory.
@@ -203,10 +245,9 @@ class BaseGenerator():
         to free up system resources.
         """
         try:
-            if self._cached_generation_pipeline:
+            if self.is_model_loaded:
                 logger.info("unload image generation model")
-                del self._cached_generation_pipeline
-                self._cached_generation_pipeline = None
+                self._pipeline_pool.unload(self.modelconfig)
             gc.collect()
             torch.cuda.empty_cache()
         except Exception:
@@ -270,22 +311,239 @@ class BaseGenerator():
             images.append(img)
         return images
 
-    @abc.abstractmethod
-    def _load_model(self, use_cached_model: bool = True) -> None:
+    def _apply_prompt_embeddings(self, pipeline, pipeline_args: dict, params_list: List[GenerationParameters]):
         """
-        Abstract method to load the AI model.
+        Replace the text prompts of the pipeline arguments with (cached) prompt embeddings.
+        The pipeline arguments stay unchanged if the generator can't encode prompts or encoding fails.
+        """
+        if not self._embedding_cache.enabled:
+            return
+        try:
+            embeddings = []
+            for params in params_list:
+                key = (self._pipeline_pool.key_for(self.modelconfig), params.prompt, params.negative_prompt or "", params.clip_skip)
+                entry = self._embedding_cache.get(key)
+                if entry is None:
+                    with torch.no_grad():
+                        entry = self._encode_prompt(pipeline, params.prompt, params.negative_prompt, params.clip_skip)
+                    if entry is None:
+                        return
+                    self._embedding_cache.put(key, entry)
+                embeddings.extend([entry] * params.num_images_per_prompt)
+
+            pipeline_args.update({name: torch.cat([entry[name] for entry in embeddings]) for name in embeddings[0].keys()})
+            pipeline_args.pop("prompt", None)
+            if "negative_prompt_embeds" in embeddings[0]:
+                pipeline_args.pop("negative_prompt", None)
+        except Exception as e:
+            logger.warning(f"Using prompt embeddings failed, the pipeline encodes the prompts: {e}")
 
-        This method must be implemented by concrete subclasses to define
-        how their specific model should be loaded.
+    def _encode_prompt(self, pipeline, prompt: str, negative_prompt: str, clip_skip: int) -> dict:
+        """
+        Encode a single prompt with the text encoders of the pipeline.
+
+        Returns:
+            dict: pipeline arguments with the embeddings of the prompt (batch size 1),
+                None if the generator does not support prompt embeddings
+        """
+        return None
+
+    def _raise_if_all_cancelled(self, cancel_tokens: List[CancellationToken]):
+        """the batch is stopped only if nobody is waiting for the images anymore"""
+        if all(token is not None and token.is_cancelled for token in cancel_tokens):
+            raise GenerationCancelledException(f"All {len(cancel_tokens)} request(s) of the batch were cancelled")
+
+    def _create_step_callback(self, params_list: List[GenerationParameters], step_callbacks: List,
+                              cancel_tokens: List[CancellationToken]):
+        """
+        Creates the callback_on_step_end of the pipeline, which reports the progress of every
+        denoising step to the requests of the batch. Every appconfig.generation_preview_steps
+        steps the latents are converted to cheap preview images (not for the last step).
+        If all requests are cancelled, the exception stops the denoising loop.
+        """
+        latent_format = get_latent_format(self.modelconfig.model_type)
+        preview_steps = self.appconfig.generation_preview_steps if latent_format else 0
+        width, height = params_list[0].width, params_list[0].height
+
+        def on_step_end(pipeline, step: int, timestep, callback_kwargs: dict) -> dict:
+            self._raise_if_all_cancelled(cancel_tokens)
+            total_steps = getattr(pipeline, "num_timesteps", None) or params_list[0].num_inference_steps
+            step += 1
+            previews = None
+            if preview_steps > 0 and step % preview_steps == 0 and step < total_steps:
+                try:
+                    latents = self._unpack_latents(pipeline, callback_kwargs["latents"], width, height)
+                    previews = latents_to_images(latents, latent_format)
+                except Exception as e:
+                    logger.debug(f"creating preview failed with {e}")
+
+            start = 0
+            for params, step_callback in zip(params_list, step_callbacks):
+                if step_callback:
+                    try:
+                        step_callback(step, total_steps, previews[start:start + params.num_images_per_prompt] if previews else None)
+                    except Exception as e:
+                        logger.debug(f"step callback failed with {e}")
+                start += params.num_images_per_prompt
+            return callback_kwargs
+
+        return on_step_end
+
+    def _unpack_latents(self, pipeline, latents: torch.Tensor, width: int, height: int) -> torch.Tensor:
+        """latents of the denoising loop as (batch, channels, height, width)"""
+        return latents
+
+    def _load_model(self, checkout: bool = False):
+        """
+        Returns the pipeline of the current model from the pipeline pool.
+        The pipeline is created by _create_pipeline if it is not in the pool.
 
         Args:
-            use_cached_model (bool): Whether to use a cached model if available
+            checkout (bool): mark the pipeline as in use until the pool's checkin()
 
-        Raises:
-            NotImplementedError: If not implemented by concrete subclass
+        Returns:
+            The pipeline or None if loading failed
+        """
+        # pipelines with cpu offload hooks are managed by accelerate and can't be moved by the pool
+        device = None if self.modelconfig.generation.get("GPU_ALLOW_MEMORY_OFFLOAD", False) else self.device
+        return self._pipeline_pool.get_or_load(self.modelconfig, self._create_pipeline, device=device, checkout=checkout)
+
+    @abc.abstractmethod
+    def _create_pipeline(self):
+        """
+        Abstract method to create the pipeline of the current model.
+
+        This method must be implemented by concrete subclasses to define
+        how their specific model should be loaded. It is required that
+        self.modelconfig is proper set.
+
+        Returns:
+            The configured pipeline or None if loading failed
         """
         pass
 
     @abc.abstractmethod
-    def generate_images(self, params: GenerationParameters, status_callback) -> List[Image.Image]:
+    def _prepare_generation_parameters(self, params: GenerationParameters) -> GenerationParameters:
+        """
+        Abstract method to adapt the parameters to the loaded model.
+
+        Concrete subclasses apply model specific constraints (e.g. steps and guidance
+        for flux schnell) and the embedding keywords from the model configuration.
+
+        Args:
+            params (GenerationParameters): Parameters requested by the user
+
+        Returns:
+            GenerationParameters: Parameters used for the pipeline call
+        """
         pass
+
+    def generate_images(self, params: GenerationParameters, step_callback=None,
+                        cancel_token: CancellationToken = None) -> List[Image.Image]:
+        """
+        Generate images using the current model.
+
+        Args:
+            params (GenerationParameters): Parameters for image generation
+                including prompts, number of images, steps, etc.
+            step_callback: Called after every denoising step with (step, total_steps, previews),
+                previews is a list of low resolution preview images or None
+            cancel_token (CancellationToken): Optional token, checked after every denoising step
+
+        Returns:
+            List[Image.Image]: List of generated PIL Images
+
+        Raises:
+            GenerationCancelledException: If the token was cancelled
+            Exception: If no model is loaded or if generation fails
+        """
+        return self.generate_images_batch([params], [step_callback], [cancel_token])[0]
+
+    def generate_images_batch(self, params_list: List[GenerationParameters], step_callbacks: List = None,
+                              cancel_tokens: List[CancellationToken] = None) -> List[List[Image.Image]]:
+        """
+        Generate images for multiple requests with one batched pipeline call.
+
+        All requests must be compatible (see GenerationParameters.batch_key). Every requested
+        image becomes one entry of the batch with its own prompt and random generator. The
+        resulting images are split back in the order of the given parameters.
+
+        Args:
+            params_list (List[GenerationParameters]): compatible parameters of all requests
+            step_callbacks (List): optional step callback per request, called with (step, total_steps, previews)
+            cancel_tokens (List[CancellationToken]): optional cancellation token per request, the pipeline
+                is stopped after the current step if all requests of the batch are cancelled
+
+        Returns:
+            List[List[Image.Image]]: generated images per request
+
+        Raises:
+            GenerationCancelledException: If all requests were cancelled
+            Exception: If no model is loaded or if generation fails
+            ValueError: If the parameters can't be combined in one batch
+
+        Notes:
+            - Thread-safe execution using generation lock
+            - Handles NO_AI testing mode
+        """
+        logger.debug("starting image generation")
+        # Validate parameters and throw exceptions
+        for params in params_list:
+            params.validate()
+        if len(set(params.batch_key() for params in params_list)) != 1 or params_list[0].batch_key() is None:
+            raise ValueError("Parameters are not compatible for a batched generation")
+        if step_callbacks is None:
+            step_callbacks = [None] * len(params_list)
+        if cancel_tokens is None:
+            cancel_tokens = [None] * len(params_list)
+
+        if self.appconfig.NO_AI:
+            logger.warning("'no ai' - option is activated")
+            return [self._create_test_image(params) for params in params_list]
+
+        with self._generation_lock:
+            # the pipeline is not offloaded while it's in use
+            pooled_modelconfig = self.modelconfig
+            current_pipeline = None
+            try:
+                current_pipeline = self._load_model(checkout=True)
+                if not current_pipeline:
+                    logger.error("No model loaded")
+                    raise Exception("No model loaded. Generation not available")
+
+                prepared_params = [self._prepare_generation_parameters(params) for params in params_list]
+                pipeline_args = GenerationParameters.to_batch_dict(prepared_params)
+                logger.debug(
+                    "start generating %d images for %d requests. Guidance: %f, Steps: %d",
+                    len(pipeline_args["prompt"]),
+                    len(prepared_params),
+                    prepared_params[0].guidance_scale,
+                    prepared_params[0].num_inference_steps,
+                )
+                # requests may be cancelled while waiting for the lock or loading the model
+                self._raise_if_all_cancelled(cancel_tokens)
+                self._apply_prompt_embeddings(current_pipeline, pipeline_args, prepared_params)
+                if any(step_callbacks) or any(cancel_tokens):
+                    pipeline_args["callback_on_step_end"] = self._create_step_callback(prepared_params, step_callbacks, cancel_tokens)
+
+                images = current_pipeline(**pipeline_args).images
+
+                # split the batch back to the requests
+                result_images = []
+                start = 0
+                for params in prepared_params:
+                    result_images.append(images[start:start + params.num_images_per_prompt])
+                    start += params.num_images_per_prompt
+                return result_images
+
+            except RuntimeError as e:
+                logger.error(f"Error while generating Images: {e}")
+                try:
+                    torch.cuda.empty_cache()
+                    self.unload_model()
+                except Exception as e:
+                    logger.debug(f"free cuda or unload model failed with {e}")
+                raise Exception("Internal error while creating the image.")
+            finally:
+                if current_pipeline is not None:
+                    self._pipeline_pool.checkin(pooled_modelconfig)
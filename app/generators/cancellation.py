@@ -0,0 +1,56 @@
+"""
+Cancellation Module
+
+A cancellation token is created for every generation request by the UI and handed over
+through the scheduler to the generator. The generator checks the token after every
+denoising step and stops the pipeline if the request was cancelled (e.g. the browser tab
+was closed) or the request timed out.
+
+Classes:
+    GenerationCancelledException: Raised if a generation was stopped by its token
+    CancellationToken: Thread-safe flag with an optional deadline
+"""
+
+import threading
+import time
+
+
+class GenerationCancelledException(Exception):
+    """
+    Exception raised if a generation job was cancelled or timed out
+    before the images were generated.
+    """
+    pass
+
+
+class CancellationToken:
+    """
+    Thread-safe cancellation flag shared between the request and the generation worker.
+
+    Args:
+        timeout_seconds (float): The token is cancelled automatically after this time, 0 = no timeout
+    """
+
+    def __init__(self, timeout_seconds: float = 0):
+        self._cancelled = threading.Event()
+        self._deadline = time.monotonic() + timeout_seconds if timeout_seconds > 0 else None
+        self.reason = None
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        if not self._cancelled.is_set() and self._deadline is not None and time.monotonic() > self._deadline:
+            self.cancel(reason="timeout")
+        return self._cancelled.is_set()
+
+    def raise_if_cancelled(self):
+        """
+        Raises:
+            GenerationCancelledException: If the token is cancelled or the timeout is reached
+        """
+        if self.is_cancelled:
+            raise GenerationCancelledException(f"Generation stopped ({self.reason})")
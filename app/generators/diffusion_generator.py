@@ -20,15 +20,11 @@ Dependencies:
     - typing: For type hints
 """
 
-from typing import List
-from PIL import Image
 from ..utils.singleton import singleton
-from .modelconfig import ModelConfig
 from .generation_params import GenerationParameters
 from .base_generator import BaseGenerator, ModelConfigException
 
 # AI STuff
-import torch
 from diffusers import StableDiffusionPipeline, StableDiffusionXLPipeline
 
 # Set up module logger
@@ -47,15 +43,15 @@ class StabelDiffusionGenerator(BaseGenerator):
     SDXL models. It supports loading models from local safetensor files or
     from Hugging Face, with automatic caching and memory optimization.
 
-    The class is implemented as a singleton to ensure only one instance of the
-    model is loaded in memory at any time.
+    The class is implemented as a singleton. The loaded pipelines are kept in
+    the shared PipelinePool, which limits how many models are resident at once.
 
     Attributes:
         modelconfig (ModelConfig): Configuration for the current model
         appconfig (AppConfig): Application-wide configuration
     """
 
-    def _load_model(self):
+    def _create_pipeline(self):
         """
         Load and configure the Stable Diffusion Pipeline for image generation.
 
@@ -63,7 +59,7 @@ class StabelDiffusionGenerator(BaseGenerator):
 
         This method handles the loading of different types of Stable Diffusion
         models (1.5 or SDXL) from either local safetensor files or Hugging Face.
-        It includes automatic model caching and memory optimization.
+        It includes memory optimization, caching is done by the PipelinePool.
 
         Returns:
             StableDiffusionPipeline or StableDiffusionXLPipeline: Configured pipeline
@@ -76,9 +72,6 @@ class StabelDiffusionGenerator(BaseGenerator):
             - Supports both .safetensors files and Hugging Face models
             - Automatically handles device placement and memory optimization
         """
-        if self._cached_generation_pipeline:
-            return self._cached_generation_pipeline
-
         try:
             modelpath = self.modelconfig.path
             logger.debug(f"Loading model {modelpath}, using cache '{self.appconfig.model_cache_dir}'")
@@ -134,7 +127,6 @@ class StabelDiffusionGenerator(BaseGenerator):
             # pipeline.enable_attention_slicing("auto")
             #
             logger.debug("Diffusion-Pipeline created")
-            self._cached_generation_pipeline = pipeline
             return pipeline
         except Exception as e:
             logger.error(f"Load Model failed. Error: {e}")
@@ -142,123 +134,62 @@ class StabelDiffusionGenerator(BaseGenerator):
             return None
             # raise Exception("Error while loading the pipeline for image conversion.\nSee logfile for details.")
 
-    def change_model(self, modelconfig: ModelConfig):
+    def _encode_prompt(self, pipeline, prompt: str, negative_prompt: str, clip_skip: int) -> dict:
         """
-        Change the current generation model to a new one.
-
-        This method safely unloads the current model and loads a new one
-        based on the provided configuration.
-
-        Args:
-            modelconfig (ModelConfig): Configuration for the new model
-
-        Raises:
-            Exception: If the modelconfig is not of type ModelConfig
-            Exception: If loading the new model fails
+        Encode the prompt and negative prompt with the CLIP text encoder(s).
+        The negative embeddings are always created, they are ignored by the pipeline without guidance.
         """
-        logger.info("Change generation model to %s", modelconfig)
-        if type(modelconfig) is not type(ModelConfig):
-            raise Exception("type of modelconfig must be ModelConfig")
-
-        try:
-            self.unload_model()
-            self.modelconfig = modelconfig
-            self._load_model()
-        except Exception as e:
-            logger.error(f"Error while changing text2img model: {e}")
-            raise (f"Loading new img2img model '{self.modelconfig.model}' failed", e)
+        # None keeps the pipeline default for empty negative prompts (zeros for SDXL)
+        negative_prompt = negative_prompt or None
+        if isinstance(pipeline, StableDiffusionXLPipeline):
+            prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds = pipeline.encode_prompt(
+                prompt=prompt,
+                device=pipeline._execution_device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=True,
+                negative_prompt=negative_prompt,
+                clip_skip=clip_skip,
+            )
+            return {
+                "prompt_embeds": prompt_embeds,
+                "negative_prompt_embeds": negative_prompt_embeds,
+                "pooled_prompt_embeds": pooled_prompt_embeds,
+                "negative_pooled_prompt_embeds": negative_pooled_prompt_embeds,
+            }
+
+        prompt_embeds, negative_prompt_embeds = pipeline.encode_prompt(
+            prompt=prompt,
+            device=pipeline._execution_device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=True,
+            negative_prompt=negative_prompt,
+            clip_skip=clip_skip,
+        )
+        return {"prompt_embeds": prompt_embeds, "negative_prompt_embeds": negative_prompt_embeds}
 
-    def generate_images(self, params: GenerationParameters, status_callback) -> List[Image.Image]:
+    def _prepare_generation_parameters(self, params: GenerationParameters) -> GenerationParameters:
         """
-        Generate images using the current Stable Diffusion model.
+        Adapt the parameters to the current Stable Diffusion model.
 
-        This method handles the complete image generation process, including:
-        - Parameter validation
-        - Model loading and verification
-        - Prompt preprocessing with embeddings
-        - Batch image generation
-        - Error handling and resource cleanup
+        Handles both SD 1.5 and SDXL model types and applies the positive
+        and negative embedding keywords.
 
         Args:
-            params (GenerationParameters): Parameters for image generation
-                including prompts, number of images, steps, etc.
+            params (GenerationParameters): Parameters requested by the user
 
         Returns:
-            List[Image.Image]: List of generated PIL Images
+            GenerationParameters: Parameters used for the pipeline call
+        """
+        if "1.5" in self.modelconfig.model_type.lower():
+            params = params.prepare_stablediffusion_std()
+        elif "sdxl" in self.modelconfig.model_type.lower():
+            params = params.prepare_stablediffusion_std()
 
-        Raises:
-            Exception: If no model is loaded or if generation fails
-            RuntimeError: If CUDA encounters memory issues
+        for embedding in self.modelconfig.embeddings["positive"]:
+            params.prompt = embedding.keyword + ", " + params.prompt
 
-        Notes:
-            - Handles both SD 1.5 and SDXL model types
-            - Automatically applies positive and negative embeddings
-            - Implements batch processing for multiple images
-            - Includes CUDA memory management
-            - Thread-safe execution using generation lock
-
-        Example:
-            ```python
-            generator = StabelDiffusionGenerator(...)
-            params = GenerationParameters(
-                prompt="a beautiful sunset",
-                num_images_per_prompt=1,
-                num_inference_steps=30
+        for embedding in self.modelconfig.embeddings["negative"]:
+            params.negative_prompt = (
+                embedding.keyword + ", " + params.negative_prompt
             )
-            images = generator.generate_images(params)
-            ```
-        """
-        logger.debug("starting image generation")
-        # Validate parameters and throw exceptions
-        params.validate()
-        if self.appconfig.NO_AI:
-            logger.warning("'no ai' - option is activated")
-            return self._create_test_image(params)
-
-        logger.debug(
-            f"start generating {params.num_images_per_prompt} images with {params.num_inference_steps} steps"
-        )
-        with self._generation_lock:
-            try:
-                current_pipeline = self._load_model()
-                if not current_pipeline:
-                    logger.error("No model loaded")
-                    raise Exception("No model loaded. Generation not available")
-
-                if "1.5" in self.modelconfig.model_type.lower():
-                    params = params.prepare_stablediffusion_std()
-                elif "sdxl" in self.modelconfig.model_type.lower():
-                    params = params.prepare_stablediffusion_std()
-
-                for embedding in self.modelconfig.embeddings["positive"]:
-                    params.prompt = embedding.keyword + ", " + params.prompt
-
-                for embedding in self.modelconfig.embeddings["negative"]:
-                    params.negative_prompt = (
-                        embedding.keyword + ", " + params.negative_prompt
-                    )
-
-                logger.debug(
-                    "Guidance: %f Strength: %f, Steps: %d",
-                    params.guidance_scale,
-                    params.strength,
-                    params.num_inference_steps,
-                )
-                result_images = []
-                imagecount = params.num_images_per_prompt
-                params.num_images_per_prompt = 1
-                for image in range(imagecount):
-                    # TODO : add yield
-                    if status_callback:
-                        status_callback(imagecount, image)
-                    result_images.append(current_pipeline(**params.to_dict()).images[0])
-                return result_images
-
-            except RuntimeError as e:
-                logger.error(f"Error while generating Images: {e}")
-                try:
-                    torch.cuda.empty_cache()
-                    self.unload_model()
-                except Exception as e:
-                    logger.debug(f"free cuda or unload model failed with {e}")
-                raise Exception("Internal error while creating the image.")
+        return params
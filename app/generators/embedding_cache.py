@@ -0,0 +1,94 @@
+"""
+Prompt Embedding Cache Module
+
+The text encoders (CLIP, and T5 for Flux) are executed for every generation, although
+the assistant, the examples and the styles produce many identical prompts. This module
+keeps the encoded prompt embeddings in an LRU cache with a byte budget, so repeated
+prompts skip the text encoders and the embeddings are handed over to the pipeline directly.
+
+Classes:
+    PromptEmbeddingCache: Singleton LRU cache of encoded prompts
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from ..utils.singleton import singleton
+
+import torch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@singleton
+class PromptEmbeddingCache:
+    """
+    LRU cache of prompt embeddings with a byte budget.
+
+    An entry is a dictionary of pipeline arguments (e.g. prompt_embeds, pooled_prompt_embeds)
+    for a single prompt. The key must contain everything which changes the embeddings,
+    e.g. (pipeline key, prompt, negative prompt, clip skip).
+
+    Args:
+        max_megabytes (float): Maximum size of all cached tensors, 0 = cache disabled
+        analytics (Analytics): Optional analytics instance to report hits and misses
+    """
+
+    CACHE_NAME = "prompt_embeddings"
+
+    def __init__(self, max_megabytes: float = 256, analytics=None):
+        logger.info(f"Initialize PromptEmbeddingCache with {max_megabytes} MB")
+        self.max_bytes = int(max_megabytes * 1024**2)
+        self.analytics = analytics
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Dict[str, torch.Tensor]]" = OrderedDict()
+        self._sizes: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> Optional[Dict[str, torch.Tensor]]:
+        """cached embeddings of the key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self.analytics:
+            self.analytics.record_cache_access(cache=self.CACHE_NAME, hit=entry is not None)
+        return entry
+
+    def put(self, key: tuple, embeddings: Dict[str, torch.Tensor]):
+        """store the embeddings, entries larger than the budget are not cached"""
+        size = sum(t.numel() * t.element_size() for t in embeddings.values() if isinstance(t, torch.Tensor))
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = embeddings
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+            while self.used_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._entries.pop(oldest)
+                self._sizes.pop(oldest)
+            used_bytes, entries = self.used_bytes, len(self._entries)
+        if self.analytics:
+            self.analytics.update_cache_size(cache=self.CACHE_NAME, size_bytes=used_bytes, entries=entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
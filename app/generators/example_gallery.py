@@ -0,0 +1,148 @@
+"""
+Example Gallery Module
+
+The examples of the UI are rendered offline by tools/render_examples.py with fixed seeds.
+This module reads and writes the manifest of these pre-rendered images, so the Examples
+tab can show the thumbnails and return the images without any GPU work.
+
+Layout of the gallery directory:
+    manifest.json                  examples per model name
+    <model folder>/<example>-0.png full size images
+    <model folder>/<example>.jpg   thumbnail of the first image
+
+Classes:
+    ExampleGallery: Manifest of the pre-rendered examples
+
+Functions:
+    load_examples: Examples of a model from the modelconfig or the examples file
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Tuple
+from PIL import Image
+from .modelconfig import ModelConfig
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def load_examples(modelconfig: ModelConfig, examples_file: str = "./msgs/examples.json") -> List[list]:
+    """examples of the modelconfig, if it has none the examples from the file are used"""
+    if len(modelconfig.examples) > 0:
+        logger.info("Initialized examples from modelconfig")
+        return modelconfig.examples
+    examples = []
+    if os.path.exists(examples_file):
+        with open(examples_file, "r") as f:
+            examples = json.load(f)
+    logger.info(f"Initialized examples from '{examples_file}'")
+    return examples
+
+
+class ExampleGallery:
+    """
+    Pre-rendered example images per model.
+
+    Args:
+        directory (str): Folder of the manifest and the images
+
+    Notes:
+        - A missing or broken manifest results in an empty gallery, the UI falls back to the prompt examples
+        - Image paths in the manifest are relative to the directory
+    """
+
+    MANIFEST_FILENAME = "manifest.json"
+    THUMBNAIL_SIZE = 256
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.models: Dict[str, dict] = {}
+        self.load()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, self.MANIFEST_FILENAME)
+
+    def load(self):
+        """read the manifest, the gallery is empty if it doesn't exist"""
+        self.models = {}
+        if not os.path.exists(self.manifest_path):
+            logger.debug(f"No example gallery found in '{self.directory}'")
+            return
+        try:
+            with open(self.manifest_path, "r") as f:
+                self.models = json.load(f).get("models", {})
+            logger.info(f"Loaded example gallery with {sum(len(m['examples']) for m in self.models.values())} examples")
+        except Exception as e:
+            logger.error(f"Error while loading example gallery '{self.manifest_path}': {e}")
+            self.models = {}
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"models": self.models}, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def examples(self, model: str) -> List[dict]:
+        return self.models.get(model, {}).get("examples", [])
+
+    def thumbnails(self, model: str) -> List[Tuple[str, str]]:
+        """(thumbnail path, prompt) of every example of the model, used as gallery value"""
+        return [(self._absolute(example["thumbnail"]), example["prompt"]) for example in self.examples(model)]
+
+    def images(self, model: str, index: int) -> List[str]:
+        """paths of the full size images of an example"""
+        examples = self.examples(model)
+        if index < 0 or index >= len(examples):
+            return []
+        return [self._absolute(path) for path in examples[index]["images"]]
+
+    def add_example(self, model: str, generation: dict, images: List[Image.Image]) -> dict:
+        """
+        Store the images of an example and add it to the manifest of the model.
+        An existing example with the same prompt is replaced.
+
+        Args:
+            model (str): Model name as used in the modelconfig
+            generation (dict): Generation details, at least the 'prompt'
+            images (List[Image.Image]): Rendered images of the example
+
+        Returns:
+            dict: The manifest entry of the example
+        """
+        folder = self._model_folder(model)
+        os.makedirs(os.path.join(self.directory, folder), exist_ok=True)
+        name = hashlib.sha1(generation["prompt"].encode("utf-8")).hexdigest()[:12]
+
+        image_paths = []
+        for index, image in enumerate(images):
+            path = os.path.join(folder, f"{name}-{index}.png")
+            image.save(self._absolute(path), format="PNG")
+            image_paths.append(path)
+
+        thumbnail = images[0].copy()
+        thumbnail.thumbnail((self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE))
+        thumbnail_path = os.path.join(folder, f"{name}.jpg")
+        thumbnail.convert("RGB").save(self._absolute(thumbnail_path), format="JPEG", quality=85)
+
+        example = dict(generation, images=image_paths, thumbnail=thumbnail_path)
+        examples = self.models.setdefault(model, {"examples": []})["examples"]
+        for index, existing in enumerate(examples):
+            if existing["prompt"] == example["prompt"]:
+                examples[index] = example
+                break
+        else:
+            examples.append(example)
+        return example
+
+    def _model_folder(self, model: str) -> str:
+        """file system safe folder name of the model"""
+        return re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+
+    def _absolute(self, path: str) -> str:
+        return os.path.join(self.directory, path)
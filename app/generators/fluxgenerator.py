@@ -21,10 +21,7 @@ Dependencies:
     - typing: For type hints
 """
 
-from typing import List
-from PIL import Image
 from ..utils.singleton import singleton
-from .modelconfig import ModelConfig
 from .generation_params import GenerationParameters
 from .base_generator import BaseGenerator, ModelConfigException
 
@@ -47,21 +44,20 @@ class FluxGenerator(BaseGenerator):
     model configurations and optimizations. It handles model loading, caching,
     and generation with specific parameter adjustments for different Flux variants.
 
-    The class is implemented as a singleton to ensure only one instance of the
-    model is loaded in memory at any time.
+    The class is implemented as a singleton. The loaded pipelines are kept in
+    the shared PipelinePool, which limits how many models are resident at once.
 
     Attributes:
         modelconfig (ModelConfig): Configuration for the current model
         appconfig (AppConfig): Application-wide configuration
     """
 
-    def _load_model(self):
+    def _create_pipeline(self):
         """
         Load and configure the Flux Pipeline for image generation.
 
         This method handles the loading of Flux models from either local safetensor
-        files or remote sources. It includes automatic model caching and applies
-        appropriate memory optimizations.
+        files or remote sources and applies appropriate memory optimizations.
         it is required that the self.modelconfig is proper set
 
         Returns:
@@ -75,12 +71,9 @@ class FluxGenerator(BaseGenerator):
             - Supports .safetensors files with from_single_file loading
             - Handles remote model loading via from_pretrained
             - Automatically configures device mapping and data types
-            - Implements caching for improved performance
+            - Caching is done by the PipelinePool
 
         """
-        if self._cached_generation_pipeline:
-            return self._cached_generation_pipeline
-
         try:
             modelpath = self.modelconfig.path
             logger.debug(f"Loading model {modelpath}, using cache '{self.appconfig.model_cache_dir}'")
@@ -124,7 +117,6 @@ class FluxGenerator(BaseGenerator):
             self._memory_optimization(pipeline)
 
             logger.debug("Flux-Pipeline created")
-            self._cached_generation_pipeline = pipeline
             return pipeline
         except Exception as e:
             logger.error(f"Load Model failed. Error: {e}")
@@ -132,119 +124,46 @@ class FluxGenerator(BaseGenerator):
             return None
             # raise Exception("Error while loading the pipeline for image conversion.\nSee logfile for details.")
 
-    def change_model(self, modelconfig: ModelConfig):
+    def _encode_prompt(self, pipeline, prompt: str, negative_prompt: str, clip_skip: int) -> dict:
         """
-        Change the current generation model to a new one.
-
-        Safely unloads the current model and loads a new one based on the
-        provided configuration.
-
-        Args:
-            modelconfig (ModelConfig): Configuration for the new model
-
-        Raises:
-            Exception: If the modelconfig is invalid or loading fails
+        Encode the prompt with the CLIP and T5 text encoders.
+        The negative prompt is not encoded, it is only used by flux with true cfg.
         """
-        logger.info("Change generation model to %s", modelconfig)
-        if type(modelconfig) is not type(ModelConfig):
-            raise Exception("type of modelconfig must be ModelConfig")
+        prompt_embeds, pooled_prompt_embeds, _ = pipeline.encode_prompt(
+            prompt=prompt,
+            prompt_2=None,
+            device=pipeline._execution_device,
+            num_images_per_prompt=1,
+        )
+        return {"prompt_embeds": prompt_embeds, "pooled_prompt_embeds": pooled_prompt_embeds}
 
-        try:
-            self.unload_model()
-            self.modelconfig = modelconfig
-            self._load_model()
-        except Exception as e:
-            logger.error(f"Error while changing text2img model: {e}")
-            raise (f"Loading new img2img model '{self.modelconfig.model}' failed", e)
+    def _unpack_latents(self, pipeline, latents: torch.Tensor, width: int, height: int) -> torch.Tensor:
+        """flux packs 2x2 latent patches into the sequence dimension"""
+        return pipeline._unpack_latents(latents, height, width, pipeline.vae_scale_factor)
 
-    def generate_images(self, params: GenerationParameters, status_callback) -> List[Image.Image]:
+    def _prepare_generation_parameters(self, params: GenerationParameters) -> GenerationParameters:
         """
-        Generate images using the current Flux model.
+        Adapt the parameters to the current Flux model.
 
-        Handles the complete image generation process with specific adjustments
-        for different Flux model variants (dev, schnell). Includes parameter
-        validation, model loading, and embedding processing.
+        Applies the positive and negative embedding keywords and the specific
+        adjustments for the Flux model variants (dev, schnell).
 
         Args:
-            params (GenerationParameters): Parameters for image generation
-                including prompts, number of images, steps, etc.
+            params (GenerationParameters): Parameters requested by the user
 
         Returns:
-            ListImage.Imageof generated PIL Images
-
-        Raises:
-            Exception: If no model is loaded or if generation fails
-            RuntimeError: If CUDA encounters memory issues
+            GenerationParameters: Parameters used for the pipeline call
+        """
+        for embedding in self.modelconfig.embeddings["positive"]:
+            params.prompt = embedding.keyword + ", " + params.prompt
 
-        Notes:
-            - Automatically applies positive and negative embeddings
-            - Supports special handling for 'dev' and 'schnell' model variants
-            - Implements batch processing for multiple images
-            - Thread-safe execution using generation lock
-            - Handles NO_AI testing mode
-
-        Example:
-            ```python
-            generator = FluxGenerator(...)
-            params = GenerationParameters(
-                prompt="an artistic landscape",
-                num_images_per_prompt=1,
-                num_inference_steps=30
+        for embedding in self.modelconfig.embeddings["negative"]:
+            params.negative_prompt = (
+                embedding.keyword + ", " + params.negative_prompt
             )
-            images = generator.generate_images(params)
-            ```
-        """
-        logger.debug("starting image generation")
-        # Validate parameters and throw exceptions
-        params.validate()
-        if self.appconfig.NO_AI:
-            logger.warning("'no ai' - option is activated")
-            return self._create_test_image(params)
-
-        logger.debug(
-            f"start generating {params.num_images_per_prompt} images with {params.num_inference_steps} steps"
-        )
-        with self._generation_lock:
-            try:
-                current_pipeline = self._load_model()
-                if not current_pipeline:
-                    logger.error("No model loaded")
-                    raise Exception("No model loaded. Generation not available")
-
-                for embedding in self.modelconfig.embeddings["positive"]:
-                    params.prompt = embedding.keyword + ", " + params.prompt
-
-                for embedding in self.modelconfig.embeddings["negative"]:
-                    params.negative_prompt = (
-                        embedding.keyword + ", " + params.negative_prompt
-                    )
-
-                if "dev" in self.modelconfig.path.lower():
-                    params = params.prepare_flux_dev()
-                elif "schnell" in self.modelconfig.path.lower():
-                    params = params.prepare_flux_schnell()
-
-                logger.debug(
-                    "Guidance: %f Strength: %f, Steps: %d",
-                    params.guidance_scale,
-                    params.strength,
-                    params.num_inference_steps,
-                )
-                result_images = []
-                imagecount = params.num_images_per_prompt
-                params.num_images_per_prompt = 1
-                for image in range(imagecount):
-                    # TODO : add yield
-                    result_images.append(current_pipeline(**params.to_dict()).images[0])
-                    if status_callback:
-                        status_callback(imagecount, image)
-                return result_images
-
-            except RuntimeError as e:
-                logger.error(f"Error while generating Images: {e}")
-                try:
-                    torch.cuda.empty_cache()
-                    self.unload_model()
-                except Exception as e:
-                    logger.debug(f"free cuda or unload model failed with {e}")
-                raise Exception("Internal error while creating the image.")
+
+        if "dev" in self.modelconfig.path.lower():
+            params = params.prepare_flux_dev()
+        elif "schnell" in self.modelconfig.path.lower():
+            params = params.prepare_flux_schnell()
+        return params
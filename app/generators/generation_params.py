@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from typing import Optional, List, Union
 from PIL import Image
+import random
 import warnings
 
 import torch
@@ -111,12 +112,48 @@ class GenerationParameters:
 
         return params
 
+    def batch_key(self) -> Optional[tuple]:
+        """
+        Returns the values which must be identical to generate images of different
+        requests in one batched pipeline call. None if the request can't be batched.
+        """
+        if self.image is not None or self.mask_image is not None:
+            return None
+        return (self.width, self.height, self.num_inference_steps, self.guidance_scale, self.clip_skip)
+
+    @classmethod
+    def to_batch_dict(cls, params_list: List['GenerationParameters']) -> dict:
+        """
+        Combine compatible parameters to one dictionary for a batched pipeline input.
+
+        Every requested image becomes one entry in the prompt list with its own generator.
+        Seeded requests use seed, seed+1, ... so the result does not depend on the batch.
+        """
+        params = params_list[0].to_dict()
+        prompts = []
+        negative_prompts = []
+        generators = []
+        for p in params_list:
+            for i in range(p.num_images_per_prompt):
+                prompts.append(p.prompt)
+                negative_prompts.append(p.negative_prompt or "")
+                seed = p.seed + i if p.seed is not None else random.randrange(2**32)
+                generators.append(torch.Generator().manual_seed(seed))
+
+        params["prompt"] = prompts
+        params["num_images_per_prompt"] = 1
+        params["generator"] = generators
+        params.pop("negative_prompt", None)
+        if any(negative_prompts):
+            params["negative_prompt"] = negative_prompts
+        return params
+
     def prepare_flux_schnell(self) -> 'GenerationParameters':
         """
         Adjusts parameters specifically for FLUX-SCHNELL model.
         Returns a new FluxParameters instance with optimized settings.
         """
-        params = GenerationParameters(**self.to_dict())  # Create a copy
+        params = GenerationParameters(**self.__dict__)  # Create a copy
 
         # Enforce FLUX-SCHNELL specific constraints
         if params.num_inference_steps > 10:
@@ -0,0 +1,34 @@
+"""
+Generator Factory Module
+
+Selects the generator implementation for a model configuration. As the generators
+are singletons and the pipelines are kept in the PipelinePool, switching between
+models of the same type is just a change of the model configuration.
+"""
+
+from ..appconfig import AppConfig
+from .modelconfig import ModelConfig
+from .base_generator import BaseGenerator
+from .fluxgenerator import FluxGenerator
+from .diffusion_generator import StabelDiffusionGenerator
+
+
+def get_generator(appconfig: AppConfig, modelconfig: ModelConfig) -> BaseGenerator:
+    """
+    Returns the generator for the model type, switched to the given model configuration.
+
+    Args:
+        appconfig (AppConfig): Application configuration instance
+        modelconfig (ModelConfig): resolved model configuration
+
+    Returns:
+        BaseGenerator: FluxGenerator or StabelDiffusionGenerator
+    """
+    if "flux" in modelconfig.model_type.lower():
+        generator = FluxGenerator(appconfig=appconfig, modelconfig=modelconfig)
+    else:
+        generator = StabelDiffusionGenerator(appconfig=appconfig, modelconfig=modelconfig)
+
+    if generator.modelconfig is not modelconfig:
+        generator.change_model(modelconfig)
+    return generator
@@ -0,0 +1,91 @@
+"""
+Latent Preview Module
+
+Cheap previews of intermediate latents while the denoising loop is running. Instead
+of the full VAE, the latent channels are projected to RGB with a fixed linear
+approximation (latent2rgb). The preview has the resolution of the latent space,
+which is 1/8 of the final image.
+
+The factors are the widely used approximations for the latent spaces of
+Stable Diffusion 1.5, SDXL and Flux.
+"""
+
+from typing import List, Optional
+from PIL import Image
+
+import torch
+import logging
+
+logger = logging.getLogger(__name__)
+
+# RGB projection (channels x 3) and bias per latent space
+LATENT_RGB_FACTORS = {
+    "sd1.5": (
+        [[0.3512, 0.2297, 0.3227],
+         [0.3250, 0.4974, 0.2350],
+         [-0.2829, 0.1762, 0.2721],
+         [-0.2120, -0.2616, -0.7177]],
+        None
+    ),
+    "sdxl": (
+        [[0.3651, 0.4232, 0.4341],
+         [-0.2533, -0.0042, 0.1068],
+         [0.1076, 0.1111, -0.0362],
+         [-0.3165, -0.2492, -0.2188]],
+        [0.1084, -0.0175, -0.0011]
+    ),
+    "flux": (
+        [[-0.0346, 0.0244, 0.0681],
+         [0.0034, 0.0210, 0.0687],
+         [0.0275, -0.0668, -0.0433],
+         [-0.0174, 0.0160, 0.0617],
+         [0.0859, 0.0721, 0.0329],
+         [0.0004, 0.0383, 0.0115],
+         [0.0405, 0.0861, 0.0915],
+         [-0.0236, -0.0185, -0.0259],
+         [-0.0245, 0.0250, 0.1180],
+         [0.1008, 0.0755, -0.0421],
+         [-0.0515, 0.0201, 0.0011],
+         [0.0428, -0.0012, -0.0036],
+         [0.0817, 0.0765, 0.0749],
+         [-0.1264, -0.0522, -0.1103],
+         [-0.0280, -0.0881, -0.0499],
+         [-0.1262, -0.0982, -0.0778]],
+        [-0.0329, -0.0718, -0.0851]
+    ),
+}
+
+
+def get_latent_format(model_type: str) -> Optional[str]:
+    """latent space of the model type, None if no approximation is known"""
+    model_type = model_type.lower()
+    if "flux" in model_type:
+        return "flux"
+    if "sdxl" in model_type:
+        return "sdxl"
+    if "1.5" in model_type:
+        return "sd1.5"
+    return None
+
+
+def latents_to_images(latents: torch.Tensor, latent_format: str) -> List[Image.Image]:
+    """
+    Convert a batch of latents (B, C, H, W) to RGB preview images.
+
+    Args:
+        latents (torch.Tensor): unpacked latents of the denoising loop
+        latent_format (str): key of LATENT_RGB_FACTORS
+
+    Returns:
+        List[Image.Image]: one preview per latent in the size of the latent space
+    """
+    factors, bias = LATENT_RGB_FACTORS[latent_format]
+    weight = torch.tensor(factors, dtype=torch.float32, device=latents.device)
+    if weight.shape[0] != latents.shape[1]:
+        raise ValueError(f"latents with {latents.shape[1]} channels don't match the '{latent_format}' format")
+
+    rgb = torch.einsum("bchw,cr->bhwr", latents.float(), weight)
+    if bias is not None:
+        rgb = rgb + torch.tensor(bias, dtype=torch.float32, device=latents.device)
+    rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).to(torch.uint8).cpu().numpy()
+    return [Image.fromarray(image) for image in rgb]
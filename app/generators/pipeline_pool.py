@@ -0,0 +1,352 @@
+"""
+Pipeline Pool Module
+
+This module keeps multiple diffusion pipelines resident in memory at the same time.
+Instead of one cached pipeline per generator, which must be unloaded before another
+model can be loaded, all pipelines are stored in one pool keyed by the resolved
+model configuration. If the pool exceeds the configured amount of models or the
+memory budget, the least recently used pipeline is evicted.
+
+Idle pipelines are not thrown away, but moved to cheaper storage tiers:
+    device (GPU) -> pinned CPU memory -> safetensors file on local disk
+The next request promotes the pipeline back to the device, which is much faster
+than loading it again with from_pretrained / from_single_file.
+
+Classes:
+    Residency: Storage tier of a pooled pipeline
+    PooledPipeline: A pipeline in the pool with its usage information
+    PipelinePool: Singleton LRU pool of loaded pipelines
+"""
+
+import gc
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Callable, List
+from safetensors import safe_open
+from safetensors.torch import save_file
+from ..utils.singleton import singleton
+from .modelconfig import ModelConfig
+
+import torch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_pipeline_bytes(pipeline) -> int:
+    """Sum of all parameters and buffers of the torch modules in the pipeline"""
+    size = 0
+    try:
+        for component in getattr(pipeline, "components", {}).values():
+            if isinstance(component, torch.nn.Module):
+                size += sum(p.numel() * p.element_size() for p in component.parameters())
+                size += sum(b.numel() * b.element_size() for b in component.buffers())
+    except Exception as e:
+        logger.warning(f"Could not estimate pipeline size: {e}")
+    return size
+
+
+def _unique_tensors(module: torch.nn.Module) -> dict:
+    """parameters and buffers of the module, tied weights are returned only once"""
+    tensors = dict(module.named_parameters())
+    tensors.update(dict(module.named_buffers()))
+    return tensors
+
+
+class Residency(Enum):
+    """Storage tier of a pooled pipeline, ordered from fast to cheap"""
+    DEVICE = "device"
+    CPU = "cpu"
+    DISK = "disk"
+
+
+class PooledPipeline:
+    """
+    A pipeline stored in the PipelinePool.
+
+    Attributes:
+        key (str): Pool key of the pipeline
+        model (str): Name of the model from the modelconfig
+        pipeline: The diffusers pipeline
+        size_bytes (int): Estimated memory used by the pipeline
+        device (str): Device used for generation, None if the pipeline can't be moved (e.g. cpu offload hooks)
+        residency (Residency): Current storage tier of the weights
+        last_used (datetime): Last time the pipeline was requested or a generation with it ended
+        in_use (int): Generations currently running with the pipeline, busy pipelines are not offloaded
+    """
+
+    def __init__(self, key: str, model: str, pipeline, size_bytes: int, device: str = None):
+        self.key = key
+        self.model = model
+        self.pipeline = pipeline
+        self.size_bytes = size_bytes
+        self.device = device
+        self.residency = Residency.DEVICE
+        self.last_used = datetime.now()
+        self.in_use = 0
+
+    @property
+    def modules(self) -> dict:
+        """torch modules of the pipeline by component name"""
+        return {name: component for name, component in getattr(self.pipeline, "components", {}).items()
+                if isinstance(component, torch.nn.Module)}
+
+
+@singleton
+class PipelinePool:
+    """
+    LRU pool of loaded diffusion pipelines shared by all generators.
+
+    Args:
+        max_models (int): Maximum amount of pooled pipelines
+        memory_budget_gb (float): Maximum estimated memory of all pipelines in memory, 0 = no limit
+        offload_directory (str): Folder for the weights of pipelines offloaded to disk, None = no disk tier
+
+    Notes:
+        - The most recently loaded pipeline is never evicted, even if it exceeds the budget alone
+        - Pipelines checked out by a running generation are never evicted or offloaded
+        - Thread-safe, loading, offloading and promotion are done while holding the pool lock
+        - Pipelines offloaded to disk are not counted in the memory budget
+    """
+
+    def __init__(self, max_models: int = 1, memory_budget_gb: float = 0, offload_directory: str = None):
+        logger.info(f"Initialize PipelinePool for {max_models} model(s) with a budget of {memory_budget_gb} GB")
+        self.max_models = max(1, max_models)
+        self.memory_budget_bytes = int(memory_budget_gb * 1024**3)
+        self.offload_directory = offload_directory
+        self._pipelines: "OrderedDict[str, PooledPipeline]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def key_for(cls, modelconfig: ModelConfig) -> str:
+        """pipelines are identical if type, path and loaded embeddings are identical"""
+        embeddings = [e.source for e in modelconfig.embeddings.get("positive", []) + modelconfig.embeddings.get("negative", [])]
+        return "|".join([modelconfig.model_type.lower(), modelconfig.path] + embeddings)
+
+    def contains(self, modelconfig: ModelConfig) -> bool:
+        return self.key_for(modelconfig) in self._pipelines
+
+    @property
+    def resident_models(self) -> List[str]:
+        """model names of all resident pipelines, least recently used first"""
+        return [p.model for p in self._pipelines.values()]
+
+    @property
+    def used_bytes(self) -> int:
+        """estimated memory of all pipelines not offloaded to disk"""
+        return sum(p.size_bytes for p in self._pipelines.values() if p.residency != Residency.DISK)
+
+    def residency_of(self, modelconfig: ModelConfig) -> Residency:
+        """storage tier of the pipeline, None if not in the pool"""
+        entry = self._pipelines.get(self.key_for(modelconfig))
+        return entry.residency if entry else None
+
+    def get_or_load(self, modelconfig: ModelConfig, loader: Callable, device: str = None, checkout: bool = False):
+        """
+        Returns the pipeline for the model configuration, loads it if not in the pool
+        and promotes it back to the device if it was offloaded.
+
+        Args:
+            modelconfig (ModelConfig): resolved model configuration
+            loader (Callable): function without arguments, returning the new pipeline or None
+            device (str): device of the pipeline, None disables offloading for this pipeline
+            checkout (bool): mark the pipeline as in use until checkin(), it's not offloaded meanwhile
+
+        Returns:
+            The pipeline or None if loading failed
+        """
+        key = self.key_for(modelconfig)
+        with self._lock:
+            entry = self._pipelines.get(key)
+            if entry:
+                self._pipelines.move_to_end(key)
+                entry.last_used = datetime.now()
+                if checkout:
+                    entry.in_use += 1
+                if entry.residency != Residency.DEVICE:
+                    self._promote(entry)
+                    self._evict()
+                return entry.pipeline
+
+            logger.info(f"Pipeline for '{modelconfig.model}' is not resident. Loading it.")
+            # free memory before loading if the pool is already full
+            self._evict(reserve_slot=True)
+            pipeline = loader()
+            if pipeline is None:
+                return None
+
+            entry = PooledPipeline(key=key, model=modelconfig.model, pipeline=pipeline,
+                                   size_bytes=estimate_pipeline_bytes(pipeline), device=device)
+            if checkout:
+                entry.in_use += 1
+            self._pipelines[key] = entry
+            logger.info(f"Pipeline '{modelconfig.model}' added to pool ({entry.size_bytes / 1024**3:.2f} GB)")
+            self._evict()
+            return pipeline
+
+    def checkin(self, modelconfig: ModelConfig):
+        """end the use of a pipeline checked out with get_or_load, the idle time starts now"""
+        with self._lock:
+            entry = self._pipelines.get(self.key_for(modelconfig))
+            if entry:
+                entry.in_use = max(0, entry.in_use - 1)
+                entry.last_used = datetime.now()
+
+    def unload(self, modelconfig: ModelConfig):
+        """remove the pipeline of the model configuration from the pool"""
+        with self._lock:
+            key = self.key_for(modelconfig)
+            if key in self._pipelines:
+                self._remove(key)
+                self._free_memory()
+
+    def unload_all(self):
+        """remove all pipelines from the pool"""
+        with self._lock:
+            for key in list(self._pipelines.keys()):
+                self._remove(key)
+            self._free_memory()
+
+    def offload_idle(self, cpu_after_minutes: int, disk_after_minutes: int = -1):
+        """
+        Move idle pipelines to the next cheaper storage tier. Idle pipelines which can't be
+        moved (device None, e.g. cpu offload hooks) are unloaded instead.
+
+        Args:
+            cpu_after_minutes (int): idle minutes before a pipeline is moved from the device to pinned CPU memory
+            disk_after_minutes (int): additional idle minutes before it is moved to disk, negative = no disk tier
+        """
+        now = datetime.now()
+        with self._lock:
+            offloaded = False
+            for entry in list(self._pipelines.values()):
+                # a running generation must not lose its weights
+                if entry.in_use > 0:
+                    continue
+                idle = now - entry.last_used
+                if entry.device is None:
+                    if idle >= timedelta(minutes=cpu_after_minutes):
+                        logger.info(f"Unload idle pipeline '{entry.model}', it can't be offloaded")
+                        self._remove(entry.key)
+                        offloaded = True
+                    continue
+                if entry.residency == Residency.DEVICE and idle >= timedelta(minutes=cpu_after_minutes):
+                    offloaded = True
+                    if not self._offload_to_cpu(entry):
+                        continue
+                if entry.residency == Residency.CPU and disk_after_minutes >= 0 and self.offload_directory \
+                        and idle >= timedelta(minutes=cpu_after_minutes + disk_after_minutes):
+                    self._offload_to_disk(entry)
+                    offloaded = True
+            if offloaded:
+                self._free_memory()
+
+    def _offload_to_cpu(self, entry: PooledPipeline) -> bool:
+        """True if the pipeline is in CPU memory, it's removed from the pool if the move failed"""
+        logger.info(f"Offload idle pipeline '{entry.model}' to CPU memory")
+        if entry.device == "cpu":
+            entry.residency = Residency.CPU
+            return True
+        try:
+            entry.pipeline.to("cpu")
+        except Exception as e:
+            # the weights may be partially moved, the pipeline is loaded again with the next request
+            logger.warning(f"Offloading pipeline '{entry.model}' to CPU failed, it's removed from the pool: {e}")
+            self._remove(entry.key)
+            return False
+        entry.residency = Residency.CPU
+        if torch.cuda.is_available():
+            try:
+                # page locked memory allows a faster transfer back to the GPU
+                for module in entry.modules.values():
+                    for tensor in _unique_tensors(module).values():
+                        tensor.data = tensor.data.pin_memory()
+            except Exception as e:
+                logger.warning(f"Pinning the memory of pipeline '{entry.model}' failed, it stays in pageable CPU memory: {e}")
+        return True
+
+    def _offload_to_disk(self, entry: PooledPipeline):
+        logger.info(f"Offload idle pipeline '{entry.model}' to disk")
+        folder = self._offload_folder(entry)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            for name, module in entry.modules.items():
+                tensors = {k: t.detach().contiguous() for k, t in _unique_tensors(module).items()}
+                save_file(tensors, os.path.join(folder, f"{name}.safetensors"))
+            # release the weights, the parameter objects stay in place (incl. tied weights)
+            for module in entry.modules.values():
+                for tensor in _unique_tensors(module).values():
+                    tensor.data = torch.empty(0, dtype=tensor.dtype)
+            entry.residency = Residency.DISK
+        except Exception as e:
+            logger.warning(f"Offloading pipeline '{entry.model}' to disk failed, it stays in CPU memory: {e}")
+
+    def _promote(self, entry: PooledPipeline):
+        """move the pipeline back to its device"""
+        started = datetime.now()
+        if entry.residency == Residency.DISK:
+            folder = self._offload_folder(entry)
+            for name, module in entry.modules.items():
+                # memory mapped file, tensors are read directly to the target device
+                with safe_open(os.path.join(folder, f"{name}.safetensors"), framework="pt", device=entry.device) as file:
+                    for k, tensor in _unique_tensors(module).items():
+                        tensor.data = file.get_tensor(k)
+            self._delete_offload_files(entry)
+        if entry.device != "cpu":
+            entry.pipeline.to(entry.device)
+        logger.info(f"Pipeline '{entry.model}' promoted from {entry.residency.value} to {entry.device} "
+                    f"in {(datetime.now() - started).total_seconds():.1f}s")
+        entry.residency = Residency.DEVICE
+
+    def _offload_folder(self, entry: PooledPipeline) -> str:
+        return os.path.join(self.offload_directory, hashlib.sha1(entry.key.encode()).hexdigest())
+
+    def _delete_offload_files(self, entry: PooledPipeline):
+        folder = self._offload_folder(entry)
+        try:
+            for file in os.listdir(folder):
+                os.remove(os.path.join(folder, file))
+            os.rmdir(folder)
+        except Exception as e:
+            logger.debug(f"removing offloaded pipeline files failed with {e}")
+
+    def _over_budget(self, reserve_slot: bool = False) -> bool:
+        count = len(self._pipelines) + (1 if reserve_slot else 0)
+        if count > self.max_models:
+            return True
+        return self.memory_budget_bytes > 0 and self.used_bytes > self.memory_budget_bytes
+
+    def _evict(self, reserve_slot: bool = False):
+        evicted = False
+        # keep at least the most recently used pipeline, unless a new one will be loaded
+        while self._over_budget(reserve_slot) and len(self._pipelines) > (0 if reserve_slot else 1):
+            # pipelines of running generations are kept, even if the budget is exceeded
+            candidates = list(self._pipelines.keys())[:len(self._pipelines) - (0 if reserve_slot else 1)]
+            key = next((k for k in candidates if self._pipelines[k].in_use == 0), None)
+            if key is None:
+                logger.warning("Pipeline pool exceeds its budget, all other pipelines are in use")
+                break
+            logger.info(f"Evict least recently used pipeline '{self._pipelines[key].model}' from pool")
+            self._remove(key)
+            evicted = True
+        if evicted:
+            self._free_memory()
+
+    def _remove(self, key: str):
+        entry = self._pipelines.pop(key)
+        if entry.residency == Residency.DISK:
+            self._delete_offload_files(entry)
+        entry.pipeline = None
+        del entry
+
+    def _free_memory(self):
+        try:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except Exception as e:
+            logger.debug(f"free memory failed with {e}")
@@ -0,0 +1,132 @@
+"""
+Model Preloader Module
+
+This module loads the selected pipeline in a background thread at server start,
+while Gradio is already serving the UI. After loading, a short warmup generation is
+executed for every resolution of the model, so CUDA kernels and the allocator pools
+are initialized before the first user request arrives.
+
+The preloader holds an event which gates the GenerationScheduler. Generation requests
+are queued until the preload is finished instead of racing it for the generator.
+
+Classes:
+    ReadinessState: Lifecycle of the preload
+    ModelPreloader: Singleton background preloader and warmup of the generator
+"""
+
+import threading
+from datetime import datetime
+from enum import Enum
+from typing import List, Tuple
+from ..utils.singleton import singleton
+from .generation_params import GenerationParameters
+from .modelconfig import ModelConfig
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessState(Enum):
+    """Lifecycle of the model preload"""
+    COLD = "cold"
+    LOADING = "loading"
+    WARMING = "warming"
+    READY = "ready"
+    FAILED = "failed"
+
+
+@singleton
+class ModelPreloader:
+    """
+    Loads and warms up the model of the generator in a background thread.
+
+    Args:
+        generator (BaseGenerator): Generator which model is loaded
+        warmup_steps (int): Inference steps of the warmup generations, 0 = only load the model
+        analytics (Analytics): Optional analytics instance to report the readiness
+
+    Notes:
+        - If the preload fails, the gate is opened anyway and the model is loaded by the first request
+        - The warmup images are discarded
+    """
+
+    WARMUP_PROMPT = "a photo of a cat"
+
+    def __init__(self, generator, warmup_steps: int = 2, analytics=None):
+        self.generator = generator
+        self.warmup_steps = max(0, warmup_steps)
+        self.analytics = analytics
+        self.state = ReadinessState.COLD
+        self.ready_event = threading.Event()
+        self._thread: threading.Thread = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self.ready_event.is_set()
+
+    def start(self):
+        """start the preload in a background thread, further calls are ignored"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._preload, name="model-preloader", daemon=True)
+        self._thread.start()
+
+    def skip(self):
+        """open the gate without preloading, the model is loaded by the first request"""
+        logger.info("Model preload is turned off")
+        self._set_state(ReadinessState.READY)
+        self.ready_event.set()
+
+    def wait_until_ready(self, timeout: float = None) -> bool:
+        """Block until the preload is finished. Returns False if the timeout is reached before."""
+        return self.ready_event.wait(timeout)
+
+    def _preload(self):
+        started = datetime.now()
+        try:
+            self._set_state(ReadinessState.LOADING)
+            logger.info(f"Preloading model '{self.generator.modelconfig.model}'")
+            self.generator.warmup()
+
+            if self.warmup_steps > 0:
+                self._set_state(ReadinessState.WARMING)
+                modelconfig = self.generator.modelconfig
+                for width, height in self._get_resolutions(modelconfig):
+                    logger.debug(f"Warmup generation with {width}x{height}")
+                    # same guidance as the user requests, so the same (e.g. classifier free guidance) kernels are used
+                    self.generator.generate_images(
+                        params=GenerationParameters(
+                            prompt=self.WARMUP_PROMPT,
+                            negative_prompt="",
+                            num_inference_steps=self.warmup_steps,
+                            guidance_scale=float(modelconfig.generation.get("guidance", 1)),
+                            width=width,
+                            height=height,
+                            seed=0
+                        )
+                    )
+            self._set_state(ReadinessState.READY)
+        except Exception as e:
+            logger.error(f"Model preload failed, the model will be loaded by the first request: {e}")
+            self._set_state(ReadinessState.FAILED)
+        finally:
+            duration = (datetime.now() - started).total_seconds()
+            logger.info(f"Model preload finished with state '{self.state.value}' after {duration:.1f}s")
+            if self.analytics:
+                self.analytics.record_model_preload(duration_seconds=duration)
+            self.ready_event.set()
+
+    def _get_resolutions(self, modelconfig: ModelConfig) -> List[Tuple[int, int]]:
+        """unique resolutions of all aspect ratios of the model"""
+        resolutions = []
+        for ratio in modelconfig.aspect_ratio.values():
+            resolution = ModelConfig.split_aspect_ratio(ratio)
+            if resolution not in resolutions:
+                resolutions.append(resolution)
+        return resolutions
+
+    def _set_state(self, state: ReadinessState):
+        self.state = state
+        if self.analytics:
+            self.analytics.update_model_readiness(state=state.value)
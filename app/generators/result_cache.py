@@ -0,0 +1,219 @@
+"""
+Generation Result Cache Module
+
+Generations with a seed are deterministic, so identical requests (e.g. the same example
+clicked by many users) don't need the GPU again. This module stores the generated images
+on disk, addressed by a fingerprint of the resolved GenerationParameters and the model
+identity. The cache has a size cap and evicts the least recently used results.
+
+Classes:
+    GenerationResultCache: Singleton disk-backed LRU cache of generated images
+
+Functions:
+    example_seed: Fixed seed of an example prompt
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from PIL import Image
+from ..utils.singleton import singleton
+from .generation_params import GenerationParameters
+from .modelconfig import ModelConfig
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def cleanup_prompt(prompt: str) -> str:
+    """cleanup of the user prompt, shared by the UI and the pre-rendered examples as seed and fingerprint depend on it"""
+    return str(prompt.strip()).replace("'", "-")
+
+
+def example_seed(prompt: str) -> int:
+    """fixed seed of an example, stable across restarts so the cached results can be reused"""
+    return int(hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8], 16)
+
+
+@singleton
+class GenerationResultCache:
+    """
+    Disk-backed LRU cache of generated images.
+
+    Every result is stored in its own folder named by the fingerprint, the access time
+    of the folder is used to restore the LRU order after a restart.
+
+    Args:
+        directory (str): Folder of the cached images
+        max_megabytes (float): Maximum size of all cached images, 0 = cache disabled
+        seeded_only (bool): Only cache requests with a seed, requests without seed use a random seed
+        analytics (Analytics): Optional analytics instance to report hits and misses
+
+    Notes:
+        - Requests with input images (img2img, inpainting) are never cached
+        - The images are stored as PNG, so cached results are identical to the generated ones
+    """
+
+    CACHE_NAME = "generation_results"
+
+    def __init__(self, directory: str, max_megabytes: float = 1024, seeded_only: bool = True, analytics=None):
+        logger.info(f"Initialize GenerationResultCache in '{directory}' with {max_megabytes} MB")
+        self.directory = directory
+        self.max_bytes = int(max_megabytes * 1024**2)
+        self.seeded_only = seeded_only
+        self.analytics = analytics
+        self.hits = 0
+        self.misses = 0
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        if self.enabled:
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def fingerprint(self, params: GenerationParameters, modelconfig: ModelConfig) -> Optional[str]:
+        """
+        Canonical fingerprint of a request.
+
+        Args:
+            params (GenerationParameters): Resolved parameters as handed over to the generator
+            modelconfig (ModelConfig): Model which generates the images
+
+        Returns:
+            Optional[str]: sha256 of the request, None if the request can't be cached
+        """
+        if not self.enabled or params.image is not None or params.mask_image is not None:
+            return None
+        if params.seed is None and self.seeded_only:
+            return None
+        request = {
+            "model": {
+                "model_type": modelconfig.model_type.lower(),
+                "path": modelconfig.path,
+                "embeddings": {kind: sorted(e.source for e in embeddings) for kind, embeddings in modelconfig.embeddings.items()},
+                "loras": sorted((lora.src, lora.weight) for lora in modelconfig.loras),
+            },
+            "prompt": params.prompt,
+            "negative_prompt": params.negative_prompt or "",
+            "num_inference_steps": int(params.num_inference_steps),
+            "guidance_scale": float(params.guidance_scale),
+            "width": int(params.width),
+            "height": int(params.height),
+            "num_images_per_prompt": int(params.num_images_per_prompt),
+            "seed": params.seed,
+            "clip_skip": params.clip_skip,
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, fingerprint: Optional[str]) -> Optional[List[Image.Image]]:
+        """cached images of the fingerprint or None"""
+        if fingerprint is None:
+            return None
+        images = None
+        with self._lock:
+            if fingerprint in self._sizes:
+                try:
+                    folder = self._folder(fingerprint)
+                    images = []
+                    for filename in sorted(os.listdir(folder)):
+                        with Image.open(os.path.join(folder, filename)) as image:
+                            image.load()
+                            images.append(image)
+                    if not images:
+                        raise FileNotFoundError("no images found")
+                    os.utime(folder)
+                    self._sizes.move_to_end(fingerprint)
+                except Exception as e:
+                    logger.warning(f"Error reading cached result {fingerprint}: {e}")
+                    self._remove(fingerprint)
+                    images = None
+            if images:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self.analytics:
+            self.analytics.record_cache_access(cache=self.CACHE_NAME, hit=images is not None)
+        return images
+
+    def put(self, fingerprint: Optional[str], images: List[Image.Image]):
+        """store the images of the fingerprint, results larger than the cache are not stored"""
+        if fingerprint is None or not images:
+            return
+        with self._lock:
+            if fingerprint in self._sizes:
+                return
+            folder = self._folder(fingerprint)
+            try:
+                # write to a temporary folder first, so a crash never leaves a partial result
+                tmp_folder = folder + ".tmp"
+                os.makedirs(tmp_folder, exist_ok=True)
+                for index, image in enumerate(images):
+                    image.save(os.path.join(tmp_folder, f"{index:03d}.png"), format="PNG")
+                size = self._folder_size(tmp_folder)
+                if size > self.max_bytes:
+                    shutil.rmtree(tmp_folder, ignore_errors=True)
+                    return
+                shutil.rmtree(folder, ignore_errors=True)
+                os.replace(tmp_folder, folder)
+            except Exception as e:
+                logger.warning(f"Error writing result {fingerprint} to cache: {e}")
+                shutil.rmtree(folder + ".tmp", ignore_errors=True)
+                return
+            self._sizes[fingerprint] = size
+            while self.used_bytes > self.max_bytes:
+                self._remove(next(iter(self._sizes)))
+            used_bytes, entries = self.used_bytes, len(self._sizes)
+        if self.analytics:
+            self.analytics.update_cache_size(cache=self.CACHE_NAME, size_bytes=used_bytes, entries=entries)
+
+    def clear(self):
+        with self._lock:
+            for fingerprint in list(self._sizes):
+                self._remove(fingerprint)
+
+    def _folder(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, fingerprint)
+
+    def _folder_size(self, folder: str) -> int:
+        return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+
+    def _remove(self, fingerprint: str):
+        self._sizes.pop(fingerprint, None)
+        shutil.rmtree(self._folder(fingerprint), ignore_errors=True)
+
+    def _load_index(self):
+        """restore the cache index from disk, oldest access first"""
+        os.makedirs(self.directory, exist_ok=True)
+        entries: Dict[str, tuple] = {}
+        for name in os.listdir(self.directory):
+            folder = os.path.join(self.directory, name)
+            if not os.path.isdir(folder):
+                continue
+            if name.endswith(".tmp"):
+                shutil.rmtree(folder, ignore_errors=True)
+                continue
+            try:
+                entries[name] = (os.stat(folder).st_mtime, self._folder_size(folder))
+            except OSError as e:
+                logger.warning(f"Ignoring cached result {name}: {e}")
+        for name, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            self._sizes[name] = size
+        while self.used_bytes > self.max_bytes:
+            self._remove(next(iter(self._sizes)))
+        logger.info(f"Loaded {len(self._sizes)} cached results ({self.used_bytes / 1024**2:.1f} MB)")
+        if self.analytics:
+            self.analytics.update_cache_size(cache=self.CACHE_NAME, size_bytes=self.used_bytes, entries=len(self._sizes))
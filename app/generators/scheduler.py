@@ -0,0 +1,487 @@
+"""
+Generation Scheduler Module
+
+This module implements the central job scheduler which sits in front of the image
+generators. Instead of letting every request block on the generator lock, jobs are
+collected in a bounded queue and dispatched one after another by a single worker thread.
+
+Features:
+    - bounded queue with rejection if the queue is full (load shedding)
+    - priority classes (e.g. derived from the remaining credits of a session)
+    - per-session fairness (round robin between sessions of the same priority)
+    - queue position and ETA reporting while a job is waiting
+    - streaming of step progress and preview images to the requesting thread
+    - cancellation of waiting and running jobs (e.g. if the client disconnected)
+    - cross-request batching of compatible jobs into one pipeline call
+    - optional gate, e.g. jobs wait until the model preload is finished
+
+Classes:
+    QueueFullException: Raised if a job can't be accepted
+    SessionLimitException: Raised if the session has already the maximum amount of jobs
+    JobPriority: Priority classes for generation jobs
+    GenerationJob: A single generation request and its result
+    JobUpdate: Progress information of a job, yielded by GenerationScheduler.stream
+    GenerationScheduler: Singleton scheduler dispatching jobs to the generator
+"""
+
+import itertools
+import queue
+import threading
+import time
+from datetime import datetime
+from enum import Enum, IntEnum
+from typing import Callable, List, Optional
+from PIL import Image
+from ..utils.singleton import singleton
+from .generation_params import GenerationParameters
+from .modelconfig import ModelConfig
+from .generator_factory import get_generator
+from .cancellation import CancellationToken, GenerationCancelledException
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullException(Exception):
+    """
+    Exception raised if the scheduler can't accept another job.
+
+    This happens if the queue reached its maximum size or the session
+    has already the maximum amount of jobs waiting.
+    """
+    pass
+
+
+class SessionLimitException(QueueFullException):
+    """
+    Exception raised if the session has already the maximum amount of jobs
+    waiting or running, e.g. after a double click on the generate button.
+    """
+    pass
+
+
+class JobPriority(IntEnum):
+    """Priority classes for generation jobs, lower value is served first"""
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class JobState(Enum):
+    """Lifecycle of a generation job"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class GenerationJob:
+    """
+    A single generation request handled by the GenerationScheduler.
+
+    Attributes:
+        params (GenerationParameters): Parameters for the generator
+        session (str): Session id of the requesting user (used for fairness)
+        priority (JobPriority): Priority class of the job
+        step_callback: Callback handed over to the generator (step, total_steps, previews)
+        modelconfig (ModelConfig): Model used for the job, None = model of the scheduler's generator
+        cancel_token (CancellationToken): Token to stop the job, created if not given
+        state (JobState): Current state of the job
+        result (List[Image.Image]): Generated images, available if state is DONE
+        error (Exception): Error raised by the generator, available if state is FAILED
+    """
+
+    def __init__(self, params: GenerationParameters, session: str, priority: JobPriority,
+                 step_callback: Callable = None, modelconfig: ModelConfig = None, cancel_token: CancellationToken = None):
+        self.params = params
+        self.session = session
+        self.priority = priority
+        self.step_callback = step_callback
+        self.modelconfig = modelconfig
+        self.cancel_token = cancel_token or CancellationToken()
+        self.state = JobState.QUEUED
+        self.result: List[Image.Image] = None
+        self.error: Exception = None
+        self.sequence = 0
+        self.created = datetime.now()
+        self.started: datetime = None
+        self._finished = threading.Event()
+        self._finish_callbacks: List[Callable] = []
+
+    @property
+    def image_count(self) -> int:
+        return max(1, self.params.num_images_per_prompt)
+
+    def batch_key(self) -> Optional[tuple]:
+        """jobs can be batched if they use the same model and compatible parameters"""
+        key = self.params.batch_key()
+        if key is None:
+            return None
+        return (id(self.modelconfig),) + key
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the job is finished. Returns False if the timeout is reached before."""
+        return self._finished.wait(timeout)
+
+    def _finish(self, result: List[Image.Image] = None, error: Exception = None):
+        self.result = result
+        self.error = error
+        if isinstance(error, GenerationCancelledException):
+            self.state = JobState.CANCELLED
+        else:
+            self.state = JobState.FAILED if error else JobState.DONE
+        self._finished.set()
+        for callback in self._finish_callbacks:
+            callback()
+
+
+class JobUpdate:
+    """
+    Progress information of a job, yielded by GenerationScheduler.stream.
+
+    Attributes:
+        state (JobState): QUEUED while waiting, RUNNING for step progress, DONE with the result
+        position (int): Position in the queue (QUEUED only)
+        eta (int): Estimated seconds until the job starts (QUEUED only)
+        step (int): Finished denoising steps (RUNNING only)
+        total_steps (int): Total denoising steps (RUNNING only)
+        previews (List[Image.Image]): Low resolution previews or None (RUNNING only)
+        images (List[Image.Image]): Generated images (DONE only)
+    """
+
+    def __init__(self, state: JobState, position: int = 0, eta: int = 0, step: int = 0, total_steps: int = 0,
+                 previews: List[Image.Image] = None, images: List[Image.Image] = None):
+        self.state = state
+        self.position = position
+        self.eta = eta
+        self.step = step
+        self.total_steps = total_steps
+        self.previews = previews
+        self.images = images
+
+
+@singleton
+class GenerationScheduler:
+    """
+    Central scheduler for all image generation requests.
+
+    Jobs are queued and executed by one worker thread, which calls the generator.
+    The next job is selected by priority first, then round robin between the sessions
+    and finally by arrival (FIFO). Waiting jobs with compatible parameters (same resolution,
+    steps and guidance) are added to the selected job and executed in one batched pipeline
+    call. The worker waits up to batch_window_ms for further compatible jobs if the batch is not full.
+
+    Args:
+        generator (BaseGenerator): Generator used to execute the jobs
+        max_queue_size (int): Maximum amount of waiting jobs, further jobs are rejected
+        max_jobs_per_session (int): Maximum amount of waiting or running jobs per session
+        max_batch_images (int): Maximum amount of images generated in one pipeline call (1 = no batching)
+        batch_window_ms (int): Time to wait for additional compatible jobs before a batch starts
+        analytics (Analytics): Optional analytics instance to report queue metrics
+        ready (threading.Event): Optional gate, jobs are queued but not started before the event is set
+    """
+
+    # start value for the time required per image, will be replaced by measured values
+    DEFAULT_SECONDS_PER_IMAGE = 10.0
+
+    def __init__(self, generator, max_queue_size: int = 20, max_jobs_per_session: int = 1,
+                 max_batch_images: int = 1, batch_window_ms: int = 0, analytics=None, ready: threading.Event = None):
+        logger.info(f"Initialize GenerationScheduler with queue size {max_queue_size} and batches up to {max_batch_images} images")
+        self.generator = generator
+        # the generators are singletons, keep the model of the default generator for jobs without model
+        self.default_modelconfig = getattr(generator, "modelconfig", None)
+        self.max_queue_size = max_queue_size
+        self.max_jobs_per_session = max_jobs_per_session
+        self.max_batch_images = max(1, max_batch_images)
+        self.batch_window_ms = max(0, batch_window_ms)
+        self.analytics = analytics
+        self.ready = ready
+
+        self._queue: List[GenerationJob] = []
+        self._running: List[GenerationJob] = []
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._seconds_per_image = self.DEFAULT_SECONDS_PER_IMAGE
+
+        self._worker = threading.Thread(target=self._worker_loop, name="generation-scheduler", daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._queue)
+
+    def submit(self, params: GenerationParameters, session: str, priority: JobPriority = JobPriority.NORMAL,
+               step_callback: Callable = None, modelconfig: ModelConfig = None,
+               cancel_token: CancellationToken = None) -> GenerationJob:
+        """
+        Add a new job to the queue.
+
+        Raises:
+            QueueFullException: If the queue is full
+            SessionLimitException: If the session has too many jobs queued
+        """
+        job = GenerationJob(params=params, session=session, priority=priority, step_callback=step_callback,
+                            modelconfig=modelconfig, cancel_token=cancel_token)
+        with self._condition:
+            if len(self._queue) >= self.max_queue_size:
+                self._record_job("rejected")
+                raise QueueFullException(f"Generation queue is full ({len(self._queue)} jobs waiting)")
+
+            jobs_of_session = [j for j in self._queue + self._running if j.session == session]
+            if len(jobs_of_session) >= self.max_jobs_per_session:
+                self._record_job("rejected")
+                raise SessionLimitException(f"Session {session} has already {len(jobs_of_session)} generation job(s) queued")
+
+            job.sequence = next(self._sequence)
+            self._queue.append(job)
+            self._record_job("queued")
+            self._condition.notify_all()
+        logger.debug(f"Job {job.sequence} of {session} queued with priority {priority.name}. Queue length: {len(self._queue)}")
+        return job
+
+    def run(self, params: GenerationParameters, session: str, priority: JobPriority = JobPriority.NORMAL,
+            step_callback: Callable = None, queue_callback: Callable = None, modelconfig: ModelConfig = None,
+            cancel_token: CancellationToken = None, poll_interval: float = 1.0) -> List[Image.Image]:
+        """
+        Submit a job and block until it is finished.
+
+        Args:
+            step_callback: called with (step, total_steps, previews) while the job is running
+            queue_callback: called with (position, eta_seconds) while the job is waiting
+            modelconfig: model used for the job, None = model of the scheduler's generator
+            cancel_token: optional token to stop the job
+
+        Returns:
+            List[Image.Image]: the generated images
+
+        Raises:
+            QueueFullException: If the job was not accepted
+            GenerationCancelledException: If the job was cancelled
+            Exception: Errors raised by the generator
+        """
+        for update in self.stream(params=params, session=session, priority=priority, modelconfig=modelconfig,
+                                  cancel_token=cancel_token, poll_interval=poll_interval):
+            try:
+                if update.state == JobState.QUEUED and queue_callback:
+                    queue_callback(update.position, update.eta)
+                elif update.state == JobState.RUNNING and step_callback:
+                    step_callback(update.step, update.total_steps, update.previews)
+            except Exception as e:
+                logger.debug(f"callback failed: {e}")
+            if update.state == JobState.DONE:
+                return update.images
+
+    def stream(self, params: GenerationParameters, session: str, priority: JobPriority = JobPriority.NORMAL,
+               modelconfig: ModelConfig = None, cancel_token: CancellationToken = None, poll_interval: float = 1.0):
+        """
+        Submit a job and yield its progress until it is finished.
+
+        The step callback of the generator is called in the worker thread, the updates
+        are handed over to the calling thread with a queue. If the stream is closed before
+        the job is finished (e.g. the client disconnected), the job is cancelled.
+
+        Yields:
+            JobUpdate: queue position while waiting, step progress while running and finally the result
+
+        Raises:
+            QueueFullException: If the job was not accepted
+            GenerationCancelledException: If the job was cancelled
+            Exception: Errors raised by the generator
+        """
+        updates = queue.Queue()
+
+        def step_callback(step: int, total_steps: int, previews: List[Image.Image]):
+            updates.put(JobUpdate(JobState.RUNNING, step=step, total_steps=total_steps, previews=previews))
+
+        job = self.submit(params=params, session=session, priority=priority, step_callback=step_callback,
+                          modelconfig=modelconfig, cancel_token=cancel_token)
+        # wake up the loop as soon as the job is finished
+        job._finish_callbacks.append(lambda: updates.put(None))
+        if job.wait(0):
+            updates.put(None)
+        try:
+            while True:
+                try:
+                    update = updates.get(timeout=poll_interval)
+                    if update is None:
+                        break
+                    yield update
+                    continue
+                except queue.Empty:
+                    pass
+                if job.state == JobState.QUEUED:
+                    if job.cancel_token.is_cancelled:
+                        # e.g. timeout while waiting in the queue
+                        self.cancel(job)
+                        continue
+                    position, eta = self.get_position(job)
+                    if position > 0:
+                        yield JobUpdate(JobState.QUEUED, position=position, eta=eta)
+        finally:
+            if not job.wait(0):
+                logger.info(f"Stream of job {job.sequence} closed before the job finished, cancel it")
+                self.cancel(job)
+        if job.error:
+            raise job.error
+        yield JobUpdate(JobState.DONE, images=job.result)
+
+    def cancel(self, job: GenerationJob, reason: str = "cancelled"):
+        """
+        Cancel a job. Waiting jobs are removed from the queue, running jobs are
+        stopped by the generator after the current denoising step.
+        """
+        job.cancel_token.cancel(reason=reason)
+        with self._condition:
+            if job in self._queue:
+                self._queue.remove(job)
+                job._finish(error=GenerationCancelledException(f"Generation stopped while waiting ({job.cancel_token.reason})"))
+                self._record_job("cancelled")
+                logger.debug(f"Job {job.sequence} removed from queue")
+                # wakes the worker if it waits for the batch window of this job
+                self._condition.notify_all()
+
+    def get_position(self, job: GenerationJob) -> tuple:
+        """
+        Returns the position of the job in the queue (1 = next) and the estimated seconds until it starts.
+        Position 0 means the job is not waiting anymore.
+        """
+        with self._condition:
+            if job not in self._queue:
+                return 0, 0
+            ordered = self._ordered_queue()
+            position = ordered.index(job) + 1
+            images_ahead = sum(j.image_count for j in ordered[:position - 1])
+            eta = images_ahead * self._seconds_per_image
+            if self._running:
+                elapsed = (datetime.now() - self._running[0].started).total_seconds()
+                running_images = sum(j.image_count for j in self._running)
+                eta += max(0, running_images * self._seconds_per_image - elapsed)
+            return position, int(eta)
+
+    def _ordered_queue(self) -> List[GenerationJob]:
+        """queue sorted by priority, round robin between sessions and arrival"""
+        session_rank = {}
+        keys = {}
+        for job in sorted(self._queue, key=lambda j: j.sequence):
+            rank = session_rank.get(job.session, 0)
+            session_rank[job.session] = rank + 1
+            keys[job] = (job.priority, rank, job.sequence)
+        return sorted(self._queue, key=lambda j: keys[j])
+
+    def _collect_batch(self, first: GenerationJob) -> List[GenerationJob]:
+        """compatible jobs from the queue which can be executed together with the first job"""
+        batch = [first]
+        key = first.batch_key()
+        if key is None:
+            return batch
+        images = first.image_count
+        for job in self._ordered_queue():
+            if job is first or job.batch_key() != key:
+                continue
+            if images + job.image_count > self.max_batch_images:
+                continue
+            batch.append(job)
+            images += job.image_count
+        return batch
+
+    def _next_batch(self) -> List[GenerationJob]:
+        """wait for the next job and collect compatible jobs within the batch window"""
+        with self._condition:
+            batch = None
+            while batch is None:
+                while len(self._queue) == 0:
+                    self._condition.wait()
+                first = self._ordered_queue()[0]
+                batch = self._collect_batch(first)
+
+                window_end = time.monotonic() + self.batch_window_ms / 1000
+                while sum(j.image_count for j in batch) < self.max_batch_images and first.batch_key() is not None:
+                    remaining = window_end - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                    if first not in self._queue:
+                        # cancelled within the batch window, pick the next job
+                        batch = None
+                        break
+                    batch = self._collect_batch(first)
+                if batch is not None and any(job not in self._queue for job in batch):
+                    batch = None
+
+            started = datetime.now()
+            for job in batch:
+                self._queue.remove(job)
+                job.state = JobState.RUNNING
+                job.started = started
+            self._running = batch
+            self._update_queue_length()
+            return batch
+
+    def _worker_loop(self):
+        if self.ready is not None and not self.ready.is_set():
+            logger.info("GenerationScheduler waits for the generator to be ready")
+            self.ready.wait()
+        while True:
+            batch, waits = [], []
+            try:
+                batch = self._next_batch()
+                waits = [(j.started - j.created).total_seconds() for j in batch]
+                logger.debug(f"Start {len(batch)} job(s) {[j.sequence for j in batch]} after max. {max(waits):.1f}s in queue")
+                generator = self._get_generator(batch[0])
+                if len(batch) == 1:
+                    results = [generator.generate_images(params=batch[0].params, step_callback=batch[0].step_callback,
+                                                         cancel_token=batch[0].cancel_token)]
+                else:
+                    results = generator.generate_images_batch(
+                        [j.params for j in batch],
+                        [j.step_callback for j in batch],
+                        [j.cancel_token for j in batch]
+                    )
+                self._update_seconds_per_image(batch)
+                for job, images, waited in zip(batch, results, waits):
+                    if job.cancel_token.is_cancelled:
+                        # the batch was continued for other jobs, nobody is waiting for these images
+                        job._finish(error=GenerationCancelledException(f"Generation stopped ({job.cancel_token.reason})"))
+                        self._record_job("cancelled", waited)
+                    else:
+                        job._finish(result=images)
+                        self._record_job("completed", waited)
+            except GenerationCancelledException as e:
+                logger.info(f"Generation job(s) {[j.sequence for j in batch]} cancelled: {e}")
+                for job, waited in zip(batch, waits):
+                    job._finish(error=e)
+                    self._record_job("cancelled", waited)
+            except Exception as e:
+                logger.error(f"Generation job(s) {[j.sequence for j in batch]} failed: {e}")
+                for job, waited in zip(batch, waits):
+                    job._finish(error=e)
+                    self._record_job("failed", waited)
+            finally:
+                with self._condition:
+                    self._running = []
+                if self.analytics and len(batch) > 1:
+                    self.analytics.record_generation_batch(job_count=len(batch), image_count=sum(j.image_count for j in batch))
+
+    def _get_generator(self, job: GenerationJob):
+        """generator for the model of the job, the default model is used if the job has none"""
+        modelconfig = job.modelconfig or self.default_modelconfig
+        if modelconfig is None or modelconfig is self.generator.modelconfig:
+            return self.generator
+        return get_generator(self.generator.appconfig, modelconfig)
+
+    def _update_seconds_per_image(self, batch: List[GenerationJob]):
+        duration = (datetime.now() - batch[0].started).total_seconds()
+        images = sum(j.image_count for j in batch)
+        # exponential moving average to smooth single outliers (e.g. model loading)
+        self._seconds_per_image = 0.7 * self._seconds_per_image + 0.3 * (duration / images)
+
+    def _update_queue_length(self):
+        if self.analytics:
+            self.analytics.update_generation_queue_length(len(self._queue))
+
+    def _record_job(self, status: str, wait_seconds: Optional[float] = None):
+        if self.analytics:
+            self.analytics.record_generation_job(status=status, wait_seconds=wait_seconds)
+            self._update_queue_length()
@@ -2,8 +2,13 @@ import os
 import random
 import gradio as gr
 import logging
-from app.generators import FluxGenerator, GenerationParameters, ModelConfig, StabelDiffusionGenerator
-from app.validators import PromptRefiner, NSFWDetector, CensorMethod, NSFWCategory
+from typing import Dict, List
+from app.generators import GenerationParameters, ModelConfig, get_generator
+from app.generators import GenerationScheduler, JobPriority, JobState, QueueFullException, ModelPreloader
+from app.generators import CancellationToken, GenerationCancelledException, PromptEmbeddingCache
+from app.generators import GenerationResultCache, example_seed, cleanup_prompt
+from app.validators import PromptRefiner, NSFWDetector, CensorMethod, NSFWCategory, AnalysisCache, PromptVerdictCache
+from app.validators import PromptPrefilter, PromptClassifier, OllamaClient, CircuitBreaker
 from app.utils.fileIO import save_image_with_timestamp, get_date_subfolder
 from app import SessionState
 from app.appconfig import AppConfig
@@ -16,34 +21,140 @@ logger = logging.getLogger(__name__)
 
 
 class ImageGenerationHandler:
-    def __init__(self, session_manager: SessionManager, config: AppConfig, analytics: Analytics, modelconfig: ModelConfig):
+    def __init__(self, session_manager: SessionManager, config: AppConfig, analytics: Analytics, modelconfig: ModelConfig,
+                 selectable_modelconfigs: Dict[str, ModelConfig] = None):
         self.config = config
         self.session_manager = session_manager
         self.analytics = analytics
         self.selectedmodelconfig = modelconfig
+        # models the user can choose from, key is the model name
+        self.selectable_modelconfigs = {modelconfig.model: modelconfig}
+        for model, selectable_modelconfig in (selectable_modelconfigs or {}).items():
+            self.selectable_modelconfigs.setdefault(model, selectable_modelconfig)
 
         self.nsfw_detector = NSFWDetector(confidence_threshold=0.7)
+        self.analysis_cache = AnalysisCache(
+            max_entries=self.config.analysis_cache_max_entries,
+            ttl_seconds=self.config.analysis_cache_ttl_minutes * 60,
+            analytics=self.analytics
+        )
+        # fixed seeds of the example prompts, so their results are served by the result cache
+        self.example_seeds: Dict[str, int] = {}
+        for selectable_modelconfig in self.selectable_modelconfigs.values():
+            self.register_examples(selectable_modelconfig.examples)
 
         self.initialize_image_generator()
         self.initialize_prompt_magic()
         self.MAX_NSFW_WARNINGS = -2  # amount of censored images if user generates nsfw content before we fully rewrite the prompt to avoid it
 
     def initialize_image_generator(self):
-        if "flux" in self.selectedmodelconfig.model_type:
-            self.generator = FluxGenerator(appconfig=self.config, modelconfig=self.selectedmodelconfig)
+        # shared by all generators, created here to report the hit ratio
+        PromptEmbeddingCache(max_megabytes=self.config.prompt_embedding_cache_mb, analytics=self.analytics)
+        self.result_cache = GenerationResultCache(
+            directory=self.config.result_cache_directory,
+            max_megabytes=self.config.result_cache_mb,
+            seeded_only=self.config.result_cache_seeded_only,
+            analytics=self.analytics
+        )
+        self.generator = get_generator(appconfig=self.config, modelconfig=self.selectedmodelconfig)
+
+        # model is loaded in the background at server start, is started by the UI
+        self.preloader = ModelPreloader(
+            generator=self.generator,
+            warmup_steps=self.config.preload_warmup_steps,
+            analytics=self.analytics
+        )
+
+        # all generation requests are queued in the scheduler instead of waiting for the generator lock
+        self.scheduler = GenerationScheduler(
+            generator=self.generator,
+            max_queue_size=self.config.generation_queue_max_size,
+            max_jobs_per_session=self.config.generation_queue_max_jobs_per_session,
+            max_batch_images=self.config.generation_batch_max_images,
+            batch_window_ms=self.config.generation_batch_window_ms,
+            analytics=self.analytics,
+            ready=self.preloader.ready_event
+        )
+
+    def start_preload(self):
+        """load and warm up the model in the background, requests are queued until it is ready"""
+        if self.config.preload_model:
+            self.preloader.start()
         else:
-            self.generator = StabelDiffusionGenerator(appconfig=self.config, modelconfig=self.selectedmodelconfig)
+            self.preloader.skip()
+
+    def register_examples(self, examples: List[list]):
+        """use a fixed seed for the example prompts (first element of each example)"""
+        for example in examples:
+            prompt = example[0] if isinstance(example, (list, tuple)) and len(example) > 0 else example
+            if isinstance(prompt, str) and prompt.strip():
+                prompt = self._cleanup_prompt(prompt)
+                self.example_seeds[prompt] = example_seed(prompt)
+        logger.debug(f"{len(self.example_seeds)} example prompts registered")
+
+    def _cleanup_prompt(self, prompt: str) -> str:
+        return cleanup_prompt(prompt)
 
     def initialize_prompt_magic(self):
         self.prompt_refiner = None
         self.promptmagic_enabled = False
         if self.config.feature_prompt_magic_enabled:
-            self.prompt_refiner = PromptRefiner()
+            ollama_client = OllamaClient(
+                server=self.config.ollama_server,
+                model=self.config.ollama_model,
+                timeout_seconds=self.config.ollama_timeout_seconds,
+                max_concurrency=self.config.ollama_max_concurrency,
+                breaker=CircuitBreaker(
+                    failure_threshold=self.config.ollama_breaker_failures,
+                    reset_seconds=self.config.ollama_breaker_reset_seconds
+                ),
+                analytics=self.analytics
+            )
+            self.prompt_refiner = PromptRefiner(
+                client=ollama_client,
+                classification_mode=self.config.prompt_check_mode,
+                prefilter=self._create_prompt_prefilter(),
+                analytics=self.analytics,
+                max_rewrite_iterations=self.config.prompt_rewrite_max_iterations,
+                max_rewrite_calls=self.config.prompt_rewrite_max_calls,
+                max_rewrite_seconds=self.config.prompt_rewrite_timeout_seconds
+            )
+            self.prompt_refiner.verdict_cache = PromptVerdictCache(
+                path=self.config.prompt_verdict_cache_path,
+                model=self.prompt_refiner.model,
+                max_entries=self.config.prompt_verdict_cache_max_entries,
+                ttl_seconds=self.config.prompt_verdict_cache_ttl_hours * 3600,
+                promptmarker=self.config.promptmarker,
+                analytics=self.analytics
+            )
             self.promptmagic_enabled = self.prompt_refiner.validate_refiner_is_ready()
 
         if not self.promptmagic_enabled:
             logger.warning("NSFW protection via PromptMagic is turned off")
 
+    def _create_prompt_prefilter(self):
+        if not self.config.prompt_prefilter_enabled:
+            return None
+        classifier = None
+        if self.config.prompt_prefilter_classifier:
+            try:
+                classifier = PromptClassifier.load(self.config.prompt_prefilter_classifier)
+            except Exception as e:
+                logger.error(f"Loading prompt classifier '{self.config.prompt_prefilter_classifier}' failed: {e}")
+        try:
+            prefilter_args = {"terms_path": self.config.prompt_prefilter_terms} if self.config.prompt_prefilter_terms else {}
+            return PromptPrefilter(
+                classifier=classifier,
+                safe_below=self.config.prompt_prefilter_safe_below,
+                unsafe_above=self.config.prompt_prefilter_unsafe_above,
+                promptmarker=self.config.promptmarker,
+                lexical_safe=self.config.prompt_prefilter_lexical_safe,
+                **prefilter_args
+            )
+        except Exception as e:
+            logger.error(f"Initialize prompt pre-filter failed, all prompts are checked by the LLM: {e}")
+            return None
+
     def create_interface_elements(self, gr):
         with gr.Row():
             prompt = gr.Textbox(
@@ -58,20 +169,38 @@ class ImageGenerationHandler:
 
         return prompt  # Return all created elements
 
-    def __status_callback(self, total_images, current_image):
+    def __step_callback(self, gradio_progress, step, total_steps):
         try:
-            current_image += 1
-            current_progress = 0.15 + (current_image * 0.65 / total_images)
+            current_progress = 0.15 + (step * 0.65 / max(1, total_steps))
             if current_progress < 0 or current_progress > 1: current_progress = 0.5
-            if total_images == 1: current_progress = 0.5
-            logger.debug(f"Create image {current_image} of {total_images}. Current Progress: {current_progress * 100}%")
-            if type(self.gradio_progress_callback) is gr.helpers.Progress:
-                gradio_progress = self.gradio_progress_callback
-                gradio_progress(progress=current_progress, desc=f"Generating image {current_image} of {total_images}")
+            if type(gradio_progress) is gr.helpers.Progress:
+                gradio_progress(progress=current_progress, desc=f"Generating step {step} of {total_steps}")
             else:
-                logger.debug(f"No progress callback available. Create image {current_image} of {total_images}")
+                logger.debug(f"No progress callback available. Step {step} of {total_steps}")
+        except Exception as e:
+            logger.error(f"Step Callback error: {e}")
+
+    def __queue_callback(self, gradio_progress, position, eta_seconds):
+        try:
+            logger.debug(f"Waiting in generation queue at position {position}, ETA {eta_seconds}s")
+            if type(gradio_progress) is gr.helpers.Progress:
+                if not self.preloader.is_ready:
+                    gradio_progress(progress=0.15, desc=f"AI system is starting ({self.preloader.state.value}), please wait")
+                else:
+                    gradio_progress(progress=0.15, desc=f"Waiting in queue at position {position} (about {eta_seconds} seconds)")
         except Exception as e:
-            logger.error(f"Status Callback error: {e}")
+            logger.error(f"Queue Callback error: {e}")
+
+    def _get_job_priority(self, session_state: SessionState) -> JobPriority:
+        """priority of the generation job based on the remaining credits of the user"""
+        if not self.config.feature_generation_credits_enabled:
+            return JobPriority.NORMAL
+        if session_state.token > self.config.initial_token:
+            # user earned additional credits by uploads or sharing links
+            return JobPriority.HIGH
+        if session_state.token <= 1:
+            return JobPriority.LOW
+        return JobPriority.NORMAL
 
     def generate_images(self,
                         progress: gr.Progress,
@@ -80,12 +209,32 @@ class ImageGenerationHandler:
                         neg_prompt,
                         aspect_ratio: str,
                         user_activated_promptmagic: bool,
-                        image_count: int):
+                        image_count: int,
+                        model: str = None,
+                        cancel_token: CancellationToken = None):
+        """
+        Generate the images for the user, used with 'yield from' by the UI action.
+        The generation is stopped if the cancel_token is cancelled.
+
+        Yields:
+            tuple: (preview images, gr.skip(), gr.skip()) while the images are generated
+
+        Returns:
+            tuple: (result images, session state, used prompt)
+        """
         try:
+            # fallback to the default model if the model is unknown
+            modelconfig = self.selectable_modelconfigs.get(model, self.selectedmodelconfig)
 
             # cleanup input data
-            prompt = str(prompt.strip()).replace("'", "-")
+            prompt = self._cleanup_prompt(prompt)
             userprompt = prompt
+            # examples are generated with a fixed seed and without the random prompt magic,
+            # so the result is identical for every user and can be served from the result cache
+            seed = self.example_seeds.get(prompt)
+            if seed is not None:
+                logger.debug(f"Example prompt identified, using seed {seed}")
+                user_activated_promptmagic = False
             style = None
             try:
                 if self.config.promptmarker in prompt:
@@ -118,32 +267,54 @@ class ImageGenerationHandler:
                 prompt: '{prompt}'""")
 
             # split aspect ratio selection to dimensions by using modelconfig
-            width, height = self._get_image_dimensions(aspect_ratio)
+            width, height = self._get_image_dimensions(aspect_ratio, modelconfig)
             progress(0.15, "load ai system")
 
             generation_details = GenerationParameters(
                 prompt=prompt,
                 negative_prompt=neg_prompt,
-                num_inference_steps=int(self.selectedmodelconfig.generation.get("steps", 30)),
-                guidance_scale=float(self.selectedmodelconfig.generation.get("guidance", 1)),
+                num_inference_steps=int(modelconfig.generation.get("steps", 30)),
+                guidance_scale=float(modelconfig.generation.get("guidance", 1)),
                 num_images_per_prompt=image_count,
                 width=width,
                 height=height,
+                seed=seed,
             )
-            self.gradio_progress_callback = progress
-            generated_images = self.generator.generate_images(params=generation_details, status_callback=self.__status_callback)
-            logger.debug(f"received {len(generated_images)} image(s) from generator")
-            self.gradio_progress_callback = None
+            fingerprint = self.result_cache.fingerprint(generation_details, modelconfig)
+            generated_images = self.result_cache.get(fingerprint)
+            if generated_images is not None:
+                logger.info(f"serving {len(generated_images)} image(s) from result cache")
+            else:
+                generated_images = []
+                for update in self.scheduler.stream(
+                        params=generation_details,
+                        session=session_state.session,
+                        priority=self._get_job_priority(session_state),
+                        modelconfig=modelconfig,
+                        cancel_token=cancel_token):
+                    if update.state == JobState.QUEUED:
+                        self.__queue_callback(progress, update.position, update.eta)
+                    elif update.state == JobState.RUNNING:
+                        self.__step_callback(progress, update.step, update.total_steps)
+                        if update.previews:
+                            # stream the previews to the gallery, state and prompt are not changed
+                            yield update.previews, gr.skip(), gr.skip()
+                    elif update.state == JobState.DONE:
+                        generated_images = update.images
+                logger.debug(f"received {len(generated_images)} image(s) from generator")
+                # results are stored uncensored, the censorship depends on the session
+                self.result_cache.put(fingerprint, generated_images)
 
             # reduce available credits after successful generation
             session_state.token -= image_count
 
             progress(0.9, "validate generated images")
             # apply censorship if still nsfw content is contained
-            result_images = self._censor_nsfw_images(session_state, generated_images)
+            result_images = self._censor_nsfw_images(session_state, generated_images, modelconfig.model)
 
             # check saving output for validation of generation (Debug & Beta Only!!)
             self._save_output_for_debug(gen_data=generation_details.to_dict(),
+                                        model=modelconfig.model,
                                         userprompt=userprompt,
                                         generated_images=generated_images,
                                         result_images=result_images
@@ -151,19 +322,41 @@ class ImageGenerationHandler:
 
             return result_images, session_state, prompt
 
+        except QueueFullException as e:
+            logger.warning(f"image generation rejected: {e}")
+            raise e
+        except GenerationCancelledException as e:
+            logger.info(f"image generation for {session_state.session} cancelled: {e}")
+            raise e
         except Exception as e:
             logger.error(f"image generation failed: {e}")
             logger.debug("Exception details:", exc_info=True)
             self.analytics.record_application_error(module="image generation", criticality="error")
             raise Exception("Error while generating the image")
 
-    def _censor_nsfw_images(self, session_state, generated_images):
+    def _detect_nsfw(self, images):
+        """NSFW results of the images, results of the result cache are usually known already"""
+        if not self.analysis_cache.enabled:
+            return self.nsfw_detector.detect_batch(images)
+        hashes = [self.analysis_cache.image_hash(image) for image in images]
+        results = [self.analysis_cache.get("nsfw", content_hash) for content_hash in hashes]
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            # one inference for all unknown images of the generation
+            detected = self.nsfw_detector.detect_batch([images[index] for index in missing])
+            for index, result in zip(missing, detected):
+                results[index] = result
+                if result.category != NSFWCategory.UNKNOWN:  # errors are detected again
+                    self.analysis_cache.put("nsfw", hashes[index], result)
+        return results
+
+    def _censor_nsfw_images(self, session_state, generated_images, model: str):
         result_images = []
         try:
             show_nsfw_censor_warning = False
             nsfw_count = 0
-            for image in generated_images:
-                nsfw_check = self.nsfw_detector.detect(image)
+            nsfw_checks = self._detect_nsfw(generated_images)
+            for image, nsfw_check in zip(generated_images, nsfw_checks):
                 if not nsfw_check.is_safe:
                     # just for debugging purposes
                     logger.debug(f"Generated NSFW Image detected. Category: {nsfw_check.category}, Confidence: {nsfw_check.confidence}")
@@ -196,7 +389,7 @@ class ImageGenerationHandler:
                 self.analytics.record_image_creation(
                     count=len(generated_images),
                     nsfw_count=nsfw_count,
-                    model=self.selectedmodelconfig.model
+                    model=model
                 )
             except Exception as e:
                 logger.warning(f"error while recording sucessful image generation for stats: {e}")
@@ -240,13 +433,13 @@ class ImageGenerationHandler:
 
         return prompt
 
-    def _save_output_for_debug(self, gen_data: dict, userprompt: str, generated_images: list, result_images: list):
+    def _save_output_for_debug(self, gen_data: dict, model: str, userprompt: str, generated_images: list, result_images: list):
         try:
             # check saving output for validation of generation (Debug & Beta Only!!)
             if self.config.save_generated_output:
                 logger.debug(f"saving images to {self.config.output_directory}")
                 gen_data["userprompt"] = userprompt
-                gen_data["model"] = self.selectedmodelconfig.model
+                gen_data["model"] = model
                 outdir = os.path.join(self.config.output_directory, get_date_subfolder(), "generation")
                 for image in generated_images:
                     save_image_with_timestamp(image=image, folder_path=outdir, ignore_errors=True, generation_details=gen_data)
@@ -258,16 +451,17 @@ class ImageGenerationHandler:
         except Exception as e:
             logger.warning(f"error while saving images: {e}")
 
-    def _get_image_dimensions(self, aspect_ratio):
+    def _get_image_dimensions(self, aspect_ratio, modelconfig: ModelConfig = None):
+        modelconfig = modelconfig or self.selectedmodelconfig
         width, height = 512, 512
         # define fallback (first element)
-        for supported_ratio in self.selectedmodelconfig.aspect_ratio.values():
+        for supported_ratio in modelconfig.aspect_ratio.values():
             width, height = ModelConfig.split_aspect_ratio(supported_ratio)
 
         # try to determine teh corect aspect ratio
-        for supported_ratio in self.selectedmodelconfig.aspect_ratio.keys():
+        for supported_ratio in modelconfig.aspect_ratio.keys():
             if aspect_ratio.lower() in supported_ratio.lower():
-                ratio = self.selectedmodelconfig.aspect_ratio[supported_ratio]
+                ratio = modelconfig.aspect_ratio[supported_ratio]
                 width, height = ModelConfig.split_aspect_ratio(ratio)
                 break
         return width, height
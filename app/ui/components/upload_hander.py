@@ -1,7 +1,12 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 from hashlib import sha1
+from typing import Dict, List, Optional, Tuple
 
 import os
+import tempfile
+import threading
 import gradio as gr
 from PIL import Image
 import logging
@@ -9,11 +14,12 @@ from app import SessionState
 from app.appconfig import AppConfig
 from app.utils.singleton import singleton
 from app.utils.fileIO import get_date_subfolder
-from app.validators import AIImageDetector, FaceDetector, NSFWDetector, NSFWCategory
+from app.utils.upload_history import UploadHistory
+from app.validators import AIImageDetector, FaceDetector, NSFWDetector, NSFWCategory, AnalysisCache, UploadAnalyzer
+from app.validators import ImageHashIndex, image_fingerprint
 from app.analytics import Analytics
 from .session_manager import SessionManager
 
-import json
 import shutil
 
 
@@ -21,6 +27,14 @@ import shutil
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class UploadReward:
+    """Credits of an analyzed upload, received by the next click or token check of the session"""
+    token: int
+    nsfw: int
+    msg: str
+
+
 @singleton
 class UploadHandler:
     def __init__(self, session_manager: SessionManager, config: AppConfig, analytics: Analytics):
@@ -35,13 +49,42 @@ class UploadHandler:
         else:
             logger.error("No output directory specified. Using fallback ./output")
 
-        self._initialize_database_uploaded_images()
-        self._initialize_database_created_images()
+        # retried uploads and both upload handlers share the hash and the results of the checks
+        self.analysis_cache = AnalysisCache(
+            max_entries=self.config.analysis_cache_max_entries,
+            ttl_seconds=self.config.analysis_cache_ttl_minutes * 60,
+            analytics=self.analytics
+        )
+
+        # uploads are analyzed in the background, the rewards wait for the next click or token check of the session
+        self._analysis_executor = ThreadPoolExecutor(max_workers=max(1, self.config.upload_job_workers), thread_name_prefix="upload")
+        self._analysis_jobs: Dict[Tuple[str, str], Future] = {}
+        self._pending_rewards: Dict[str, List[UploadReward]] = {}
+        self._rewards_lock = threading.Lock()
+        self._uploads_lock = threading.Lock()
+
+        self._initialize_history()
+        # perceptual hashes find re-saved, resized or slightly altered uploads and generated images
+        self.image_index = ImageHashIndex(
+            path=os.path.join(self.basedir, "image_hashes.log"),
+            max_distance=self.config.image_duplicate_distance
+        )
 
     def load_components(self):
         self.nsfw_detector = NSFWDetector(confidence_threshold=0.7)
-        self.face_analyzer = FaceDetector()
+        self.face_analyzer = FaceDetector(
+            pool_size=self.config.face_detector_pool_size,
+            intra_op_threads=self.config.face_detector_threads
+        )
         self.ai_image_detector = AIImageDetector()
+        self.upload_analyzer = UploadAnalyzer(
+            face_detector=self.face_analyzer,
+            ai_image_detector=self.ai_image_detector,
+            nsfw_detector=self.nsfw_detector,
+            analysis_cache=self.analysis_cache,
+            max_workers=self.config.upload_analysis_workers,
+            analytics=self.analytics
+        )
 
         try:
             self.msg_share_image = ""
@@ -53,46 +96,43 @@ class UploadHandler:
         except Exception as e:
             logger.error(f"Error while loading msgs: {e}")
 
-    def _initialize_database_uploaded_images(self):
-        self._uploaded_images_data = {}
-
-        try:
-            self._uploaded_images_data = {}
-            # check maybe it's better to add the data folder as well
-            self.__uploaded_images_db_path = os.path.join(self.config.output_directory, "uploaded_images.json")
-            if os.path.exists(self.__uploaded_images_db_path):
-                with open(self.__uploaded_images_db_path, "r") as f:
-                    self._uploaded_images_data.update(json.load(f))
-            logger.info(f"Initialized upload files history from '{self.__uploaded_images_db_path}'")
-        except Exception as e:
-            logger.error(f"Error while loading uploaded_images.json: {e}")
-
-    def _initialize_database_created_images(self):
-        self._created_images_data = {}
-
+    def _initialize_history(self):
+        self.history = UploadHistory(os.path.join(self.basedir, "upload_history.db"))
         try:
-            # check maybe it's better to add the data folder as well
-            self.__created_images_db_path = os.path.join(self.config.output_directory, "created_images.json")
-            if os.path.exists(self.__created_images_db_path):
-                with open(self.__created_images_db_path, "r") as f:
-                    self._created_images_data.update(json.load(f))
-            logger.info(f"Initialized created files history from '{self.__created_images_db_path}'")
+            # the former JSON databases are imported once into a new history
+            uploaded_images_path = os.path.join(self.basedir, "uploaded_images.json")
+            created_images_path = os.path.join(self.basedir, "created_images.json")
+            if self.history.is_empty() and (os.path.exists(uploaded_images_path) or os.path.exists(created_images_path)):
+                uploads, created = self.history.import_json(uploaded_images_path, created_images_path)
+                logger.info(f"Imported {uploads} uploads and {created} created images into the upload history")
+            logger.info(f"Initialized upload history from '{self.history.path}'")
         except Exception as e:
-            logger.error(f"Error while loading created_images.json: {e}")
+            logger.error(f"Error while importing the upload history: {e}")
 
     def block_created_images_from_upload(self, images):
         try:
+            image_hashes = []
             for image in images:
                 image_sha1 = sha1(image.tobytes()).hexdigest()
-                self._created_images_data[image_sha1] = True
-        except Exception as e:
-            logger.debug(f"Error while blocking generated images from upload: {e}")
-        # now save the list to disk for reuse in later sessions
-        try:
-            with open(self.__created_images_db_path, "w") as f:
-                json.dump(self._created_images_data, f, indent=4)
+                image_hashes.append(image_sha1)
+                self.image_index.add(image_fingerprint(image), kind="created", key=image_sha1)
+            self.history.add_created(image_hashes)
         except Exception as e:
-            logger.error(f"Error while saving {self.__created_images_db_path}: {e}")
+            logger.error(f"Error while blocking generated images from upload: {e}")
+
+    def _fingerprint(self, image_path: str, image_sha1: str):
+        return self.analysis_cache.get_or_compute("fingerprint", image_sha1, lambda: image_fingerprint(image_path))
+
+    def _find_known_image(self, image_sha1: str, fingerprint, kind: str) -> Optional[str]:
+        """content hash of a known upload or created image which is equal or similar to the image, None if unknown"""
+        is_known = self.history.get_upload if kind == "upload" else self.history.is_created
+        if is_known(image_sha1):
+            return image_sha1
+        match = self.image_index.find(fingerprint, kind=kind)
+        if match is not None and is_known(match[0]):
+            logger.info(f"Image {image_sha1} is similar to the {kind} image {match[0]} (distance {match[1]})")
+            return match[0]
+        return None
 
     def create_interface_elements(self, user_session_storage):
         if not self.config.feature_upload_images_for_new_token_enabled: return
@@ -123,12 +163,12 @@ class UploadHandler:
             inputs=[user_session_storage, upload_image],
             outputs=[user_session_storage, upload_button, upload_image],
             concurrency_limit=None,
-            concurrency_id="gpu"
+            concurrency_id="image upload"
         )
 
-    def _handle_upload(self, gradio_state: str, image_path: str):
+    def _handle_upload(self, request: gr.Request, gradio_state: str, image_path: str):
         """
-        Handle image upload
+        Handle image upload, the analysis of the image starts in the background
 
         Args:
             gradio_state: the session state
@@ -143,16 +183,15 @@ class UploadHandler:
 
         try:
             logger.debug(f"image type: {type(image_path)} with value {image_path}")
-            image = Image.open(image_path)
             filename = os.path.basename(image_path)
 
-            image_sha1 = sha1(image.tobytes()).hexdigest()
+            image_sha1 = self.analysis_cache.file_hash(image_path)
             logger.info(f"UPLOAD from {session_state.session} with ID: {image_sha1}")
-            if self._uploaded_images_data.get(image_sha1) is not None:
+            if self._find_known_image(image_sha1, self._fingerprint(image_path, image_sha1), "upload") is not None:
                 logger.warning(f"Image {image_sha1} already uploaded, cancel save to disk")
+                # the analysis decides about the reduced credits of a repeated upload
+                self._enqueue_analysis(request, session_state.session, image_path, image_sha1, temporary_copy=True)
                 # we keep upload button true as the whole logic is behind it
-                # this is important to allow physical upload while generation is runnning (use wait time)
-                # and do the token update after generation to avoid loose received token
                 return gr.Button(interactive=True)
 
             dir = self.config.output_directory
@@ -163,13 +202,15 @@ class UploadHandler:
             os.makedirs(dir, exist_ok=True)
             shutil.copy(image_path, targetpath)
             logger.debug(f"Image saved to {targetpath}")
+            # the copy is analyzed, the temporary file of gradio could be removed before the job starts
+            self._enqueue_analysis(request, session_state.session, targetpath, image_sha1)
         except Exception as e:
             logger.error(f"save image failed: {e}")
         return gr.Button(interactive=True)
 
     def _handle_token_generation(self, request: gr.Request, gradio_state: str, image_path):
         """
-        Handle token generation for image upload
+        Handle token generation for image upload, receives the credits of all finished analysis of the session
         """
         if image_path is None:
             logger.error("No Image received, path is none")
@@ -178,72 +219,167 @@ class UploadHandler:
         session_state = SessionState.from_gradio_state(gradio_state)
         self.session_manager.record_active_session(session_state)
         try:
-            logger.debug(f"image type: {type(image_path)} with value {image_path}")
+            image_sha1 = self.analysis_cache.file_hash(image_path)
+            if not self.history.get_upload(image_sha1).get(session_state.session):
+                # no-op if the upload event already started the analysis
+                self._enqueue_analysis(request, session_state.session, image_path, image_sha1, temporary_copy=True)
+
+            for reward in self._collect_rewards(session_state):
+                if reward.token > 0:
+                    if reward.msg != "":
+                        gr.Info(f"You received {reward.token} new generation credits! \n\nNote: {reward.msg}", duration=30)
+                    else:
+                        gr.Info(f"Congratulation, you received {reward.token} new generation credits!", duration=30)
+                else:
+                    gr.Warning(reward.msg, title="Upload failed")
+
+            if self._is_analysis_running(session_state.session, image_sha1):
+                gr.Info("Your image is being analyzed. The credits are added automatically in a moment.", duration=15)
+        except Exception as e:
+            logger.error(f"generate credits for uploaded image failed: {e}")
+            logger.debug("Exception details:", exc_info=True)
+            self.analytics.record_application_error(module="upload credits", criticality="error")
+        return session_state, gr.Button(interactive=False), None
+
+    def earn_upload_rewards(self, session_state: SessionState) -> Tuple[SessionState, int]:
+        """
+        receive all credits of uploads which were analyzed in the background, the caller shows the sum of the credits
+        and the notes or the reason of a failed upload are shown here
+        """
+        rewards = self._collect_rewards(session_state)
+        for reward in rewards:
+            if reward.token <= 0:
+                gr.Warning(reward.msg, title="Upload failed")
+            elif reward.msg != "":
+                gr.Info(f"Note on your uploaded image: {reward.msg}", duration=30)
+        return session_state, sum(reward.token for reward in rewards)
+
+    def _enqueue_analysis(self, request: gr.Request, session: str, image_path: str, image_sha1: str, temporary_copy: bool = False):
+        """
+        start the background analysis of an upload, every image is analyzed once per session
+
+        Args:
+            temporary_copy (bool): analyze a copy of the image, required for the temporary files of gradio
+                which could be removed before the job starts. The copy is removed after the analysis.
+        """
+        key = (session, image_sha1)
+        with self._rewards_lock:
+            if key in self._analysis_jobs:
+                return
+            if temporary_copy:
+                handle, copy_path = tempfile.mkstemp(prefix="upload_", suffix=os.path.splitext(image_path)[1])
+                os.close(handle)
+                shutil.copy(image_path, copy_path)
+                image_path = copy_path
+            headers = request.headers if request is not None else {}
+            self._analysis_jobs[key] = self._analysis_executor.submit(
+                self._analyze_upload,
+                session=session,
+                image_path=image_path,
+                image_sha1=image_sha1,
+                user_agent=headers.get("user-agent", ""),
+                languages=headers.get("accept-language", ""),
+                remove_image=temporary_copy
+            )
+
+    def _is_analysis_running(self, session: str, image_sha1: str) -> bool:
+        with self._rewards_lock:
+            job = self._analysis_jobs.get((session, image_sha1))
+            return job is not None and not job.done()
+
+    def _collect_rewards(self, session_state: SessionState) -> List[UploadReward]:
+        """apply the rewards of the finished analysis jobs to the session state"""
+        with self._rewards_lock:
+            rewards = self._pending_rewards.pop(session_state.session, [])
+            for key in [key for key, job in self._analysis_jobs.items() if key[0] == session_state.session and job.done()]:
+                del self._analysis_jobs[key]
+        for reward in rewards:
+            session_state.token += reward.token
+            if reward.nsfw > 0:
+                # no check required if user is prooved adult
+                if session_state.nsfw < 0: session_state.nsfw = 0
+                session_state.nsfw += reward.nsfw
+            logger.info(f"Received token for upload: {reward.token} - {reward.msg}")
+        return rewards
+
+    def _analyze_upload(self, session: str, image_path: str, image_sha1: str, user_agent: str, languages: str,
+                        remove_image: bool = False):
+        """
+        Analyze an upload in the background, the reward is received by the next click or token check of the session
+        """
+        try:
             image = Image.open(image_path)
-            logger.info(f"Analyze upload to receive credits from {session_state.session}")
+            logger.info(f"Analyze upload to receive credits from {session}")
             token = self.config.feature_upload_images_token_reward
+            nsfwtoken = 0
             analytics_detected_content = "safe"
             msg = ""
-            image_sha1 = sha1(image.tobytes()).hexdigest()
-            already_used = self._uploaded_images_data.get(image_sha1)
+            fingerprint = self._fingerprint(image_path, image_sha1)
+            with self._uploads_lock:
+                known_upload = self._find_known_image(image_sha1, fingerprint, "upload")
+                already_used = self.history.get_upload(known_upload) if known_upload else None
+                known_created = self._find_known_image(image_sha1, fingerprint, "created")
+                if not already_used and not known_created:
+                    # prepare upload state, will be adapted later
+                    self.history.record_upload(image_sha1, session, token)
             if (already_used):
                 msg = """The image signature matches a previous submission, so the full credit reward isn't possible.
                 We’re awarding you 5 credits as a thank you for your involvement."""
                 token = 5
                 analytics_detected_content = "repeat"
-                if already_used.get(session_state.session):
+                if already_used.get(session):
                     msg = "You've already submitted this image, and it won't generate any credits."
                     token = 0
-                    # gr.Warning(msg, title="Upload failed")
-                    # return session_state, gr.Button(interactive=False), None
-            elif self._created_images_data.get(image_sha1):
+            elif known_created:
                 msg = "This image is already known, and it won't generate any credits."
                 token = 0
                 analytics_detected_content = "generated"
-                # gr.Warning(msg, title="Upload failed")
-                # return session_state, gr.Button(interactive=False), None
             elif (image.width <= 768 and image.height <= 768) or (image.width <= 512 or image.height <= 512):
                 msg = "This image is too small to be used for training of our generator. Please use a resolution with more then 768x768 to get more credits."
                 token = 1
                 analytics_detected_content = "to_small"
             else:
-                # prepare upload state, will be adapted later
-                self._uploaded_images_data[image_sha1] = {session_state.session: {"token": token, "msg": ""}}
-
                 try:
-                    faces, cv2 = self.face_analyzer.get_faces(image)
-
-                    is_ai_image, reason = self.ai_image_detector.is_ai_image(image_path)
-                    if is_ai_image:
+                    # face, AI-image and NSFW checks run in parallel, the verdict contains the results required for the reward
+                    verdict = self.upload_analyzer.analyze(image_path, image_sha1)
+                    faces = verdict.faces
+                    # the face pictures are only saved on the first analysis, cached results have no image
+                    cv2 = verdict.face_image
+                    if verdict.is_ai_image:
                         msg = "Image probably AI generated"
-                        logger.info(msg + " Reason: " + reason)
+                        logger.info(msg + " Reason: " + verdict.ai_reason)
                         token = 1
                         analytics_detected_content = "ai"
+                    elif faces is None:
+                        # failed or timed out, the image must not get the reward of a checked image
+                        msg = "Your image could not be checked completely, so only a reduced credit reward is possible."
+                        token = 1
+                        logger.warning(f"Face check of image {image_sha1} from {session} failed")
+                        analytics_detected_content = "check_failed"
                     elif len(faces) == 0:
                         msg = """No face detected in the image. Could happen that the face is to narrow or the resolution is too low.
                                 Try another pictrue to get more credits!"""
                         token = 5
-                        logger.debug(f"No Face detected on image {image_sha1} from {session_state.session}")
+                        logger.debug(f"No Face detected on image {image_sha1} from {session}")
                         analytics_detected_content = "no_face"
                     else:
                         # prepare for auto removal of critical images
-                        logger.debug(f"{len(faces)} Face(s) detected on upload from {session_state.session}")
+                        logger.debug(f"{len(faces)} Face(s) detected on upload from {session}")
                         ages = ""
                         for face in faces:
                             if face.age:
                                 ages += str(face.age) + ","
                                 if face.age < 18 and self.config.output_directory is not None:
-                                    fn = os.path.join(self.config.output_directory, "warning", get_date_subfolder())
-                                    fn = os.path.join(fn, f"{image_sha1}-{face.age}.jpg")
-                                    self.face_analyzer.get_face_picture(cv2, face, filename=fn)
+                                    if cv2 is not None:
+                                        fn = os.path.join(self.config.output_directory, "warning", get_date_subfolder())
+                                        fn = os.path.join(fn, f"{image_sha1}-{face.age}.jpg")
+                                        self.face_analyzer.get_face_picture(cv2, face, filename=fn)
                                     logger.warning(f"Suspected age detected on image {image_sha1}")
                         logger.debug(f"Ages on the image {image_sha1}: {ages[:-1]}")
 
-                        nsfw_result = self.nsfw_detector.detect(image)
-                        if not nsfw_result.is_safe:
-                            # no check required if user is prooved adult
+                        nsfw_result = verdict.nsfw
+                        if nsfw_result is not None and not nsfw_result.is_safe:
                             logger.info(f"Upload NSFW check: {nsfw_result.category}")
-                            if session_state.nsfw < 0: session_state.nsfw = 0
                             nsfwtoken = token // 2
                             if nsfw_result.category == NSFWCategory.EXPLICIT:
                                 nsfwtoken = token - 2
@@ -253,7 +389,6 @@ class UploadHandler:
                                 analytics_detected_content = "suggestive"
 
                             # token += nsfwtoken
-                            session_state.nsfw += nsfwtoken
                             if self.config.feature_allow_nsfw: msg += f"NSFW enabled for {nsfwtoken} generations."
 
                 except Exception as e:
@@ -262,39 +397,24 @@ class UploadHandler:
             if (token > 0):
                 self.analytics.record_new_upload(
                     content=analytics_detected_content,
-                    user_agent=request.headers["user-agent"],
-                    languages=request.headers["accept-language"]
+                    user_agent=user_agent,
+                    languages=languages
                 )
 
-                session_state.token += token
-                logger.info(f"Received token for upload: {token} - {msg}")
-                if msg != "":
-                    gr.Info(f"You received {token} new generation credits! \n\nNote: {msg}", duration=30)
-                else:
-                    gr.Info(f"Congratulation, you received {token} new generation credits!", duration=30)
-
-            else:
-                gr.Warning(msg, title="Upload failed")
+            with self._rewards_lock:
+                self._pending_rewards.setdefault(session, []).append(UploadReward(token=token, nsfw=nsfwtoken, msg=msg))
 
             # if token = 0, it was already claimed or it's failing the checks
-            if not self._uploaded_images_data.get(image_sha1):
-                self._uploaded_images_data[image_sha1] = {}
-            if not self._uploaded_images_data[image_sha1].get(session_state.session):
-                # split creation and assignment as old data might be in the object we want to keep
-                self._uploaded_images_data[image_sha1][session_state.session] = {}
-
-            self._uploaded_images_data[image_sha1][session_state.session]["token"] = token
-            self._uploaded_images_data[image_sha1][session_state.session]["msg"] = msg
-            self._uploaded_images_data[image_sha1][session_state.session]["timestamp"] = datetime.now().isoformat()
-            # now save the list to disk for reuse in later sessions
-            try:
-                with open(self.__uploaded_images_db_path, "w") as f:
-                    json.dump(self._uploaded_images_data, f, indent=4)
-            except Exception as e:
-                logger.error(f"Error while saving {self.__uploaded_images_db_path}: {e}")
+            self.history.record_upload(image_sha1, session, token, msg, datetime.now().isoformat())
+            self.image_index.add(fingerprint, kind="upload", key=image_sha1)
 
         except Exception as e:
-            logger.error(f"generate credits for uploaded image failed: {e}")
+            logger.error(f"analysis of uploaded image failed: {e}")
             logger.debug("Exception details:", exc_info=True)
             self.analytics.record_application_error(module="upload credits", criticality="error")
-        return session_state, gr.Button(interactive=False), None
+        finally:
+            if remove_image:
+                try:
+                    os.remove(image_path)
+                except OSError as e:
+                    logger.debug(f"removing the temporary copy of the upload failed with {e}")
@@ -8,9 +8,10 @@ import logging
 from app import SessionState
 from ..appconfig import AppConfig
 from app.utils.singleton import singleton
-from app.generators import ModelConfig
+from app.generators import (ModelConfig, PipelinePool, QueueFullException, SessionLimitException, CancellationToken,
+                            GenerationCancelledException)
+from app.generators import ExampleGallery, load_examples
 from ..analytics import Analytics
-import json
 from .components import UploadHandler, SessionManager, LinkSharingHandler, ImageGenerationHandler, FeedbackHandler, PromptAssistantHandler
 
 # Set up module logger
@@ -42,13 +43,24 @@ class GradioUI():
 
             self.analytics = Analytics(config=self.config)
             self.analytics.register_model(selectedmodel)
+
+            # optional additional models, all of them are served by the shared PipelinePool
+            selectable_modelconfigs = {}
+            for model in self.config.selectable_models:
+                modelconfig = ModelConfig.get_config(model=model, configs=modelconfigs)
+                if modelconfig is None or modelconfig.model != model or modelconfig.sanity_check() == False:
+                    logger.error(f"Selectable model '{model}' from env 'SELECTABLE_MODELS' is not valid and will be ignored")
+                    continue
+                selectable_modelconfigs[model] = modelconfig
+                self.analytics.register_model(model)
             self.component_session_manager = SessionManager(config=self.config, analytics=self.analytics)
 
             self.component_image_generator = ImageGenerationHandler(
                 session_manager=self.component_session_manager,
                 config=self.config,
                 analytics=self.analytics,
-                modelconfig=self.selectedmodelconfig
+                modelconfig=self.selectedmodelconfig,
+                selectable_modelconfigs=selectable_modelconfigs
             )
 
             self.component_upload_handler = None
@@ -103,15 +115,7 @@ class GradioUI():
     def initialize_examples(self):
         self.examples = []
         try:
-            if len(self.selectedmodelconfig.examples) > 0:
-                self.examples = self.selectedmodelconfig.examples
-                logger.info("Initialized examples from modelconfig")
-            else:
-                p = "./msgs/examples.json"
-                if os.path.exists(p):
-                    with open(p, "r") as f:
-                        self.examples = json.load(f)
-                logger.info(f"Initialized examples from '{p}'")
+            self.examples = load_examples(self.selectedmodelconfig)
         except Exception as e:
             logger.error(f"Error while loading examples: {e}")
             self.examples = [
@@ -122,12 +126,15 @@ class GradioUI():
                     1
                 ]
             ]
+        self.component_image_generator.register_examples(self.examples)
+        # pre-rendered images of the examples (tools/render_examples.py), shown without GPU work
+        self.example_gallery = ExampleGallery(directory=self.config.example_gallery_directory)
 
     def interval_cleanup_and_analytics(self):
         """is called every 60 secdonds and:
         * updates monitoring information
         * refreshes configuration
-        * unloading unused models
+        * offloading or unloading unused models
         """
         # logger.debug("tick - cleanup interval")
         try:
@@ -135,10 +142,15 @@ class GradioUI():
             x15_minutes_ago = datetime.now() - timedelta(minutes=timeout_minutes)
             self.component_session_manager.session_cleanup_and_analytics()
 
-            if self.app_last_image_generation < x15_minutes_ago and self.component_image_generator.generator._cached_generation_pipeline:
-                # no active user for x minutes, we can unload the model to free memory
+            pipeline_pool = PipelinePool()
+            if self.config.pipeline_offload_enabled:
+                # idle models are moved to CPU memory and later to disk, the next request promotes them back
+                pipeline_pool.offload_idle(cpu_after_minutes=timeout_minutes,
+                                           disk_after_minutes=self.config.pipeline_offload_disk_after_minutes)
+            elif self.app_last_image_generation < x15_minutes_ago and len(pipeline_pool.resident_models) > 0:
+                # no active user for x minutes, we can unload the models to free memory
                 logger.debug(f"No active user for {timeout_minutes} minutes. Unloading Generator Models from Memory")
-                self.component_image_generator.generator.unload_model()
+                pipeline_pool.unload_all()
         except Exception as e:
             logger.warning(f"Error in cleanup handler: {e}")
             self.analytics.record_application_error(module="cleanup", criticality="warning")
@@ -164,6 +176,9 @@ class GradioUI():
             languages=request.headers.get("accept-language", "en"),
             reference=reference_code)
 
+        if not self.component_image_generator.preloader.is_ready:
+            gr.Info("The AI system is starting right now. Your first images may take a bit longer.", duration=10)
+
     def uiaction_timer_check_token(self, gradio_state: str):
         if gradio_state is None:
             return None
@@ -176,15 +191,31 @@ class GradioUI():
         if self.config.feature_sharing_links_enabled:
             session_state, new_reference_token = self.component_link_sharing_handler.earn_link_rewards(session_state=session_state)
 
-        if self.config.feature_generation_credits_enabled and (new_timer_token + new_reference_token) > 0:
-            msgTimer = f"{new_timer_token} for waiting," if new_timer_token > 0 else ""
+        new_upload_token = 0
+        if self.component_upload_handler:
+            # uploads are analyzed in the background
+            session_state, new_upload_token = self.component_upload_handler.earn_upload_rewards(session_state=session_state)
+
+        if self.config.feature_generation_credits_enabled and (new_timer_token + new_reference_token + new_upload_token) > 0:
+            msgTimer = f"{new_timer_token} for waiting" if new_timer_token > 0 else ""
             msgReference = f"{new_reference_token} for sharing links" if new_reference_token > 0 else ""
-            gr.Info(f"Congratulation, you received new generation credits: {msgTimer} {msgReference}!", duration=0)
+            msgUpload = f"{new_upload_token} for uploaded images" if new_upload_token > 0 else ""
+            msg = ", ".join(m for m in (msgTimer, msgReference, msgUpload) if m)
+            gr.Info(f"Congratulation, you received new generation credits: {msg}!", duration=0)
 
         self.analytics.update_user_tokens(session_state.session, session_state.token)
         return session_state
 
-    def uiaction_generate_images(self, request: gr.Request, gr_state, prompt, aspect_ratio, neg_prompt, image_count, promptmagic_active, progress=gr.Progress()):
+    def uiaction_show_example(self, selection: gr.SelectData):
+        """show the pre-rendered images of the selected example and load its prompt"""
+        model = self.selectedmodelconfig.model
+        images = self.example_gallery.images(model, selection.index)
+        prompt = self.example_gallery.examples(model)[selection.index]["prompt"] if images else gr.skip()
+        logger.debug(f"Example {selection.index} selected with {len(images)} pre-rendered images")
+        return images, prompt
+
+    def uiaction_generate_images(self, request: gr.Request, gr_state, prompt, aspect_ratio, neg_prompt, image_count, promptmagic_active,
+                                 model, progress=gr.Progress()):
         """
         Generate images based on the given prompt and aspect ratio.
 
@@ -192,6 +223,10 @@ class GradioUI():
             prompt (str): The text prompt for image generation
             aspect_ratio (str): The aspect ratio for the generated image
             image_count (int): The number of images to generate
+            model (str): The selected model, the default model is used if unknown
+
+        Yields:
+            tuple: (images, session state, prompt), previews are streamed to the gallery while generating
         """
         session_state = SessionState.from_gradio_state(gr_state)
         try:
@@ -226,7 +261,8 @@ class GradioUI():
                 logger.info("User %s attempted generation with insufficient credits (%s needed, %s available)",
                             session_state.session, image_count, session_state.token)
                 gr.Warning(msg, title="Image generation failed", duration=30)
-                return [], session_state, ""
+                yield [], session_state, ""
+                return
 
             if self.component_link_sharing_handler:
                 try:
@@ -238,17 +274,48 @@ class GradioUI():
                     logger.error("Failed to record image generation for shared link: %s", str(e))
                     # Continue execution as this is not critical for image generation
 
+            # stops the generation if the client disconnects or the request takes too long
+            cancel_token = CancellationToken(timeout_seconds=self.config.generation_timeout_seconds)
             try:
                 progress(0.05, desc="start generation")
-                generated_images, session_state, prompt = self.component_image_generator.generate_images(
+                generated_images, session_state, prompt = yield from self.component_image_generator.generate_images(
                     progress=progress,
                     session_state=session_state,
                     prompt=prompt,
                     neg_prompt=neg_prompt,
                     aspect_ratio=aspect_ratio,
                     image_count=image_count,
-                    user_activated_promptmagic=promptmagic_active
+                    user_activated_promptmagic=promptmagic_active,
+                    model=model,
+                    cancel_token=cancel_token
                 )
+            except GeneratorExit:
+                # gradio closes the generator if the request was cancelled or the client disconnected
+                logger.info("Image generation request of %s closed, cancel generation", session_state.session)
+                cancel_token.cancel(reason="client disconnected")
+                raise
+            except GenerationCancelledException as e:
+                logger.info("Image generation for %s stopped: %s", session_state.session, str(e))
+                if cancel_token.reason == "timeout":
+                    gr.Warning("Your image generation took too long and was stopped. Please try again in a few minutes.",
+                               title="Image generation not possible", duration=30)
+                else:
+                    gr.Warning("Your image generation was stopped. Please try again.",
+                               title="Image generation not possible", duration=30)
+                yield [], session_state, prompt
+                return
+            except SessionLimitException as e:
+                logger.info("Image generation rejected for %s: %s", session_state.session, str(e))
+                gr.Warning("You already have an image generation running. Please wait until it is finished.",
+                           title="Image generation not possible", duration=30)
+                yield [], session_state, prompt
+                return
+            except QueueFullException as e:
+                logger.info("Image generation rejected for %s: %s", session_state.session, str(e))
+                gr.Warning("Our servers are very busy right now. Please try again in a few minutes.",
+                           title="Image generation not possible", duration=30)
+                yield [], session_state, prompt
+                return
             except Exception as e:
                 logger.error("Image generation failed: %s", str(e))
                 logger.debug("Image generation exception details:", exc_info=True)
@@ -267,13 +334,13 @@ class GradioUI():
                 logger.warning(f"session {session_state.session} is out of credits ({session_state.token}) left")
 
             progress(1, "image generation finished")
-            return generated_images, session_state, prompt
+            yield generated_images, session_state, prompt
         except Exception as e:
             logger.error(f"image generation failed: {e}")
             logger.debug("Exception details:", exc_info=True)
 
             gr.Warning(f"Error while generating the image: {e}", title="Image generation failed", duration=30)
-            return [], session_state, prompt
+            yield [], session_state, prompt
 
     def create_interface(self):
 
@@ -333,22 +400,37 @@ class GradioUI():
                                             variant="primary"
                                         )
 
-                    with gr.TabItem("Examples", visible=len(self.examples) > 0):
-                        def example_selected(self):
-                            # FIXME generation_tabs.selected = tabText #is not working in any variation
-                            gr.Info(
-                                message=f"Switch now back to the Tab '{tabText.label}' and click 'Start' to generate this image.",
-                                title="Example selected"
+                    example_thumbnails = self.example_gallery.thumbnails(self.selectedmodelconfig.model)
+                    gr_example_gallery = None
+                    with gr.TabItem("Examples", visible=len(self.examples) > 0 or len(example_thumbnails) > 0):
+                        if example_thumbnails:
+                            # pre-rendered examples, the images are shown without generation
+                            gr_example_gallery = gr.Gallery(
+                                value=example_thumbnails,
+                                label="Click an example to show it",
+                                show_share_button=False,
+                                show_download_button=False,
+                                allow_preview=False,
+                                columns=4,
+                                height="auto",
+                                object_fit="cover"
                             )
+                        else:
+                            def example_selected(self):
+                                # FIXME generation_tabs.selected = tabText #is not working in any variation
+                                gr.Info(
+                                    message=f"Switch now back to the Tab '{tabText.label}' and click 'Start' to generate this image.",
+                                    title="Example selected"
+                                )
 
-                        # Examples
-                        gr.Examples(
-                            examples=self.examples,
-                            fn=example_selected,
-                            run_on_click=True,
-                            inputs=[gr_freestyle_prompt],
-                            label="Click an example to load it"
-                        )
+                            # Examples
+                            gr.Examples(
+                                examples=self.examples,
+                                fn=example_selected,
+                                run_on_click=True,
+                                inputs=[gr_freestyle_prompt],
+                                label="Click an example to load it"
+                            )
 
             # Advanced row
             with gr.Row():
@@ -380,6 +462,15 @@ class GradioUI():
                                         label="Aspect Ratio",
                                         scale=1
                                     )
+                                with gr.Row():
+                                    models = list(self.component_image_generator.selectable_modelconfigs.keys())
+                                    model_selection = gr.Dropdown(
+                                        choices=models,
+                                        value=self.selectedmodelconfig.model,
+                                        label="Model",
+                                        visible=len(models) > 1,
+                                        scale=1
+                                    )
                             with gr.Column(visible=True, scale=3):
                                 gr.Markdown("Did you miss something here? Let us know!")
 
@@ -515,9 +606,11 @@ class GradioUI():
                 outputs=[]
             ).then(
                 fn=self.uiaction_generate_images,
-                inputs=[user_session_storage, gr_assistant_prompt, aspect_ratio, neg_prompt, image_count, prompt_magic_checkbox],
+                inputs=[user_session_storage, gr_assistant_prompt, aspect_ratio, neg_prompt, image_count, prompt_magic_checkbox,
+                        model_selection],
                 outputs=[gallery, user_session_storage, magic_prompt],
                 concurrency_id="gpu",
+                concurrency_limit=None,  # queuing and load shedding is done by the GenerationScheduler
                 show_progress="full",
                 show_progress_on=[token_label, gr_assistant_token_info]
             ).then(
@@ -542,9 +635,11 @@ class GradioUI():
                 outputs=[]
             ).then(
                 fn=self.uiaction_generate_images,
-                inputs=[user_session_storage, gr_freestyle_prompt, aspect_ratio, neg_prompt, image_count, prompt_magic_checkbox],
+                inputs=[user_session_storage, gr_freestyle_prompt, aspect_ratio, neg_prompt, image_count, prompt_magic_checkbox,
+                        model_selection],
                 outputs=[gallery, user_session_storage, magic_prompt],
                 concurrency_id="gpu",
+                concurrency_limit=None,  # queuing and load shedding is done by the GenerationScheduler
                 show_progress="full",
                 show_progress_on=token_label
             ).then(
@@ -559,6 +654,16 @@ class GradioUI():
                 outputs=[feedback_txt]
             )
 
+            if gr_example_gallery:
+                gr_example_gallery.select(
+                    fn=self.uiaction_show_example,
+                    inputs=None,
+                    outputs=[gallery, gr_freestyle_prompt],
+                    concurrency_limit=None,
+                    show_api=False,
+                    show_progress=False
+                )
+
             def prepare_download(selection: gr.SelectData):
                 # gr.Warning(f"Your choice is #{selection.index}, with image: {selection.value['image']['path']}!")
                 # Create a custom filename (for example, using timestamp)
@@ -595,6 +700,7 @@ class GradioUI():
         if self.interface is None:
             self.create_interface()
         self.scheduler.start()
+        # runs in the background while gradio is already serving the UI
+        self.component_image_generator.start_preload()
         self.interface.launch(**kwargs)
-        # self.generator.warmup()
-        # gr.Interface.from_pipeline(self.generator._cached_generation_pipeline).launch()
+        # gr.Interface.from_pipeline(self.generator._load_model()).launch()
@@ -0,0 +1,133 @@
+"""
+Upload History Module
+
+History of uploaded and generated images in an embedded SQLite database. Every upload and
+every generated image is a single indexed row, so writes don't depend on the size of the
+history. WAL mode lets the request threads read while the upload jobs write.
+
+Classes:
+    UploadHistory: Uploaded and generated images by content hash
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UploadHistory:
+    """
+    Uploaded and generated images by content hash.
+
+    Args:
+        path (str): Path of the SQLite database, ':memory:' for a temporary history
+
+    Notes:
+        - Uploads are stored per (image hash, session) with the received credits and message
+        - Generated images are only stored by hash, they can't be uploaded for credits
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS uploads (
+            image_hash TEXT NOT NULL,
+            session TEXT NOT NULL,
+            token INTEGER NOT NULL DEFAULT 0,
+            msg TEXT NOT NULL DEFAULT '',
+            timestamp TEXT,
+            PRIMARY KEY (image_hash, session)
+        );
+        CREATE TABLE IF NOT EXISTS created_images (
+            image_hash TEXT PRIMARY KEY,
+            timestamp TEXT
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # one connection shared by all threads, the lock serializes the access
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # WAL with NORMAL sync is still consistent after a crash, only the last commits could be lost
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return (self._connection.execute("SELECT 1 FROM uploads LIMIT 1").fetchone() is None
+                    and self._connection.execute("SELECT 1 FROM created_images LIMIT 1").fetchone() is None)
+
+    def get_upload(self, image_hash: str) -> Dict[str, dict]:
+        """uploads of the image per session as {session: {"token", "msg", "timestamp"}}, empty if unknown"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT session, token, msg, timestamp FROM uploads WHERE image_hash = ?", (image_hash,)).fetchall()
+        return {session: {"token": token, "msg": msg, "timestamp": timestamp} for session, token, msg, timestamp in rows}
+
+    def record_upload(self, image_hash: str, session: str, token: int, msg: str = "", timestamp: str = None):
+        """insert or update the upload of the image by the session"""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO uploads (image_hash, session, token, msg, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (image_hash, session, token, msg, timestamp))
+
+    def is_created(self, image_hash: str) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT 1 FROM created_images WHERE image_hash = ?", (image_hash,)).fetchone() is not None
+
+    def add_created(self, image_hashes: Iterable[str]):
+        """mark generated images, known hashes are ignored"""
+        timestamp = datetime.now().isoformat()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO created_images (image_hash, timestamp) VALUES (?, ?)",
+                [(image_hash, timestamp) for image_hash in image_hashes])
+
+    def import_json(self, uploaded_images_path: str = None, created_images_path: str = None) -> Tuple[int, int]:
+        """
+        Import the former JSON databases, existing rows are kept.
+
+        Args:
+            uploaded_images_path (str): Path of uploaded_images.json ({hash: {session: {"token", "msg", "timestamp"}}})
+            created_images_path (str): Path of created_images.json ({hash: true})
+
+        Returns:
+            Tuple[int, int]: Amount of imported uploads and created images
+        """
+        uploads, created = [], []
+        if uploaded_images_path and os.path.exists(uploaded_images_path):
+            with open(uploaded_images_path, "r") as f:
+                for image_hash, sessions in json.load(f).items():
+                    for session, upload in (sessions or {}).items():
+                        uploads.append((image_hash, session, int(upload.get("token", 0)),
+                                        upload.get("msg", ""), upload.get("timestamp")))
+        if created_images_path and os.path.exists(created_images_path):
+            with open(created_images_path, "r") as f:
+                created = [(image_hash, None) for image_hash, value in json.load(f).items() if value]
+
+        with self._lock:
+            # one transaction, an interrupted import doesn't leave a partial history
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO uploads (image_hash, session, token, msg, timestamp) VALUES (?, ?, ?, ?, ?)", uploads)
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO created_images (image_hash, timestamp) VALUES (?, ?)", created)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return len(uploads), len(created)
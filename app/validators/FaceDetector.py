@@ -1,4 +1,6 @@
 import os
+import queue
+from contextlib import contextmanager
 from PIL import Image, ImageOps # for image handling
 import numpy as np              # converting PIL to CV2
 import logging
@@ -7,7 +9,9 @@ import threading
 from app.utils.singleton import singleton
 
 import cv2                      # prepare images for face recognition
+import onnxruntime
 from insightface.app import FaceAnalysis    # face boxes detection
+from insightface.app.common import Face
 
 # Set up module logger
 logger = logging.getLogger(__name__)
@@ -24,34 +28,171 @@ class FaceAnalysisEnhanced(FaceAnalysis):
 
         return super().get(img, max_num)
 
+    def get_multi_scale(self, img, det_sizes):
+        """
+        Detect faces on an image pyramid in a single pass. Only the detector runs on every scale,
+        the candidates of all scales are merged by one NMS and the landmark, age and recognition
+        models run only on the final boxes.
+
+        Args:
+            img (np.ndarray): Image in the format of get()
+            det_sizes (list): Detection sizes (width, height) of the pyramid levels
+
+        Returns:
+            list: Detected faces as returned by get()
+        """
+        detector = self.det_model
+        candidates, keypoints = [], []
+        for det_size in det_sizes:
+            det_img, det_scale = self._letterbox(img, det_size)
+            scores_list, bboxes_list, kpss_list = detector.forward(det_img, detector.det_thresh)
+            scores = np.vstack(scores_list) if scores_list else np.empty((0, 1), dtype=np.float32)
+            if scores.size == 0:
+                continue
+            candidates.append(np.hstack((np.vstack(bboxes_list) / det_scale, scores)))
+            if detector.use_kps:
+                keypoints.append(np.vstack(kpss_list) / det_scale)
+        if not candidates:
+            return []
+
+        pre_det = np.vstack(candidates).astype(np.float32, copy=False)
+        order = pre_det[:, 4].argsort()[::-1]
+        pre_det = pre_det[order, :]
+        kpss = np.vstack(keypoints)[order] if keypoints else None
+        faces = []
+        for index in detector.nms(pre_det):
+            face = Face(bbox=pre_det[index, 0:4], kps=kpss[index] if kpss is not None else None, det_score=pre_det[index, 4])
+            for taskname, model in self.models.items():
+                if taskname == 'detection':
+                    continue
+                model.get(img, face)
+            faces.append(face)
+        return faces
+
+    def _letterbox(self, img, det_size):
+        """image resized into the detection size with kept aspect ratio as the detector does, and the used scale"""
+        width, height = det_size
+        if img.shape[0] / img.shape[1] > height / width:
+            new_height, new_width = height, int(height * img.shape[1] / img.shape[0])
+        else:
+            new_height, new_width = int(width * img.shape[0] / img.shape[1]), width
+        det_img = np.zeros((height, width, 3), dtype=np.uint8)
+        det_img[:new_height, :new_width, :] = cv2.resize(img, (new_width, new_height))
+        return det_img, new_height / img.shape[0]
+
+
+class FaceAnalysisPool():
+    """
+    Pool of face analysis sessions, every session is used by one thread at a time.
+
+    Sessions are created on demand when all existing sessions are busy, so the pool only
+    grows to max_size under concurrent load and an idle server keeps a single session.
+
+    Args:
+        factory: Creates a new prepared FaceAnalysisEnhanced instance
+        max_size (int): Maximum amount of sessions
+    """
+
+    def __init__(self, factory, max_size: int):
+        self._factory = factory
+        self.max_size = max(1, max_size)
+        self._idle = queue.LifoQueue()  # the most recently used session has warm caches
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """amount of created sessions"""
+        return self._created
+
+    def checkout(self, timeout: float = None):
+        """idle session, a new session if all are busy and the pool is not full, otherwise wait for a returned session"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.max_size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                logger.debug(f"Create face analysis session {self._created} of {self.max_size}")
+                return self._factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=timeout)
+
+    def checkin(self, session):
+        """return a session of checkout to the pool"""
+        self._idle.put(session)
+
+    @contextmanager
+    def session(self, timeout: float = None):
+        session = self.checkout(timeout=timeout)
+        try:
+            yield session
+        finally:
+            self.checkin(session)
+
+
 @singleton
 class FaceDetector():
-    def __init__(self):
-        logger.info("Initializing FaceDetector")
-        self.thread_lock = threading.Lock()
+    """
+    Face and age detection of uploaded images with a pool of insightface sessions.
+
+    Args:
+        pool_size (int): Maximum amount of parallel sessions, 0 = cpu cores / intra_op_threads
+        intra_op_threads (int): Threads of onnxruntime used by one inference
+        inter_op_threads (int): Threads of onnxruntime to run independent nodes of a graph in parallel
+    """
+    # pyramid of the second pass if no face was found with the default size, smaller sizes find faces
+    # which fill the image. Replaces the former retry with nine sizes in steps of 64 pixels.
+    REDUCED_DETECTION_SIZES = [(512, 512), (384, 384), (256, 256)]
+
+    def __init__(self, pool_size: int = 0, intra_op_threads: int = 2, inter_op_threads: int = 1):
+        self.intra_op_threads = max(1, intra_op_threads)
+        self.inter_op_threads = max(1, inter_op_threads)
+        if pool_size <= 0:
+            # every session uses its own onnxruntime threads, more sessions than cores only compete for the cpu
+            pool_size = max(1, (os.cpu_count() or 1) // self.intra_op_threads)
+        logger.info(f"Initializing FaceDetector with up to {pool_size} sessions and {self.intra_op_threads} threads each")
 
         #https://github.com/onnx/models/blob/main/validated/vision/body_analysis/emotion
         # _ferplus/model/emotion-ferplus-2.onnx
         #ctx_id =0 GPU, -1=CPU, 1,2, select GPU to be used
         self.ctx_id = -1 #to save gpu memory
-        #providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-        providers = ['CPUExecutionProvider']
+        self.pool = FaceAnalysisPool(factory=self._create_face_analysis, max_size=pool_size)
         try:
-            #smallest: buffalo_sc but problems for some faces (blurry, mirror etc)
-            # buffalo_l: much better detection, but don't trust age detection
-            #FIXME: antelopev2 does not work (git issue is open) https://github.com/deepinsight/insightface/issues/2725
-            self.face_detector = FaceAnalysisEnhanced(name="buffalo_l", providers=providers)  # https://github.com/deepinsight/insightface/tree/master/model_zoo
-            self.face_detector.prepare(ctx_id=self.ctx_id, det_size=(512,512))
+            # the first session is created at start to report missing models early
+            self.pool.checkin(self.pool.checkout())
             logger.debug("FaceDetector initialization done")
         except Exception as e:
             logger.error("Error while initializing FaceDetector: %s", str(e))
             logger.debug("Exception details:", exc_info=True)
+            self.pool = None
+
+    def _create_face_analysis(self) -> FaceAnalysisEnhanced:
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = self.intra_op_threads
+        session_options.inter_op_num_threads = self.inter_op_threads
+        #providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+        providers = ['CPUExecutionProvider']
+        #smallest: buffalo_sc but problems for some faces (blurry, mirror etc)
+        # buffalo_l: much better detection, but don't trust age detection
+        #FIXME: antelopev2 does not work (git issue is open) https://github.com/deepinsight/insightface/issues/2725
+        # https://github.com/deepinsight/insightface/tree/master/model_zoo
+        face_analysis = FaceAnalysisEnhanced(name="buffalo_l", providers=providers, sess_options=session_options)
+        face_analysis.prepare(ctx_id=self.ctx_id, det_size=(512,512))
+        return face_analysis
 
     def get_faces(self, pil_image: Image):
         """ return values are a list of dictionaries. if len=0, then no face was detected"""
         retVal = []
         cv2_image = None
-        if self.face_detector == None: return retVal, cv2_image
+        if self.pool is None: return retVal, cv2_image
         try:
             # reduce size if it is a big image to process it faster
             max_size = 1024
@@ -69,10 +210,9 @@ class FaceDetector():
 
             #size = scaling to for face detection (smaller = faster)
             #if size is bigger then the image size, we got no detection so 512x512 is fine
-            with self.thread_lock:
-                faces = self.face_detector.get(cv2_image)
-
-            if len(faces)==0: faces = self._reduced_detection_site_detection(cv2_image)
+            with self.pool.session() as face_analysis:
+                faces = face_analysis.get(cv2_image)
+                if len(faces)==0: faces = self._reduced_detection_site_detection(face_analysis, cv2_image)
             for face in faces:
                 #print ("Face bbox", face['bbox'])
                 x1, y1, x2, y2 = map(int, face.bbox)
@@ -86,18 +226,14 @@ class FaceDetector():
         return retVal, cv2_image
 
 
-    def _reduced_detection_site_detection(self, cv2_image):
+    def _reduced_detection_site_detection(self, face_analysis: FaceAnalysisEnhanced, cv2_image):
         """ return values are a list of dictionaries. if len=0, then no face was detected"""
         try:
             logger.debug("startin enhanced detection with different detection sizes")
-            detection_sizes = [None] + [(size, size) for size in range(640, 256, -64)] + [(256, 256)]
-            with self.thread_lock:
-                for size in detection_sizes:
-                    faces = self.face_detector.get(cv2_image, det_size=size)
-                    if len(faces) > 0:
-                        logger.debug(f"Detected  {len(faces)} Faces with reduced detection size of {size}")
-                        return faces
-            
+            faces = face_analysis.get_multi_scale(cv2_image, det_sizes=self.REDUCED_DETECTION_SIZES)
+            if len(faces) > 0:
+                logger.debug(f"Detected  {len(faces)} Faces with reduced detection sizes")
+            return faces
         except Exception as e:
             logger.error("Error while detecting face with reduced_detection_site_detection: %s", str(e))
             logger.debug("Exception details:", exc_info=True)
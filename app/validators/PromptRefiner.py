@@ -1,10 +1,13 @@
 
+import json
 import os
+import re
 import threading
+import time
 import logging
-from langchain_ollama import ChatOllama
+from typing import Dict, Optional, Tuple
 from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
-from ollama import Client
+from .ollama_client import OllamaChat, OllamaClient, OllamaUnavailableException
 
 logger = logging.getLogger(__name__)
 # no need for Singleton, as the Ollama Server takes care for model loading
@@ -14,40 +17,68 @@ class PromptRefiner():
     """
     Analyze the prompts and optimize it
     the optimization includes also applying rules
+
+    Args:
+        classification_mode (str): 'structured' asks all NSFW checks in one call with a JSON answer,
+            'per_question' asks one check per call. Default is 'structured'
+        verdict_cache (PromptVerdictCache): Optional cache of the NSFW verdicts, must be created for the same model
+        prefilter (PromptPrefilter): Optional local pre-filter, only prompts it can't decide are checked by the LLM
+        analytics (Analytics): Optional analytics instance to report the decisions and latency per tier
+        max_rewrite_iterations (int): Maximum rewrites of a NSFW prompt in make_prompt_sfw
+        max_rewrite_calls (int): Maximum LLM calls of make_prompt_sfw incl. the NSFW checks, at least one check and one iteration
+        max_rewrite_seconds (float): No further rewrite is started after this time
+        client (OllamaClient): Client of the Ollama server, default is a client of OLLAMA_SERVER and OLLAMA_MODEL
+
+    Notes:
+        - If Ollama fails or the circuit breaker of the client is open, the checks fall back to the
+          pre-filter, prompts with ambiguous terms are NSFW, and the rewrites return the prompt unchanged
     """
 
-    def __init__(self):
+    # NSFW category -> question of the check
+    NSFW_CHECKS = {
+        "nudity": ("Contains the text explicit or implicit depictions of nudity or porn including the words naked, nude? "
+                   "Ignore underwear or lingerie!"),
+        "genitals": "Contains the text mentioning of genitals?",
+        "death": "Contains the text mentioning of death or killed people?",
+    }
+    CLASSIFICATION_MODES = ("structured", "per_question")
+
+    def __init__(self, classification_mode: str = None, verdict_cache=None, prefilter=None, analytics=None,
+                 max_rewrite_iterations: int = 3, max_rewrite_calls: int = 10, max_rewrite_seconds: float = 30,
+                 client: OllamaClient = None):
         logger.info("Initializing PromptRefiner")
+        self.max_rewrite_iterations = max(1, max_rewrite_iterations)
+        self.max_rewrite_calls = max_rewrite_calls
+        self.max_rewrite_seconds = max_rewrite_seconds
+        # LLM calls and tokens of the current make_prompt_sfw of the thread
+        self._usage = threading.local()
+        self.verdict_cache = verdict_cache
+        self.prefilter = prefilter
+        self.analytics = analytics
+        self.classification_mode = (classification_mode or "structured").strip().lower()
+        if self.classification_mode not in self.CLASSIFICATION_MODES:
+            logger.warning(f"Unknown classification mode '{self.classification_mode}', using 'structured'")
+            self.classification_mode = "structured"
+        self.max_rewrite_calls = max(self.max_rewrite_calls, 1 + 2 * self._max_check_calls())
         self.thread_lock = threading.Lock()
         # self.model ="llama3.2" #prefered, but partial issues with prompt enhance
-        self.model = os.getenv("OLLAMA_MODEL", "llava").strip()
-        self.ollama_server = os.getenv("OLLAMA_SERVER", None)
-
-        self.llm = None
-        try:
-            olc = Client(self.ollama_server)
-            olc.pull(self.model)
-            self.llm = ChatOllama(
-                model=self.model,
-                server=self.ollama_server,
-                temperature=0,
-            )
-        except Exception as e:
-            logger.error(f"Initialize llm for PromptRefiner failed {e}")
-
-        try:
-            self.llm_creative = ChatOllama(
-                model=self.model,
-                server=self.ollama_server,
-                temperature=0.6,
-            )
-        except Exception as e:
-            logger.error(f"Initialize llm for PromptRefiner failed {e}")
+        self.client = client or OllamaClient(
+            server=os.getenv("OLLAMA_SERVER", None), model=os.getenv("OLLAMA_MODEL", "llava").strip(), analytics=analytics)
+        self.model = self.client.model
+        self.ollama_server = self.client.server
+        # the model is downloaded in the background, validate_refiner_is_ready waits for it
+        self.client.pull()
+
+        self.llm = OllamaChat(self.client, temperature=0)
+        # same model, Ollama constrains the answer to valid JSON
+        self.llm_json = OllamaChat(self.client, temperature=0, format="json")
+        self.llm_creative = OllamaChat(self.client, temperature=0.6)
 
     def validate_refiner_is_ready(self) -> bool:
         validation = True
         try:
             if self.llm is None: raise Exception("llm not initialized")
+            if not self.client.wait_for_model(): raise Exception(f"model {self.model} not available")
             messages = [
                 SystemMessage("You answer only with yes and no."),
                 HumanMessage("Are you ready to work for me?"),
@@ -66,17 +97,155 @@ class PromptRefiner():
         nsfw, _ = self.check_contains_nsfw(prompt=prompt)
         return not nsfw
 
-    # def contains_nsfw(self, prompt: str, include_rule_violations: bool=False) -> bool:
-    def check_contains_nsfw(self, prompt: str) -> bool:
-        """Validates if the prompt contains NSFW"""
+    def check_contains_nsfw(self, prompt: str) -> Tuple[bool, str]:
+        """
+        Validates if the prompt contains NSFW.
+
+        Args:
+            prompt (str): Prompt to check
+
+        Returns:
+            Tuple[bool, str]: True if NSFW was detected, and the reason
+        """
+        decision = None
+        if self.prefilter is not None:
+            started = time.perf_counter()
+            decision = self.prefilter.classify(prompt)
+            self._record_check(decision.tier, decision.nsfw, started)
+            if decision.nsfw is not None:
+                return decision.nsfw, decision.reason
+
         if not self.llm: return False, "no llm available"
 
-        # now check for NSFW
-        checks = [
-            "Contains the text explicit or implicit depictions of nudity or porn including the words naked, nude? Ignore underwear or lingerie!",
-            "Contains the text mentioning of genitals?",
-            "Contains the text mentioning of death or killed people?",
+        if self.verdict_cache is not None:
+            started = time.perf_counter()
+            verdict = self.verdict_cache.get(prompt)
+            if verdict is not None:
+                logger.debug(f"cached NSFW verdict: {verdict}")
+                self._record_check("cache", verdict[0], started)
+                return verdict
+
+        started = time.perf_counter()
+        result = None
+        try:
+            if self.classification_mode == "structured":
+                result = self._check_contains_nsfw_structured(prompt)
+                # None = answer couldn't be parsed, ask the questions one by one
+            if result is None:
+                result = self._check_contains_nsfw_per_question(prompt)
+        except OllamaUnavailableException as e:
+            logger.warning(f"NSFW check of prompt without LLM: {e}")
+            if decision is not None and decision.ambiguous:
+                # fail closed, only the LLM could tell if the ambiguous terms are used in a safe context
+                self._record_check("fallback", True, started)
+                return True, f"llm unavailable, ambiguous terms: {', '.join(decision.ambiguous)}"
+            # the pre-filter found no listed term, the generated images are still checked by the NSFW detector
+            self._record_check("fallback", False, started)
+            return False, "llm unavailable"
+        self._record_check("llm", result[0], started)
+
+        if self.verdict_cache is not None:
+            self.verdict_cache.put(prompt, *result)
+        return result
+
+    def _record_check(self, tier: str, nsfw: Optional[bool], started: float):
+        if self.analytics:
+            verdict = "ambiguous" if nsfw is None else "nsfw" if nsfw else "sfw"
+            self.analytics.record_prompt_check(tier=tier, verdict=verdict, duration_seconds=time.perf_counter() - started)
+
+    def _check_contains_nsfw_structured(self, prompt: str) -> Optional[Tuple[bool, str]]:
+        """all checks in one call with a JSON answer, None if the answer can't be parsed"""
+        llm = self.llm_json or self.llm
+        questions = "\n".join(f'- "{category}": {question}' for category, question in self.NSFW_CHECKS.items())
+        example = {category: {"flag": False, "reason": ""} for category in self.NSFW_CHECKS}
+        messages = [
+            SystemMessage(
+                "You check texts without speculating. Use only the given input. Answer every question for the text "
+                "with a JSON object which contains for every category a boolean 'flag' and a short 'reason', if the flag is true.\n"
+                f"Questions:\n{questions}"),
+            HumanMessage("Text to check: 'a girl'"),
+            AIMessage(json.dumps(example)),
+            HumanMessage("Text to check: 'a woman in lingerie'"),
+            AIMessage(json.dumps(example | {"nudity": {"flag": False, "reason": "Lingerie and underwear is not counted as nude"}})),
+            HumanMessage("Text to check: 'a naked man next to a dead body'"),
+            AIMessage(json.dumps(example | {"nudity": {"flag": True, "reason": "naked man"},
+                                            "death": {"flag": True, "reason": "dead body"}})),
+            HumanMessage(f"Text to check: '{prompt}'"),
         ]
+        try:
+            ai_msg = self._invoke(llm, messages)
+        except OllamaUnavailableException:
+            raise
+        except Exception as e:
+            logger.warning(f"Structured NSFW check failed with {e}")
+            return None
+
+        verdict = self.parse_nsfw_verdict(ai_msg.content)
+        if verdict is None:
+            logger.warning(f"Unable to parse NSFW check answer: '{ai_msg.content}'")
+            return None
+        reasons = [f"{category}: {reason}" if reason else category for category, (flag, reason) in verdict.items() if flag]
+        if reasons:
+            logger.debug(f"detected nsfw in prompt: {reasons}")
+            return True, "; ".join(reasons)
+        return False, ""
+
+    @classmethod
+    def parse_nsfw_verdict(cls, content: str) -> Optional[Dict[str, Tuple[bool, str]]]:
+        """
+        Parse the JSON answer of the structured NSFW check.
+
+        Accepts code fences and text around the JSON object, and per category either an object
+        with 'flag' (or 'value', 'answer') and 'reason', a boolean or a yes/no string.
+
+        Args:
+            content (str): Answer of the llm
+
+        Returns:
+            Optional[Dict[str, Tuple[bool, str]]]: (flag, reason) per category, None if a category is missing
+        """
+        start = content.find("{") if content else -1
+        if start < 0:
+            return None
+        try:
+            data, _ = json.JSONDecoder().raw_decode(content[start:])
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+
+        answers = {re.sub(r"[^a-z]", "", str(key).lower()): value for key, value in data.items()}
+        verdict = {}
+        for category in cls.NSFW_CHECKS:
+            if category not in answers:
+                return None
+            value, reason = answers[category], ""
+            if isinstance(value, dict):
+                reason = str(value.get("reason", "") or "")
+                value = next((value[key] for key in ("flag", "value", "answer", "contains") if key in value), None)
+            flag = cls._parse_flag(value)
+            if flag is None:
+                return None
+            verdict[category] = (flag, reason)
+        return verdict
+
+    @staticmethod
+    def _parse_flag(value) -> Optional[bool]:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)):
+            return value != 0
+        if isinstance(value, str):
+            answer = value.strip().lower()
+            if answer.startswith(("yes", "true")):
+                return True
+            if answer.startswith(("no", "false")):
+                return False
+        return None
+
+    def _check_contains_nsfw_per_question(self, prompt: str) -> Tuple[bool, str]:
+        """one call per check, every call sends the whole conversation"""
+        checks = list(self.NSFW_CHECKS.values())
 
         messages = [
             SystemMessage("You have to answer users questions without speculating. Use only the given input. User is asking Yes/No questions and you have to answer with yes or no. Explain why, if you decide for yes"),
@@ -113,7 +282,7 @@ class PromptRefiner():
 
         for check in checks:
             messages.append(HumanMessage(check))
-            ai_msg = self.llm.invoke(messages)
+            ai_msg = self._invoke(self.llm, messages)
             messages.append(ai_msg)
             lower_response = ai_msg.content.lower()
             if "yes" in lower_response:
@@ -170,34 +339,70 @@ class PromptRefiner():
         #     logger.debug(ai_msg.content)
         #     return prompt
 
+    def _invoke(self, llm, messages):
+        """invoke the llm and count the call and its tokens for the budget of make_prompt_sfw"""
+        ai_msg = llm.invoke(messages)
+        if getattr(self._usage, "active", False):
+            self._usage.calls += 1
+            usage = getattr(ai_msg, "usage_metadata", None) or {}
+            self._usage.tokens += usage.get("total_tokens", 0)
+        return ai_msg
+
     def make_prompt_sfw(self, prompt: str, is_nsfw: bool = False) -> str:
-        if not self.llm: return prompt
-        i = 0
-        if not is_nsfw:
-            logger.debug("analyze image")
-            is_nsfw, reasons = self.check_contains_nsfw(prompt)
-            logger.debug(f"result NSFW check:{is_nsfw}, message: '{reasons}'")
-
-        while is_nsfw and i < 10:
-            # we need to loop because sometimes not all content is removed on first run
-            prompt = self._executor_make_prompt_sfw(prompt)
-            is_nsfw, reasons = self.check_contains_nsfw(prompt)
-            i += 1
-
-        if i > 1: logger.debug(f"looped {i} times to make prompt sfw")
-        return prompt
+        """
+        Rewrite the prompt until it doesn't contain NSFW, within the rewrite budget.
 
-    def _executor_make_prompt_sfw(self, prompt: str) -> str:
-        if not self.llm: return prompt
+        Every iteration is one rewrite call with all rules and one NSFW check. The rewrite stops
+        after max_rewrite_iterations, max_rewrite_calls or max_rewrite_seconds, the last rewrite is returned.
 
-        system_message = """
-        The user provides always an image description. You have to rewrite it by given tasks.
-        Don't explain yourself. Only return the optimized text.
-        Keep maturity, age, gender and country in any of the tasks you execute.
+        Args:
+            prompt (str): Prompt to rewrite
+            is_nsfw (bool): True if the prompt is already known as NSFW, the first check is skipped
+
+        Returns:
+            str: The rewritten prompt, or the prompt if it doesn't contain NSFW
         """
+        if not self.llm: return prompt
+        started = time.perf_counter()
+        self._usage.active, self._usage.calls, self._usage.tokens = True, 0, 0
+        iterations, reasons, outcome = 0, "", "sfw"
+        try:
+            if not is_nsfw:
+                logger.debug("analyze image")
+                is_nsfw, reasons = self.check_contains_nsfw(prompt)
+                logger.debug(f"result NSFW check:{is_nsfw}, message: '{reasons}'")
+
+            while is_nsfw:
+                # one rewrite and a check per iteration, the check may fall back to the per-question mode
+                if iterations >= self.max_rewrite_iterations or self._usage.calls + 1 + self._max_check_calls() > self.max_rewrite_calls \
+                        or time.perf_counter() - started > self.max_rewrite_seconds:
+                    outcome = "budget_exhausted"
+                    logger.warning(f"Rewrite budget exhausted after {iterations} iterations, {self._usage.calls} calls "
+                                   f"and {time.perf_counter() - started:.1f}s, NSFW: '{reasons}'")
+                    break
+                # sometimes not all content is removed on the first run, the reasons of the check guide the next one
+                prompt = self._executor_make_prompt_sfw(prompt, reasons)
+                is_nsfw, reasons = self.check_contains_nsfw(prompt)
+                iterations += 1
+        except OllamaUnavailableException as e:
+            outcome = "llm_unavailable"
+            logger.warning(f"Rewrite of NSFW prompt stopped: {e}")
+        finally:
+            self._usage.active = False
+            if iterations > 1: logger.debug(f"looped {iterations} times to make prompt sfw")
+            if self.analytics and (iterations > 0 or outcome != "sfw"):
+                self.analytics.record_prompt_rewrite(
+                    outcome=outcome, iterations=iterations, llm_calls=self._usage.calls,
+                    tokens=self._usage.tokens, duration_seconds=time.perf_counter() - started)
+        return prompt
+
+    def _max_check_calls(self) -> int:
+        """worst case LLM calls of check_contains_nsfw, a structured answer which can't be parsed is asked again per question"""
+        return len(self.NSFW_CHECKS) + (1 if self.classification_mode == "structured" else 0)
 
-        # if failed_rules:
-        #     system_message+="Take special care and solve the following NSFW reasons\n\n"+ failed_rules
+    def _executor_make_prompt_sfw(self, prompt: str, reasons: str = "") -> str:
+        """one rewrite call which applies all rules"""
+        if not self.llm: return prompt
 
         rules = [
             "Replace all explicit or implicit depictions of nudity or porn including the words naked, nude with clothed e.g. underwear",
@@ -207,22 +412,30 @@ class PromptRefiner():
             "Remove mentioning of sexual activity like gangbang or sex between humans.",
             "If the image is related to People, add terms like perfect face or beautiful."
         ]
+        rule_list = "\n".join(f"{number}. {rule}" for number, rule in enumerate(rules, 1))
+        system_message = f"""
+        The user provides always an image description. You have to rewrite it by applying all of the following rules at once:
+        {rule_list}
+        Keep maturity, age, gender and country in any of the rules you apply.
+        Don't explain yourself. Only return the rewritten text.
+        """
 
+        task = f"Rewrite this image description: '{prompt}'"
+        if reasons:
+            task += f"\nTake special care and solve the following NSFW reasons: {reasons}"
         messages = [
             SystemMessage(system_message),
-            HumanMessage("Example: Replace all mentioning of airplanes in the given text: 'An airplane is flying over the forest"),
-            AIMessage("A bird is flying over the forest."),
-            HumanMessage("Example: Replace all mentioning of nudity in the given text: 'A naked woman on the beach"),
-            AIMessage("A woman wearing a bikini."),
-            HumanMessage(f"Perfect. New Tasks will follow. Here is the image description to work with: '{prompt}'")
+            HumanMessage("Rewrite this image description: 'A naked woman on the beach'"),
+            AIMessage("A beautiful woman with perfect face wearing a bikini on the beach."),
+            HumanMessage("Rewrite this image description: 'An airplane is flying over the forest'"),
+            AIMessage("An airplane is flying over the forest."),
+            HumanMessage(task),
         ]
-        for rule in rules:
-            messages.append(HumanMessage(rule))
-            ai_msg = self.llm_creative.invoke(messages)
-            messages.append(ai_msg)
+        ai_msg = self._invoke(self.llm_creative, messages)
+        rewritten = ai_msg.content.strip().strip("'\"").strip()
 
-        logger.debug(f"rewritten prompt: {ai_msg.content}")
-        return self._validateAnswer(prompt=prompt, ai_response=ai_msg.content)
+        logger.debug(f"rewritten prompt: {rewritten}")
+        return self._validateAnswer(prompt=prompt, ai_response=rewritten) if rewritten else prompt
 
     def _magic_prompt_tweaks(self, prompt: str, max_words, enhance: bool) -> str:
         if not self.llm: return prompt
@@ -251,11 +464,15 @@ Don't write any summary or explanation. If you can't fulfill the task, echo the
                 f"Perfect. New Task:\n{task} this image description to a maximum of {max_words} words, answer only with the new text: '{prompt}'"),
         ]
 
-        ai_msg = self.llm_creative.invoke(messages)
-        messages.append(ai_msg)
-        messages.append(HumanMessage(
-            f"make sure that the image description not contains more then {max_words}. Shorten if required by removing details. Answer only with the image description"))
-        ai_msg = self.llm_creative.invoke(messages)
+        try:
+            ai_msg = self.llm_creative.invoke(messages)
+            messages.append(ai_msg)
+            messages.append(HumanMessage(
+                f"make sure that the image description not contains more then {max_words}. Shorten if required by removing details. Answer only with the image description"))
+            ai_msg = self.llm_creative.invoke(messages)
+        except OllamaUnavailableException as e:
+            logger.warning(f"Prompt magic skipped: {e}")
+            return prompt
 
         logger.debug(f"rewritten prompt: {ai_msg.content}")
         return self._validateAnswer(prompt=prompt, ai_response=ai_msg.content)
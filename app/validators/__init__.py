@@ -2,6 +2,15 @@ from .FaceDetector import FaceDetector
 from .PromptRefiner import PromptRefiner
 from .ai_image_detector import AIImageDetector
 from .nsfw_detector import NSFWDetector, NSFWCategory, NSFWDetectionResult, CensorMethod
+from .analysis_cache import AnalysisCache
+from .upload_analyzer import UploadAnalyzer, UploadVerdict
+from .image_index import ImageHashIndex, image_fingerprint
+from .prompt_verdict_cache import PromptVerdictCache, normalize_prompt
+from .prompt_prefilter import PromptPrefilter, PromptClassifier, PrefilterDecision
+from .ollama_client import OllamaClient, CircuitBreaker, OllamaUnavailableException
 # from .OllamaImageAnalyzer import OllamaImageAnalyzer
 
-__all__ = ["FaceDetector", "PromptRefiner", "AIImageDetector", "NSFWDetector", "NSFWCategory", "CensorMethod", "NSFWDetectionResult"]
+__all__ = ["FaceDetector", "PromptRefiner", "AIImageDetector", "NSFWDetector", "NSFWCategory", "CensorMethod", "NSFWDetectionResult",
+           "AnalysisCache", "UploadAnalyzer", "UploadVerdict", "ImageHashIndex", "image_fingerprint",
+           "PromptVerdictCache", "normalize_prompt", "PromptPrefilter", "PromptClassifier", "PrefilterDecision",
+           "OllamaClient", "CircuitBreaker", "OllamaUnavailableException"]
@@ -0,0 +1,153 @@
+"""
+Analysis Cache Module
+
+The same image content is often analyzed more than once, e.g. an upload is hashed by the
+upload and by the credit handler, retried uploads repeat the face, AI-image and NSFW checks,
+and results of the result cache are checked for NSFW content on every delivery. This module
+keeps the results of every validator keyed by the content hash of the image, so repeated
+analysis is a dictionary lookup.
+
+Classes:
+    AnalysisCache: Singleton TTL/LRU cache of validator results per image content
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha1
+from typing import Any, Callable, Dict, Tuple
+from PIL import Image
+from app.utils.singleton import singleton
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@singleton
+class AnalysisCache:
+    """
+    Results of the validators (e.g. 'nsfw', 'faces', 'ai_image') per content hash.
+
+    Args:
+        max_entries (int): Maximum amount of cached results of all validators, 0 = cache disabled
+        ttl_seconds (float): Results are analyzed again after this time
+        analytics (Analytics): Optional analytics instance to report the hit ratio per validator
+
+    Notes:
+        - The content hash is the sha1 of the decoded pixels, as used for the upload history
+        - Results are shared objects, callers must not modify them
+    """
+
+    CACHE_NAME = "analysis"
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, analytics=None):
+        logger.info(f"Initialize AnalysisCache with {max_entries} entries and {ttl_seconds}s TTL")
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.analytics = analytics
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        # (validator, content hash) -> (expiry, result)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        # (path, mtime, size) -> content hash
+        self._file_hashes: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def image_hash(self, image: Image.Image) -> str:
+        """content hash of the decoded image"""
+        return sha1(image.tobytes()).hexdigest()
+
+    def file_hash(self, path: str) -> str:
+        """content hash of an image file, the file is only decoded once as long as it's not modified"""
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            content_hash = self._file_hashes.get(key)
+            if content_hash is not None:
+                self._file_hashes.move_to_end(key)
+                return content_hash
+
+        with Image.open(path) as image:
+            content_hash = self.image_hash(image)
+        if self.enabled:
+            with self._lock:
+                self._file_hashes[key] = content_hash
+                while len(self._file_hashes) > self.max_entries:
+                    self._file_hashes.popitem(last=False)
+        return content_hash
+
+    def get(self, validator: str, content_hash: str) -> Any:
+        """cached result of the validator for the content, None if not cached or expired"""
+        if not self.enabled:
+            return None
+        key = (validator, content_hash)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        self._record_access(validator, hit=entry is not None)
+        return entry[1] if entry is not None else None
+
+    def put(self, validator: str, content_hash: str, result: Any):
+        """cache the result of the validator, None is not cached"""
+        if not self.enabled or result is None:
+            return
+        key = (validator, content_hash)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            entries = len(self._entries)
+        if self.analytics:
+            self.analytics.update_cache_size(cache=self.CACHE_NAME, entries=entries)
+
+    def get_or_compute(self, validator: str, content_hash: str, compute: Callable[[], Any]) -> Any:
+        """
+        Cached result of the validator for the content or the result of compute(), which is cached.
+
+        Args:
+            validator (str): Name of the validator, used as metric label
+            content_hash (str): Hash of the analyzed content
+            compute (Callable): Runs the validator, exceptions are not cached
+
+        Returns:
+            The result of the validator
+        """
+        result = self.get(validator, content_hash)
+        if result is None:
+            result = compute()
+            self.put(validator, content_hash, result)
+        return result
+
+    def invalidate(self, content_hash: str = None):
+        """remove the results of the content, or all results if no hash is given"""
+        with self._lock:
+            if content_hash is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[1] == content_hash]:
+                    del self._entries[key]
+
+    def hit_ratio(self, validator: str) -> float:
+        hits, misses = self.hits.get(validator, 0), self.misses.get(validator, 0)
+        return hits / (hits + misses) if hits + misses > 0 else 0.0
+
+    def _record_access(self, validator: str, hit: bool):
+        with self._lock:
+            counter = self.hits if hit else self.misses
+            counter[validator] = counter.get(validator, 0) + 1
+        if self.analytics:
+            self.analytics.record_cache_access(cache=f"{self.CACHE_NAME}_{validator}", hit=hit)
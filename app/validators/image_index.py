@@ -0,0 +1,191 @@
+"""
+Image Index Module
+
+Perceptual hashes of uploaded and generated images to detect near-duplicates. A re-saved,
+resized or slightly altered image has a different content hash but almost the same
+perceptual hash, so the index finds it by the Hamming distance of the hashes.
+
+The index uses multi-index hashing: the 64 bit pHash is split into 4 chunks of 16 bits and
+every chunk is a key of a dictionary. Two hashes within a distance k have at least one chunk
+within a distance k // 4, so only the few entries of the neighboring chunk values are compared.
+New entries are appended to a log file, the index is loaded from it at start.
+
+Classes:
+    ImageHashIndex: Persistent near-duplicate search of perceptual hashes
+
+Functions:
+    phash: 64 bit DCT hash of an image
+    dhash: 64 bit difference hash of an image
+    image_fingerprint: pHash and dHash of an image or image file
+"""
+
+import os
+import threading
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple, Union
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _grayscale(image: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+    image = ImageOps.exif_transpose(image)
+    return np.asarray(image.convert("L").resize(size, Image.Resampling.LANCZOS), dtype=np.float32)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def phash(image: Image.Image) -> int:
+    """64 bit DCT hash, robust against re-encoding, resizing and small color changes"""
+    pixels = _grayscale(image, (32, 32))
+    low_frequencies = cv2.dct(pixels)[:8, :8]
+    # the DC coefficient is the mean brightness, it's excluded from the median
+    return _bits_to_int(low_frequencies > np.median(low_frequencies.ravel()[1:]))
+
+
+def dhash(image: Image.Image) -> int:
+    """64 bit difference hash of horizontal gradients, used to confirm pHash matches"""
+    pixels = _grayscale(image, (9, 8))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def image_fingerprint(image: Union[Image.Image, str]) -> Tuple[int, int]:
+    """
+    (pHash, dHash) of an image or an image file.
+    Files are decoded with a reduced size where the format allows it (e.g. JPEG), which is much faster.
+    """
+    if isinstance(image, str):
+        with Image.open(image) as file_image:
+            file_image.draft("RGB", (64, 64))
+            return phash(file_image), dhash(file_image)
+    return phash(image), dhash(image)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class ImageHashIndex:
+    """
+    Persistent near-duplicate search of perceptual hashes.
+
+    Args:
+        path (str): Append-only log of the entries, None = in-memory index
+        max_distance (int): Maximum Hamming distance of pHash and dHash of a near-duplicate
+
+    Notes:
+        - Every entry has a kind (e.g. 'upload', 'created') and a key (the content hash of the image)
+        - Searches take a few microseconds per candidate, candidates are only entries sharing a nearby chunk
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self, path: Optional[str] = None, max_distance: int = 6):
+        self.path = path
+        self.max_distance = max_distance
+        # chunk index -> chunk value -> entry ids
+        self._chunk_tables: List[Dict[int, List[int]]] = [{} for _ in range(self.CHUNKS)]
+        self._entries: List[Tuple[int, int, str, str]] = []  # (phash, dhash, kind, key)
+        self._known: set = set()  # (kind, key)
+        self._masks: Dict[int, List[int]] = {}  # radius -> xor masks of all chunk values within the radius
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, kind_and_key: Tuple[str, str]) -> bool:
+        return kind_and_key in self._known
+
+    def add(self, fingerprint: Tuple[int, int], kind: str, key: str) -> bool:
+        """add an image to the index and the log, False if the key of this kind is already known"""
+        with self._lock:
+            if (kind, key) in self._known:
+                return False
+            self._insert(fingerprint[0], fingerprint[1], kind, key)
+            if self.path:
+                try:
+                    with open(self.path, "a") as f:
+                        f.write(f"{fingerprint[0]:016x} {fingerprint[1]:016x} {kind} {key}\n")
+                except Exception as e:
+                    logger.error(f"Error while saving image hash to {self.path}: {e}")
+        return True
+
+    def find(self, fingerprint: Tuple[int, int], kind: Optional[str] = None,
+             max_distance: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        """
+        The most similar known image within the maximum distance.
+
+        Args:
+            fingerprint (Tuple[int, int]): (pHash, dHash) of the image, see image_fingerprint
+            kind (str): Only entries of this kind, None = all kinds
+            max_distance (int): Overrides the maximum distance of the index
+
+        Returns:
+            Optional[Tuple[str, int]]: (key, pHash distance) of the best match or None
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        image_phash, image_dhash = fingerprint
+        chunk_radius = max_distance // self.CHUNKS
+        best = None
+        with self._lock:
+            masks = self._neighbor_masks(chunk_radius)
+            candidates = set()
+            for chunk, table in enumerate(self._chunk_tables):
+                value = self._chunk(image_phash, chunk)
+                for mask in masks:
+                    entry_ids = table.get(value ^ mask)
+                    if entry_ids:
+                        candidates.update(entry_ids)
+            for entry_id in candidates:
+                entry_phash, entry_dhash, entry_kind, entry_key = self._entries[entry_id]
+                if kind is not None and entry_kind != kind:
+                    continue
+                distance = hamming_distance(image_phash, entry_phash)
+                if distance > max_distance or hamming_distance(image_dhash, entry_dhash) > max_distance:
+                    continue
+                if best is None or distance < best[1]:
+                    best = (entry_key, distance)
+        return best
+
+    def _insert(self, entry_phash: int, entry_dhash: int, kind: str, key: str):
+        entry_id = len(self._entries)
+        self._entries.append((entry_phash, entry_dhash, kind, key))
+        self._known.add((kind, key))
+        for chunk, table in enumerate(self._chunk_tables):
+            table.setdefault(self._chunk(entry_phash, chunk), []).append(entry_id)
+
+    def _chunk(self, value: int, chunk: int) -> int:
+        return (value >> (chunk * self.CHUNK_BITS)) & ((1 << self.CHUNK_BITS) - 1)
+
+    def _neighbor_masks(self, radius: int) -> List[int]:
+        """xor masks which turn a chunk value into all values within the Hamming radius"""
+        masks = self._masks.get(radius)
+        if masks is None:
+            masks = [sum(1 << bit for bit in bits)
+                     for distance in range(radius + 1)
+                     for bits in combinations(range(self.CHUNK_BITS), distance)]
+            self._masks[radius] = masks
+        return masks
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    parts = line.split()
+                    # an interrupted append leaves an incomplete last line
+                    if len(parts) != 4 or (parts[2], parts[3]) in self._known:
+                        continue
+                    self._insert(int(parts[0], 16), int(parts[1], 16), parts[2], parts[3])
+            logger.info(f"Loaded {len(self._entries)} image hashes from '{self.path}'")
+        except Exception as e:
+            logger.error(f"Error while loading image hashes from '{self.path}': {e}")
@@ -1,12 +1,12 @@
-from PIL import Image, ImageFilter
+from PIL import Image
 import numpy as np
-from typing import Dict, Union, List, Set
+from typing import Dict, Union, List, Set, Tuple
 import logging
 from enum import Enum
-import os
 from dataclasses import dataclass
 from nudenet import NudeDetector as nndetector
-import tempfile
+from nudenet.nudenet import _postprocess as nudenet_postprocess
+import cv2
 
 
 class NSFWCategory(Enum):
@@ -94,31 +94,69 @@ class NSFWDetector:
             self.logger.error(f"Model initialization error: {str(e)}")
             raise
 
-    def _save_image_temporarily(self, image: Image.Image) -> str:
+    def _to_array(self, image: Union[Image.Image, np.ndarray]) -> np.ndarray:
         """
-        Save image to temporary file
+        Convert the image to a RGB uint8 array (height, width, 3)
 
         Args:
-            image: PIL Image to save
+            image: PIL Image or NumPy array in RGB(A) or grayscale
 
         Returns:
-            str: Path to temporary file
+            np.ndarray: RGB array, shares the memory with the input if possible
         """
-        try:
-            # Create temporary file with .jpg extension
-            temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
-            temp_path = temp_file.name
-
-            # Save image in RGB mode
+        if isinstance(image, Image.Image):
             if image.mode != 'RGB':
                 image = image.convert('RGB')
-            image.save(temp_path, 'JPEG')
+            return np.asarray(image)
+
+        array = np.asarray(image)
+        if array.ndim == 2:
+            array = np.stack([array] * 3, axis=-1)
+        elif array.shape[2] == 4:
+            array = array[:, :, :3]
+        if array.dtype != np.uint8:
+            array = np.clip(array, 0, 255).astype(np.uint8)
+        return array
+
+    def _preprocess(self, array: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+        """
+        NudeNet preprocessing in memory: pad to a square at the bottom/right, resize to the
+        model resolution, scale to 0..1 and convert to a BGR NCHW tensor (the channel order
+        NudeNet feeds its model when reading files with OpenCV)
 
-            return temp_path
+        Args:
+            array: RGB uint8 array
 
-        except Exception as e:
-            self.logger.error(f"Error saving temporary image: {str(e)}")
-            raise
+        Returns:
+            Tuple of the input tensor (1, 3, size, size) and (x_pad, y_pad, width, height) for the postprocessing
+        """
+        height, width = array.shape[:2]
+        max_size = max(height, width)
+        x_pad = max_size - width
+        y_pad = max_size - height
+        if x_pad or y_pad:
+            array = cv2.copyMakeBorder(array, 0, y_pad, 0, x_pad, cv2.BORDER_CONSTANT)
+
+        size = self.classifier.input_width
+        resized = cv2.resize(array, (size, size), interpolation=cv2.INTER_LINEAR)
+        blob = resized[:, :, ::-1].transpose(2, 0, 1)[np.newaxis].astype(np.float32)
+        blob *= 1 / 255.0
+        return blob, (x_pad, y_pad, width, height)
+
+    def _postprocess(self, output: np.ndarray, metadata: Tuple[int, int, int, int]) -> List[dict]:
+        """map the raw model output of one image to NudeNet detections in image coordinates"""
+        x_pad, y_pad, width, height = metadata
+        return nudenet_postprocess(
+            [output],
+            x_pad,
+            y_pad,
+            (width + x_pad) / width,
+            (height + y_pad) / height,
+            width,
+            height,
+            self.classifier.input_width,
+            self.classifier.input_height
+        )
 
     def _analyze_nudenet_result(self, classification: Dict[str, float]) -> NSFWDetectionResult:
         """
@@ -174,84 +212,115 @@ class NSFWDetector:
                 details={'error': str(e)}
             )
 
-    def detect(self, image: Image.Image) -> NSFWDetectionResult:
+    def detect(self, image: Union[Image.Image, np.ndarray]) -> NSFWDetectionResult:
         """
-        Detect NSFW content in an image
+        Detect NSFW content in an image, the image is processed in memory
 
         Args:
-            image: PIL Image to analyze
+            image: PIL Image or RGB NumPy array to analyze
 
         Returns:
             NSFWDetectionResult object
         """
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images: List[Union[Image.Image, np.ndarray]]) -> List[NSFWDetectionResult]:
+        """
+        Detect NSFW content in multiple images with a single inference. Every image is
+        letterboxed to the model resolution and all of them are stacked to one input tensor.
+
+        Args:
+            images: PIL Images or RGB NumPy arrays to analyze
+
+        Returns:
+            List[NSFWDetectionResult]: one result per image in the same order
+        """
         if not self.classifier:
             raise RuntimeError("Model not initialized")
 
-        temp_path = None
-        try:
-            # Save image temporarily
-            temp_path = self._save_image_temporarily(image)
-            classification = self.classifier.detect(temp_path)
-            # Analyze results
-            return self._analyze_nudenet_result(classification)
+        results: List[NSFWDetectionResult] = [None] * len(images)
+        blobs = []
+        batch = []  # (index of the image, metadata) per row of the input tensor
+        for index, image in enumerate(images):
+            try:
+                blob, metadata = self._preprocess(self._to_array(image))
+                blobs.append(blob)
+                batch.append((index, metadata))
+            except Exception as e:
+                self.logger.error(f"Detection error: {str(e)}")
+                results[index] = self._error_result(e)
+
+        if blobs:
+            try:
+                outputs = self.classifier.onnx_session.run(None, {self.classifier.input_name: np.concatenate(blobs)})
+                for row, (index, metadata) in enumerate(batch):
+                    classification = self._postprocess(outputs[0][row:row + 1], metadata)
+                    results[index] = self._analyze_nudenet_result(classification)
+            except Exception as e:
+                self.logger.error(f"Detection error: {str(e)}")
+                for index, _ in batch:
+                    results[index] = self._error_result(e)
+        return results
+
+    def _error_result(self, error: Exception) -> NSFWDetectionResult:
+        return NSFWDetectionResult(
+            is_safe=False,
+            category=NSFWCategory.UNKNOWN,
+            confidence=0.0,
+            details={'error': str(error)}
+        )
+
+    def _merge_boxes(self, boxes: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+        """
+        Merge overlapping boxes to their bounding box, so every pixel is censored only once
 
-        except Exception as e:
-            self.logger.error(f"Detection error: {str(e)}")
-            return NSFWDetectionResult(
-                is_safe=False,
-                category=NSFWCategory.UNKNOWN,
-                confidence=0.0,
-                details={'error': str(e)}
-            )
-        finally:
-            # Clean up temporary file
-            if temp_path and os.path.exists(temp_path):
-                try:
-                    os.unlink(temp_path)
-                except Exception as e:
-                    self.logger.warning(f"Error removing temporary file: {str(e)}")
-
-
-    def _apply_censoring(
-        self, 
-        region: Image.Image, 
-        method: CensorMethod, 
-        **kwargs
-    ) -> Image.Image:
+        Args:
+            boxes: (left, top, right, bottom) boxes
+
+        Returns:
+            Non overlapping (left, top, right, bottom) boxes
+        """
+        merged = [list(box) for box in boxes]
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(merged)):
+                for j in range(len(merged) - 1, i, -1):
+                    a, b = merged[i], merged[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        merged[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del merged[j]
+                        changed = True
+        return [tuple(box) for box in merged]
+
+    def _censor_region(self, region: np.ndarray, method: CensorMethod, **kwargs) -> np.ndarray:
         """
-        Apply censoring method to image region
+        Censored version of a region
 
         Args:
-            region: Image region to censor
+            region: RGB uint8 array of the region
             method: Censoring method to apply
-            **kwargs: Additional parameters for censoring method
+            **kwargs: Additional parameters for censoring method (blur_radius)
 
         Returns:
-            Censored image region
+            Censored array in the size of the region
         """
-        try:
-            if method == CensorMethod.BLUR:
-                return region.filter(ImageFilter.GaussianBlur(
-                    radius=kwargs.get('blur_radius', 30)
-                ))
-            elif method == CensorMethod.PIXELATE:
-                small = region.resize(
-                    (region.width // 16, region.height // 16),
-                    Image.Resampling.BILINEAR
-                )
-                return small.resize(
-                    region.size,
-                    Image.Resampling.NEAREST
-                )
-            elif method == CensorMethod.BLACK:
-                return Image.new('RGB', region.size, 'black')
-            elif method == CensorMethod.WHITE:
-                return Image.new('RGB', region.size, 'white')
-            else:
-                return region.filter(ImageFilter.GaussianBlur(radius=30))
-        except Exception as e:
-            self.logger.error(f"Error applying censoring: {str(e)}")
-            return region
+        height, width = region.shape[:2]
+        if method == CensorMethod.BLACK:
+            return np.zeros_like(region)
+        if method == CensorMethod.WHITE:
+            return np.full_like(region, 255)
+        if method == CensorMethod.PIXELATE:
+            # blocks of about 16 pixels, bilinear sampling is enough to pick the block colors
+            small = cv2.resize(region, (max(1, width // 16), max(1, height // 16)), interpolation=cv2.INTER_LINEAR)
+            return cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+
+        # blur on a downscaled buffer, a blurred region has no details to lose by the upsampling
+        radius = kwargs.get('blur_radius', 30)
+        factor = max(1, min(int(radius // 4), width, height))
+        small = cv2.resize(region, (max(1, width // factor), max(1, height // factor)), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (0, 0), sigmaX=max(radius / factor, 0.1))
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
 
     def censor_detected_regions(
         self,
@@ -265,6 +334,9 @@ class NSFWDetector:
         """
         Censor detected regions in image
 
+        Overlapping regions are merged and censored once with NumPy/OpenCV, a mask of the
+        merged boxes makes sure only the pixels of the detected boxes are replaced.
+
         Args:
             image: PIL Image to censor
             detection_result: Detection result from detect()
@@ -285,41 +357,50 @@ class NSFWDetector:
             if image.mode != 'RGB':
                 image = image.convert('RGB')
 
-            # Create copy of image to modify
-            censored_image = image.copy()
-
-            # Process each detection
+            # Extract and adjust box coordinates
+            boxes = []
             for detection in detection_result.details:
-                # Skip if class not in labels to censor
                 if detection['class'] not in labels_to_censor:
                     continue
-
-                # Extract and adjust box coordinates
                 x, y, width, height = detection['box']
                 left = max(0, x - padding)
                 top = max(0, y - padding)
                 right = min(image.width, x + width + padding)
                 bottom = min(image.height, y + height + padding)
+                if right > left and bottom > top:
+                    boxes.append((left, top, right, bottom))
+            if not boxes:
+                return image.copy()
+
+            # the only full size buffer, regions are censored in place
+            censored = image.copy()
+            for merged in self._merge_boxes(boxes):
+                left, top, right, bottom = merged
+                members = [box for box in boxes
+                           if box[0] >= left and box[1] >= top and box[2] <= right and box[3] <= bottom]
+                if method in (CensorMethod.BLACK, CensorMethod.WHITE):
+                    color = (0, 0, 0) if method == CensorMethod.BLACK else (255, 255, 255)
+                    for box in members:
+                        censored.paste(color, box)
+                    continue
 
-                # Extract region
-                region = censored_image.crop((left, top, right, bottom))
-
-                # Apply censoring
-                censored_region = self._apply_censoring(
-                    region, 
-                    method, 
-                    **kwargs
-                )
-
-                # Paste back
-                censored_image.paste(censored_region, (left, top))
+                region = self._censor_region(np.asarray(censored.crop(merged)), method, **kwargs)
+                mask = None
+                if len(members) > 1:
+                    # merged boxes: only the pixels of the detected boxes are replaced
+                    mask = np.zeros(region.shape[:2], dtype=np.uint8)
+                    for box in members:
+                        mask[box[1] - top:box[3] - top, box[0] - left:box[2] - left] = 255
+                    mask = Image.fromarray(mask)
+                censored.paste(Image.fromarray(region), (left, top), mask)
 
-            return censored_image
+            return censored
 
         except Exception as e:
             self.logger.error(f"Error censoring image: {str(e)}")
             return image
 
+
 def create_nsfw_detector(confidence_threshold: float = 0.8) -> NSFWDetector:
     """
     Factory function to create NSFW detector
@@ -0,0 +1,306 @@
+"""
+Ollama Client Module
+
+Access layer of the prompt checks and rewrites to the Ollama server. All requests run on one
+asyncio event loop with a pooled httpx.AsyncClient, so the Gradio worker threads only wait for
+their own result. Every call has a timeout, the amount of concurrent requests to the server is
+bounded, and a circuit breaker rejects calls immediately while the server is failing, so a
+stalled server doesn't pile up generation threads.
+
+Classes:
+    OllamaUnavailableException: The call failed, timed out or was rejected by the circuit breaker
+    CircuitOpenException: The call was rejected by the open circuit breaker
+    CircuitBreaker: Failure counter which stops calls to a failing server for a while
+    OllamaClient: Async, pooled client of the Ollama chat API with a synchronous interface
+    OllamaChat: Chat model of the client with the invoke interface of the langchain chat models
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List, Optional, Union
+
+import httpx
+from langchain_core.messages import AIMessage, BaseMessage
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaUnavailableException(Exception):
+    """The call failed, timed out or was rejected by the circuit breaker"""
+    pass
+
+
+class CircuitOpenException(OllamaUnavailableException):
+    """The call was rejected by the open circuit breaker"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Failure counter which stops calls to a failing server for a while.
+
+    Args:
+        failure_threshold (int): Consecutive failures which open the circuit
+        reset_seconds (float): Time until a trial call is allowed after the circuit opened
+        on_state_change (Callable[[str], None]): Optional callback of the new state
+
+    Notes:
+        - closed: all calls are allowed
+        - open: all calls are rejected until reset_seconds passed
+        - half_open: one trial call is allowed, its success closes and its failure opens the circuit
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    STATES = (CLOSED, OPEN, HALF_OPEN)
+
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 30, on_state_change=None):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.on_state_change = on_state_change
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """True if a call is allowed, a trial call of the half open circuit is reserved"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_running = False
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self._state != self.OPEN:
+                    self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        """the lock must be held"""
+        logger.info(f"Ollama circuit breaker {self._state} -> {state}")
+        self._state = state
+        if self.on_state_change:
+            self.on_state_change(state)
+
+
+class OllamaClient:
+    """
+    Async, pooled client of the Ollama chat API with a synchronous interface.
+
+    Args:
+        server (str): Url of the Ollama server, None = localhost
+        model (str): Model used for all chats
+        timeout_seconds (float): Timeout of a call incl. the wait for a free connection
+        max_concurrency (int): Maximum concurrent requests to the server
+        breaker (CircuitBreaker): Circuit breaker of the server, None = default breaker
+        analytics (Analytics): Optional analytics instance to report latency and breaker state
+        transport (httpx.AsyncBaseTransport): Optional transport, used by the tests
+
+    Notes:
+        - The event loop runs in a daemon thread which is started with the client
+        - Calls of other threads block until their result or timeout, calls on the loop thread are not supported
+    """
+
+    DEFAULT_SERVER = "http://localhost:11434"
+    PULL_TIMEOUT_SECONDS = 1800
+
+    def __init__(self, server: Optional[str], model: str, timeout_seconds: float = 20, max_concurrency: int = 4,
+                 breaker: Optional[CircuitBreaker] = None, analytics=None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.server = self._base_url(server)
+        self.model = model
+        self.timeout_seconds = timeout_seconds
+        self.max_concurrency = max(1, max_concurrency)
+        self.analytics = analytics
+        self.breaker = breaker or CircuitBreaker()
+        if self.breaker.on_state_change is None:
+            self.breaker.on_state_change = self._report_state
+        self._report_state(self.breaker.state)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ollama-client", daemon=True)
+        self._thread.start()
+        self._semaphore: asyncio.Semaphore = None
+        self._http: httpx.AsyncClient = None
+        self._pull = None
+        self._submit(self._open(transport)).result()
+
+    @staticmethod
+    def _base_url(server: Optional[str]) -> str:
+        if not server:
+            return OllamaClient.DEFAULT_SERVER
+        server = server.strip().rstrip("/")
+        return server if "://" in server else f"http://{server}"
+
+    async def _open(self, transport):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._http = httpx.AsyncClient(
+            base_url=self.server,
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            timeout=httpx.Timeout(self.timeout_seconds, connect=min(5.0, self.timeout_seconds)),
+            transport=transport,
+        )
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self._submit(self._http.aclose()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def pull(self):
+        """start the download of the model in the background, see wait_for_model"""
+        if self._pull is None:
+            self._pull = self._submit(self._apull())
+        return self._pull
+
+    def wait_for_model(self, timeout_seconds: float = PULL_TIMEOUT_SECONDS) -> bool:
+        """True if the model is available, waits for the pull started with pull()"""
+        try:
+            self.pull().result(timeout_seconds)
+            return True
+        except Exception as e:
+            logger.error(f"Pull of Ollama model '{self.model}' failed: {e}")
+            return False
+
+    async def _apull(self):
+        response = await self._http.post("/api/pull", json={"model": self.model, "stream": False},
+                                         timeout=self.PULL_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        logger.info(f"Ollama model '{self.model}' is available")
+
+    def chat(self, messages: List[BaseMessage], temperature: float = 0, format: Union[str, dict, None] = None,
+             timeout_seconds: Optional[float] = None) -> AIMessage:
+        """
+        Chat completion of the messages, blocks until the answer or the timeout.
+
+        Args:
+            messages (List[BaseMessage]): System, human and ai messages of the conversation
+            temperature (float): Sampling temperature
+            format (str | dict): Optional 'json' or a JSON schema of the answer
+            timeout_seconds (float): Overrides the timeout of the client
+
+        Returns:
+            AIMessage: Answer with the token counts in usage_metadata
+
+        Raises:
+            OllamaUnavailableException: The call failed, timed out or the circuit breaker is open
+        """
+        timeout_seconds = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+        future = self._submit(self.achat(messages, temperature, format, timeout_seconds))
+        try:
+            # the coroutine has its own timeout, this one only guards against a blocked loop
+            return future.result(timeout_seconds + 1)
+        except FutureTimeoutError:
+            future.cancel()
+            raise OllamaUnavailableException(f"Ollama call timed out after {timeout_seconds}s")
+
+    async def achat(self, messages: List[BaseMessage], temperature: float = 0, format: Union[str, dict, None] = None,
+                    timeout_seconds: Optional[float] = None) -> AIMessage:
+        """coroutine of chat(), must run on the loop of the client"""
+        timeout_seconds = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+        if not self.breaker.allow():
+            self._record_call("rejected", 0)
+            raise CircuitOpenException("Ollama circuit breaker is open")
+
+        started = time.perf_counter()
+        try:
+            ai_msg = await asyncio.wait_for(self._request(messages, temperature, format, timeout_seconds), timeout_seconds)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            self._record_call("timeout", time.perf_counter() - started)
+            raise OllamaUnavailableException(f"Ollama call timed out after {timeout_seconds}s")
+        except asyncio.CancelledError:
+            self.breaker.record_failure()
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            self._record_call("error", time.perf_counter() - started)
+            raise OllamaUnavailableException(f"Ollama call failed: {e}") from e
+        self.breaker.record_success()
+        self._record_call("success", time.perf_counter() - started)
+        return ai_msg
+
+    async def _request(self, messages: List[BaseMessage], temperature: float, format, timeout_seconds: float) -> AIMessage:
+        payload = {
+            "model": self.model,
+            "messages": [{"role": self._role(message), "content": message.content} for message in messages],
+            "stream": False,
+            "options": {"temperature": temperature},
+        }
+        if format:
+            payload["format"] = format
+        async with self._semaphore:
+            response = await self._http.post("/api/chat", json=payload, timeout=timeout_seconds)
+        response.raise_for_status()
+        data = response.json()
+        input_tokens, output_tokens = data.get("prompt_eval_count", 0), data.get("eval_count", 0)
+        return AIMessage(
+            content=data.get("message", {}).get("content", ""),
+            usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens,
+                            "total_tokens": input_tokens + output_tokens},
+        )
+
+    @staticmethod
+    def _role(message: BaseMessage) -> str:
+        return {"system": "system", "human": "user", "ai": "assistant"}.get(message.type, "user")
+
+    def _record_call(self, outcome: str, duration_seconds: float):
+        if self.analytics:
+            self.analytics.record_llm_call(outcome=outcome, duration_seconds=duration_seconds)
+
+    def _report_state(self, state: str):
+        if self.analytics:
+            self.analytics.update_llm_circuit_state(state=state)
+
+
+class OllamaChat:
+    """
+    Chat model of the client with the invoke interface of the langchain chat models.
+
+    Args:
+        client (OllamaClient): Client of the server
+        temperature (float): Sampling temperature
+        format (str | dict): Optional 'json' or a JSON schema of the answers
+    """
+
+    def __init__(self, client: OllamaClient, temperature: float = 0, format: Union[str, dict, None] = None):
+        self.client = client
+        self.temperature = temperature
+        self.format = format
+
+    def invoke(self, messages: List[BaseMessage]) -> AIMessage:
+        return self.client.chat(messages, temperature=self.temperature, format=self.format)
@@ -0,0 +1,270 @@
+"""
+Prompt Pre-Filter Module
+
+Local first stage of the NSFW check of prompts. Most prompts are clearly harmless ("a dog on
+a beach") or clearly explicit ("naked woman"), only a few need the context understanding of
+the LLM. The pre-filter matches a maintained term list with an Aho-Corasick automaton over
+the words of the prompt, so clearly explicit prompts are decided in microseconds. A prompt
+without any listed term (unsafe or ambiguous) is decided as safe, unless it looks obfuscated.
+The list therefore also contains hint words of implicit phrasings ("wearing nothing"). The
+optional tiny linear classifier replaces this lexical safe tier, all other prompts go to the LLM.
+
+Classes:
+    PrefilterDecision: Decision of the pre-filter for a prompt
+    TermAutomaton: Aho-Corasick automaton of word sequences
+    PromptClassifier: Logistic regression over hashed words and word pairs
+    PromptPrefilter: Lexical and classifier tiers in front of the LLM check
+
+Functions:
+    prompt_words: Normalized words of a prompt used by the pre-filter
+"""
+
+import json
+import os
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from .prompt_verdict_cache import normalize_prompt
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TERMS_PATH = os.path.join(os.path.dirname(__file__), "prompt_terms.txt")
+# digits used as letters, e.g. p0rn or nak3d
+_LEET = str.maketrans("013457", "oieast")
+# single letters in a row, e.g. n.a.k.e.d, which hide a word from the term list
+_SPELLED_OUT_LETTERS = 3
+
+
+def prompt_words(prompt: str, promptmarker: Optional[str] = None) -> List[str]:
+    """normalized words of the prompt, digits inside words are folded to letters"""
+    words = normalize_prompt(prompt, promptmarker).split()
+    return [word.translate(_LEET) if not word.isdigit() and not word.isalpha() else word for word in words]
+
+
+@dataclass
+class PrefilterDecision:
+    """Decision of the pre-filter, nsfw None = ambiguous, the LLM has to decide"""
+    nsfw: Optional[bool]
+    tier: str  # 'lexical' or 'classifier'
+    reason: str = ""
+    score: Optional[float] = None  # probability of the classifier, None if not used
+    ambiguous: Tuple[str, ...] = ()  # ambiguous terms found in the prompt
+
+
+class TermAutomaton:
+    """
+    Aho-Corasick automaton of word sequences.
+
+    All terms are matched in one pass over the words of the prompt, independent of the size of
+    the term list. Terms are matched as whole words only.
+
+    Args:
+        terms (Iterable[Tuple[Sequence[str], object]]): (words of the term, value returned for a match)
+    """
+
+    def __init__(self, terms: Iterable[Tuple[Sequence[str], object]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[object]] = [[]]
+        for words, value in terms:
+            self._add(words, value)
+        self._build()
+
+    def __len__(self) -> int:
+        return sum(len(values) for values in self._output)
+
+    def _add(self, words: Sequence[str], value):
+        state = 0
+        for word in words:
+            next_state = self._goto[state].get(word)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][word] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(value)
+
+    def _build(self):
+        """breadth-first computation of the failure links"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(word, 0)
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+
+    def find(self, words: Sequence[str]) -> List[object]:
+        """values of all terms contained in the words"""
+        matches = []
+        state = 0
+        for word in words:
+            while state and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            matches.extend(self._output[state])
+        return matches
+
+
+class PromptClassifier:
+    """
+    Logistic regression over hashed words and word pairs of the prompt.
+
+    Small enough to score a prompt in a few microseconds on the CPU. Trained with
+    tools/train_prompt_classifier.py from labeled prompts.
+
+    Args:
+        weights (np.ndarray): Weight per hash bucket
+        bias (float): Bias of the regression
+    """
+
+    def __init__(self, weights: np.ndarray, bias: float = 0.0):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+
+    @staticmethod
+    def features(words: Sequence[str], buckets: int) -> List[int]:
+        tokens = list(words) + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return sorted({zlib.crc32(token.encode("utf-8")) % buckets for token in tokens})
+
+    def score(self, words: Sequence[str]) -> float:
+        """probability of NSFW content"""
+        features = self.features(words, len(self.weights))
+        logit = self.bias + float(self.weights[features].sum())
+        return 1.0 / (1.0 + np.exp(-logit))
+
+    @classmethod
+    def fit(cls, prompts: Sequence[str], labels: Sequence[bool], buckets: int = 1 << 14,
+            epochs: int = 30, learning_rate: float = 0.5, l2: float = 1e-4) -> "PromptClassifier":
+        """
+        Train the classifier with gradient descent.
+
+        Args:
+            prompts (Sequence[str]): Training prompts
+            labels (Sequence[bool]): True for NSFW prompts
+            buckets (int): Amount of hash buckets of the features
+
+        Returns:
+            PromptClassifier: Trained classifier
+        """
+        rows = [cls.features(prompt_words(prompt), buckets) for prompt in prompts]
+        targets = np.asarray(labels, dtype=np.float32)
+        weights = np.zeros(buckets, dtype=np.float32)
+        bias = 0.0
+        for _ in range(epochs):
+            for features, target in zip(rows, targets):
+                prediction = 1.0 / (1.0 + np.exp(-(bias + weights[features].sum())))
+                gradient = prediction - target
+                weights[features] -= learning_rate * (gradient + l2 * weights[features])
+                bias -= learning_rate * gradient
+        return cls(weights, bias)
+
+    def save(self, path: str):
+        np.savez_compressed(path, weights=self.weights, bias=np.float32(self.bias))
+
+    @classmethod
+    def load(cls, path: str) -> "PromptClassifier":
+        with np.load(path) as data:
+            return cls(data["weights"], float(data["bias"]))
+
+
+class PromptPrefilter:
+    """
+    Lexical and classifier tiers in front of the LLM check of prompts.
+
+    Args:
+        terms_path (str): Term list, see prompt_terms.txt for the format
+        classifier (PromptClassifier): Optional classifier of prompts without unsafe terms
+        safe_below (float): Classifier score below which a prompt is safe
+        unsafe_above (float): Classifier score above which a prompt is unsafe
+        promptmarker (str): Marker of the user prompt inside a style, the style is ignored
+        lexical_safe (bool): Prompts without any listed term are safe, used if there is no classifier
+
+    Notes:
+        - Unsafe terms always decide, the classifier is not asked
+        - Without classifier, prompts without any listed or spelled out term are safe, if lexical_safe is set.
+          Implicit phrasings which the list doesn't know are missed, the generated images are still checked
+          by the NSFW detector
+        - With classifier, its score decides between the thresholds, everything else goes to the LLM
+    """
+
+    TIERS = ("unsafe", "ambiguous")
+
+    def __init__(self, terms_path: str = DEFAULT_TERMS_PATH, classifier: Optional[PromptClassifier] = None,
+                 safe_below: float = 0.1, unsafe_above: float = 0.95, promptmarker: Optional[str] = None,
+                 lexical_safe: bool = True):
+        self.classifier = classifier
+        self.lexical_safe = lexical_safe
+        self.safe_below = safe_below
+        self.unsafe_above = unsafe_above
+        self.promptmarker = promptmarker
+        self.automaton = TermAutomaton(self.load_terms(terms_path))
+        logger.info(f"Initialized PromptPrefilter with {len(self.automaton)} terms from '{terms_path}'"
+                    + (" and classifier" if classifier else ""))
+
+    @classmethod
+    def load_terms(cls, path: str) -> List[Tuple[Tuple[str, ...], Tuple[str, str, str]]]:
+        """(words, (tier, category, term)) of every term of the list"""
+        terms = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                parts = line.split(maxsplit=2)
+                if len(parts) != 3 or parts[0] not in cls.TIERS:
+                    logger.warning(f"Invalid term in '{path}' line {line_number}: '{line}'")
+                    continue
+                words = tuple(prompt_words(parts[2]))
+                if words:
+                    terms.append((words, (parts[0], parts[1], " ".join(words))))
+        return terms
+
+    def classify(self, prompt: str) -> PrefilterDecision:
+        """
+        Decide the prompt locally if possible.
+
+        Args:
+            prompt (str): Prompt to check
+
+        Returns:
+            PrefilterDecision: nsfw True/False if decided, None if the LLM has to decide
+        """
+        words = prompt_words(prompt, self.promptmarker)
+        matches = self.automaton.find(words)
+        unsafe = sorted({f"{category}: {term}" for tier, category, term in matches if tier == "unsafe"})
+        if unsafe:
+            return PrefilterDecision(nsfw=True, tier="lexical", reason="; ".join(unsafe))
+        ambiguous = sorted({term for tier, _, term in matches if tier == "ambiguous"})
+
+        if self.classifier is not None:
+            score = self.classifier.score(words)
+            if score >= self.unsafe_above:
+                return PrefilterDecision(nsfw=True, tier="classifier", reason=f"classifier score {score:.2f}", score=score)
+            if score <= self.safe_below:
+                return PrefilterDecision(nsfw=False, tier="classifier", score=score)
+            return PrefilterDecision(nsfw=None, tier="classifier", reason=", ".join(ambiguous), score=score,
+                                     ambiguous=tuple(ambiguous))
+
+        if self.lexical_safe and not matches and not self._spelled_out(words):
+            return PrefilterDecision(nsfw=False, tier="lexical")
+        return PrefilterDecision(nsfw=None, tier="lexical", reason=", ".join(ambiguous), ambiguous=tuple(ambiguous))
+
+    @staticmethod
+    def _spelled_out(words: List[str]) -> bool:
+        """True if the prompt contains single letters in a row, which could hide a listed term"""
+        run = 0
+        for word in words:
+            run = run + 1 if len(word) == 1 and word.isalpha() else 0
+            if run >= _SPELLED_OUT_LETTERS:
+                return True
+        return False
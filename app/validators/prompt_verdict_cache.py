@@ -0,0 +1,213 @@
+"""
+Prompt Verdict Cache Module
+
+The same prompts are checked for NSFW content again and again: examples, prompts built by the
+prompt assistant, retries of a failed generation and the rewritten prompts of make_prompt_sfw.
+This module keeps the verdicts of the prompt check in an embedded SQLite database, keyed by the
+normalized prompt, so a repeated prompt doesn't need the LLM. The verdicts survive restarts and
+are dropped when the LLM model changes.
+
+Classes:
+    PromptVerdictCache: Persistent TTL/LRU cache of NSFW verdicts per normalized prompt
+
+Functions:
+    normalize_prompt: Prompt without style, case, punctuation and whitespace differences
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from hashlib import sha1
+from typing import Optional, Tuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str, promptmarker: Optional[str] = None) -> str:
+    """
+    Prompt without style, case, punctuation and whitespace differences.
+
+    Args:
+        prompt (str): Prompt as entered or built by the assistant
+        promptmarker (str): Marker around the user prompt inside a style, see AppConfig.promptmarker
+
+    Returns:
+        str: Lower case words of the prompt separated by single spaces
+    """
+    if promptmarker and promptmarker in prompt:
+        # the style around the marked user prompt is the same for every prompt
+        prompt = prompt.split(promptmarker)[1]
+    return " ".join(re.sub(r"[\W_]+", " ", prompt.casefold()).split())
+
+
+class PromptVerdictCache:
+    """
+    Persistent TTL/LRU cache of NSFW verdicts per normalized prompt.
+
+    Args:
+        path (str): Path of the SQLite database, ':memory:' for a temporary cache
+        model (str): LLM model of the verdicts, cached verdicts of another model are dropped
+        max_entries (int): Maximum amount of cached verdicts, least recently used are removed, 0 = cache disabled
+        ttl_seconds (float): Verdicts are checked again after this time
+        promptmarker (str): Marker of the user prompt inside a style, see normalize_prompt
+        analytics (Analytics): Optional analytics instance to report hits, misses and the size
+
+    Notes:
+        - Only the hash of the normalized prompt is stored, not the prompt itself
+        - Failed checks must not be cached, the caller decides what is stored
+    """
+
+    CACHE_NAME = "prompt_verdict"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS verdicts (
+            prompt_hash TEXT PRIMARY KEY,
+            nsfw INTEGER NOT NULL,
+            reason TEXT NOT NULL DEFAULT '',
+            expires REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS verdicts_last_access ON verdicts (last_access);
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path: str, model: str, max_entries: int = 10000, ttl_seconds: float = 7 * 24 * 3600,
+                 promptmarker: Optional[str] = None, analytics=None):
+        logger.info(f"Initialize PromptVerdictCache with {max_entries} entries and {ttl_seconds}s TTL for model '{model}'")
+        self.path = path
+        self.model = model
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.promptmarker = promptmarker
+        self.analytics = analytics
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._entries = 0
+        if not self.enabled:
+            return
+
+        try:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # one connection shared by all threads, the lock serializes the access
+            self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(self.SCHEMA)
+            self._check_model()
+            self._connection.execute("DELETE FROM verdicts WHERE expires < ?", (time.time(),))
+            self._entries = self._connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error while opening prompt verdict cache '{path}', cache disabled: {e}")
+            self._connection = None
+        self._report_size()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return self._entries
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def get(self, prompt: str) -> Optional[Tuple[bool, str]]:
+        """cached (nsfw, reason) of the prompt, None if not cached or expired"""
+        if self._connection is None:
+            return None
+        prompt_hash = self._prompt_hash(prompt)
+        now = time.time()
+        verdict = None
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT nsfw, reason, expires FROM verdicts WHERE prompt_hash = ?", (prompt_hash,)).fetchone()
+                if row is not None and row[2] < now:
+                    self._connection.execute("DELETE FROM verdicts WHERE prompt_hash = ?", (prompt_hash,))
+                    self._entries -= 1
+                elif row is not None:
+                    self._connection.execute("UPDATE verdicts SET last_access = ? WHERE prompt_hash = ?", (now, prompt_hash))
+                    verdict = (bool(row[0]), row[1])
+        except Exception as e:
+            logger.warning(f"Error while reading prompt verdict cache: {e}")
+        self._record_access(hit=verdict is not None)
+        return verdict
+
+    def put(self, prompt: str, nsfw: bool, reason: str = ""):
+        """cache the verdict of the prompt"""
+        if self._connection is None:
+            return
+        prompt_hash = self._prompt_hash(prompt)
+        now = time.time()
+        try:
+            with self._lock:
+                known = self._connection.execute(
+                    "SELECT 1 FROM verdicts WHERE prompt_hash = ?", (prompt_hash,)).fetchone() is not None
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO verdicts (prompt_hash, nsfw, reason, expires, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (prompt_hash, int(bool(nsfw)), reason or "", now + self.ttl_seconds, now))
+                if not known:
+                    self._entries += 1
+                if self._entries > self.max_entries:
+                    self._evict(self._entries - self.max_entries)
+        except Exception as e:
+            logger.warning(f"Error while saving prompt verdict: {e}")
+        self._report_size()
+
+    def invalidate(self, prompt: str = None):
+        """remove the verdict of the prompt, or all verdicts if no prompt is given"""
+        if self._connection is None:
+            return
+        with self._lock:
+            if prompt is None:
+                self._connection.execute("DELETE FROM verdicts")
+            else:
+                self._connection.execute("DELETE FROM verdicts WHERE prompt_hash = ?", (self._prompt_hash(prompt),))
+            self._entries = self._connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        self._report_size()
+
+    def hit_ratio(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0.0
+
+    def _prompt_hash(self, prompt: str) -> str:
+        return sha1(normalize_prompt(prompt, self.promptmarker).encode("utf-8")).hexdigest()
+
+    def _check_model(self):
+        """drop all verdicts if they were created by another model"""
+        row = self._connection.execute("SELECT value FROM settings WHERE name = 'model'").fetchone()
+        if row is not None and row[0] != self.model:
+            logger.info(f"Model changed from '{row[0]}' to '{self.model}', prompt verdicts are dropped")
+            self._connection.execute("DELETE FROM verdicts")
+        self._connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('model', ?)", (self.model,))
+
+    def _evict(self, amount: int):
+        """remove the least recently used verdicts, the lock must be held"""
+        self._connection.execute(
+            "DELETE FROM verdicts WHERE prompt_hash IN (SELECT prompt_hash FROM verdicts ORDER BY last_access LIMIT ?)",
+            (amount,))
+        self._entries = self._connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def _record_access(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self.analytics:
+            self.analytics.record_cache_access(cache=self.CACHE_NAME, hit=hit)
+
+    def _report_size(self):
+        if self.analytics:
+            self.analytics.update_cache_size(cache=self.CACHE_NAME, entries=self._entries)
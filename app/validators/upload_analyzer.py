@@ -0,0 +1,158 @@
+"""
+Upload Analyzer Module
+
+Runs the independent checks of an uploaded image (AI-image metadata, face detection and
+NSFW detection) at the same time on a bounded worker pool and combines their results into
+one verdict. The analysis stops waiting as soon as the finished checks decide the reward,
+e.g. an image with AI metadata doesn't need the face and NSFW results.
+
+Classes:
+    UploadVerdict: Combined results of the checks of an upload
+    UploadAnalyzer: Parallel analysis pipeline of uploaded images
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import numpy as np
+from PIL import Image
+from .nsfw_detector import NSFWCategory, NSFWDetectionResult
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UploadVerdict:
+    """Combined results of the checks of an upload, None = check not finished or skipped"""
+    is_ai_image: Optional[bool] = None
+    ai_reason: str = ""
+    faces: Optional[List[Any]] = None
+    face_image: Optional[np.ndarray] = None  # image of the face detection, None if the faces were cached
+    nsfw: Optional[NSFWDetectionResult] = None
+    decided_by: str = ""
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+class UploadAnalyzer:
+    """
+    Parallel analysis pipeline of uploaded images.
+
+    Args:
+        face_detector (FaceDetector): Detector of the faces and their age
+        ai_image_detector (AIImageDetector): Metadata and size check of AI images
+        nsfw_detector (NSFWDetector): NSFW detector
+        analysis_cache (AnalysisCache): Optional cache of the results per content hash
+        max_workers (int): Size of the worker pool shared by all uploads
+        analytics (Analytics): Optional analytics instance to report the duration of the stages
+
+    Notes:
+        - Checks which are not needed for the verdict keep running in the background, their results are cached
+        - The reward precedence is the same as before: AI image, no face, NSFW content
+    """
+
+    def __init__(self, face_detector, ai_image_detector, nsfw_detector,
+                 analysis_cache=None, max_workers: int = 3, analytics=None):
+        self.face_detector = face_detector
+        self.ai_image_detector = ai_image_detector
+        self.nsfw_detector = nsfw_detector
+        self.analysis_cache = analysis_cache
+        self.analytics = analytics
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="upload-analysis")
+
+    def analyze(self, image_path: str, content_hash: str) -> UploadVerdict:
+        """
+        Run the checks of the uploaded image in parallel.
+
+        Args:
+            image_path (str): Path of the uploaded image
+            content_hash (str): Content hash of the image, key of the analysis cache
+
+        Returns:
+            UploadVerdict: Results of the checks required for the reward
+        """
+        started = time.perf_counter()
+        verdict = UploadVerdict()
+        image = Image.open(image_path)
+        image.load()
+
+        futures = {
+            self._executor.submit(self._timed, verdict, "ai_image", self._check_ai_image, image_path, content_hash): "ai_image",
+            # the face detection shrinks the image in place
+            self._executor.submit(self._timed, verdict, "faces", self._check_faces, image.copy(), content_hash): "faces",
+            self._executor.submit(self._timed, verdict, "nsfw", self._check_nsfw, image, content_hash): "nsfw",
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Upload check '{futures[future]}' failed: {e}")
+            verdict.decided_by = self._decided_by(verdict, {futures[future] for future in pending})
+            if verdict.decided_by:
+                break
+        for future in pending:
+            future.cancel()
+
+        verdict.timings["total"] = time.perf_counter() - started
+        if self.analytics:
+            self.analytics.record_upload_analysis(stage="total", duration_seconds=verdict.timings["total"])
+        logger.debug(f"Upload analysis decided by '{verdict.decided_by}' in "
+                     + ", ".join(f"{stage}: {duration:.3f}s" for stage, duration in verdict.timings.items()))
+        return verdict
+
+    def _decided_by(self, verdict: UploadVerdict, pending: set) -> str:
+        """name of the check which decides the reward, empty if the pending checks are still required"""
+        if verdict.is_ai_image:
+            return "ai_image"
+        if "ai_image" in pending:
+            return ""
+        if verdict.faces is not None and len(verdict.faces) == 0:
+            return "faces"
+        if not pending:
+            return "nsfw"
+        return ""
+
+    def _timed(self, verdict: UploadVerdict, stage: str, check, *args):
+        started = time.perf_counter()
+        try:
+            check(verdict, *args)
+        finally:
+            duration = time.perf_counter() - started
+            verdict.timings[stage] = duration
+            if self.analytics:
+                self.analytics.record_upload_analysis(stage=stage, duration_seconds=duration)
+
+    def _cached(self, stage: str, content_hash: str):
+        return self.analysis_cache.get(stage, content_hash) if self.analysis_cache is not None else None
+
+    def _cache(self, stage: str, content_hash: str, result):
+        if self.analysis_cache is not None:
+            self.analysis_cache.put(stage, content_hash, result)
+
+    def _check_ai_image(self, verdict: UploadVerdict, image_path: str, content_hash: str):
+        result = self._cached("ai_image", content_hash)
+        if result is None:
+            result = self.ai_image_detector.is_ai_image(image_path)
+            if result[0] is not None:  # errors are analyzed again
+                self._cache("ai_image", content_hash, result)
+        verdict.is_ai_image, verdict.ai_reason = result
+
+    def _check_faces(self, verdict: UploadVerdict, image: Image.Image, content_hash: str):
+        faces = self._cached("faces", content_hash)
+        if faces is None:
+            faces, verdict.face_image = self.face_detector.get_faces(image)
+            self._cache("faces", content_hash, faces)
+        verdict.faces = faces
+
+    def _check_nsfw(self, verdict: UploadVerdict, image: Image.Image, content_hash: str):
+        result = self._cached("nsfw", content_hash)
+        if result is None:
+            result = self.nsfw_detector.detect(image)
+            if result.category != NSFWCategory.UNKNOWN:  # errors are analyzed again
+                self._cache("nsfw", content_hash, result)
+        verdict.nsfw = result
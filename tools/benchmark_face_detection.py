@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the face detection on images without faces.
+
+Compares the former retry loop (full buffalo_l pipeline at up to nine detection sizes)
+with the single-pass multi-scale detection of FaceDetector.get_faces. Images without a
+face are the worst case of both paths, random noise and gradient images are used unless
+image files are passed.
+
+Usage (from the project root):
+    python tools/benchmark_face_detection.py
+    python tools/benchmark_face_detection.py --runs 10 landscape1.jpg landscape2.jpg
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.validators import FaceDetector  # noqa: E402
+
+
+def get_faces_with_retry_loop(face_analysis, cv2_image):
+    """former implementation of FaceDetector._reduced_detection_site_detection incl. the first detection"""
+    faces = face_analysis.get(cv2_image)
+    if len(faces) > 0:
+        return faces
+    detection_sizes = [None] + [(size, size) for size in range(640, 256, -64)] + [(256, 256)]
+    for size in detection_sizes:
+        faces = face_analysis.get(cv2_image, det_size=size)
+        if len(faces) > 0:
+            return faces
+    return []
+
+
+def get_faces_multi_scale(detector, face_analysis, cv2_image):
+    faces = face_analysis.get(cv2_image)
+    if len(faces) > 0:
+        return faces
+    return face_analysis.get_multi_scale(cv2_image, det_sizes=detector.REDUCED_DETECTION_SIZES)
+
+
+def measure(name: str, fn, images, runs: int):
+    fn(images[0])  # warmup of the onnx sessions
+    durations = []
+    for run in range(runs):
+        started = time.perf_counter()
+        fn(images[run % len(images)])
+        durations.append((time.perf_counter() - started) * 1000)
+    print(f"{name:<22} mean {np.mean(durations):8.2f} ms   p50 {np.percentile(durations, 50):8.2f} ms   "
+          f"p95 {np.percentile(durations, 95):8.2f} ms")
+    return np.mean(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the face detection on images without faces")
+    parser.add_argument("images", nargs="*", help="image files without faces, random images if empty")
+    parser.add_argument("--size", type=int, default=1024, help="size of the random images")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.images:
+        images = [Image.open(path).convert("RGB") for path in args.images]
+    else:
+        rng = np.random.default_rng(0)
+        gradient = np.linspace(0, 255, args.size, dtype=np.uint8)
+        images = [
+            Image.fromarray(rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)),
+            Image.fromarray(np.stack([np.tile(gradient, (args.size, 1))] * 3, axis=-1))
+        ]
+    # same preparation as FaceDetector.get_faces
+    cv2_images = []
+    for image in images:
+        image = image.copy()
+        image.thumbnail((1024, 1024))
+        cv2_images.append(np.array(image.convert("RGB")))
+
+    detector = FaceDetector(pool_size=1)
+    if detector.pool is None:
+        print("FaceDetector could not be initialized, are the buffalo_l models available?")
+        return
+    print(f"{len(images)} image(s) {cv2_images[0].shape[1]}x{cv2_images[0].shape[0]}, {args.runs} runs")
+    with detector.pool.session() as face_analysis:
+        before = measure("retry loop", lambda image: get_faces_with_retry_loop(face_analysis, image), cv2_images, args.runs)
+        after = measure("multi-scale", lambda image: get_faces_multi_scale(detector, face_analysis, image), cv2_images, args.runs)
+    print(f"speedup {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
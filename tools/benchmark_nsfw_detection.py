@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the NSFW detection paths.
+
+Compares the former path (JPEG encode to a temporary file, NudeNet reads the file)
+with the in-memory path of NSFWDetector.detect, and a loop of detect calls with a
+single detect_batch call. Random noise images are used unless image files are passed.
+
+Usage (from the project root):
+    python tools/benchmark_nsfw_detection.py
+    python tools/benchmark_nsfw_detection.py --size 1024 --runs 50 image1.png image2.png
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.validators import NSFWDetector  # noqa: E402
+
+
+def detect_with_temporary_file(detector: NSFWDetector, image: Image.Image):
+    """former implementation of NSFWDetector.detect"""
+    temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+    try:
+        image.convert('RGB').save(temp_file.name, 'JPEG')
+        return detector.classifier.detect(temp_file.name)
+    finally:
+        os.unlink(temp_file.name)
+
+
+def measure(name: str, fn, images, runs: int):
+    fn(images[0])  # warmup of the onnx session
+    durations = []
+    for run in range(runs):
+        started = time.perf_counter()
+        fn(images[run % len(images)])
+        durations.append((time.perf_counter() - started) * 1000)
+    print(f"{name:<22} mean {np.mean(durations):7.2f} ms   p50 {np.percentile(durations, 50):7.2f} ms   "
+          f"p95 {np.percentile(durations, 95):7.2f} ms")
+    return np.mean(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the NSFW detection paths")
+    parser.add_argument("images", nargs="*", help="image files, random images if empty")
+    parser.add_argument("--size", type=int, default=1024, help="size of the random images")
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.images:
+        images = [Image.open(path).convert("RGB") for path in args.images]
+    else:
+        rng = np.random.default_rng(0)
+        images = [Image.fromarray(rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)) for _ in range(4)]
+
+    detector = NSFWDetector(confidence_threshold=0.7)
+    print(f"{len(images)} image(s) {images[0].size}, {args.runs} runs")
+    before = measure("temporary JPEG file", lambda image: detect_with_temporary_file(detector, image), images, args.runs)
+    after = measure("in-memory", detector.detect, images, args.runs)
+    print(f"speedup {before / after:.2f}x")
+
+    print(f"{len(images)} images per generation")
+    loop = measure("detect loop", lambda _: [detector.detect(image) for image in images], images, args.runs)
+    batch = measure("detect_batch", lambda _: detector.detect_batch(images), images, args.runs)
+    print(f"speedup {loop / batch:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Import the former JSON databases of the upload handler into the SQLite upload history.
+
+uploaded_images.json and created_images.json of OUTPUT_DIRECTORY are imported into
+upload_history.db, existing rows are kept, so the tool can be run more than once. The
+server imports the files on its own if it starts with an empty history, the tool is meant
+for a migration in advance and for the perceptual hashes of the stored uploads.
+
+Usage (from the project root):
+    python tools/migrate_upload_history.py
+    python tools/migrate_upload_history.py --output-directory ./output --index-uploads
+"""
+import argparse
+import os
+import sys
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app import AppConfig  # noqa: E402
+from app.utils.upload_history import UploadHistory  # noqa: E402
+from app.validators import ImageHashIndex, image_fingerprint  # noqa: E402
+
+
+def index_uploads(output_directory: str, history: UploadHistory) -> int:
+    """add the perceptual hashes of the stored uploads (<session>_<hash>_<filename>) to the image index"""
+    upload_directory = os.path.join(output_directory, "upload")
+    if not os.path.isdir(upload_directory):
+        return 0
+    index = ImageHashIndex(path=os.path.join(output_directory, "image_hashes.log"))
+    added = 0
+    for filename in sorted(os.listdir(upload_directory)):
+        parts = filename.split("_", 2)
+        if len(parts) < 3 or not history.get_upload(parts[1]):
+            continue
+        try:
+            if index.add(image_fingerprint(os.path.join(upload_directory, filename)), kind="upload", key=parts[1]):
+                added += 1
+        except Exception as e:
+            print(f"Skipped {filename}: {e}")
+    return added
+
+
+def main():
+    load_dotenv(override=True)
+    parser = argparse.ArgumentParser(description="Import uploaded_images.json and created_images.json into the upload history")
+    parser.add_argument("--output-directory", default=None, help="folder of the JSON files (default: OUTPUT_DIRECTORY)")
+    parser.add_argument("--index-uploads", action="store_true", help="add the perceptual hashes of the stored uploads")
+    args = parser.parse_args()
+
+    output_directory = args.output_directory or AppConfig().output_directory or "./output/"
+    history = UploadHistory(os.path.join(output_directory, "upload_history.db"))
+    uploads, created = history.import_json(
+        uploaded_images_path=os.path.join(output_directory, "uploaded_images.json"),
+        created_images_path=os.path.join(output_directory, "created_images.json")
+    )
+    print(f"Imported {uploads} uploads and {created} created images into {history.path} (existing rows are kept)")
+    if args.index_uploads:
+        print(f"Added {index_uploads(output_directory, history)} uploads to the image index")
+    history.close()
+
+
+if __name__ == "__main__":
+    main()
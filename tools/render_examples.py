@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Render the examples of the models offline with fixed seeds.
+
+The images are stored with a manifest in EXAMPLE_GALLERY_DIRECTORY and are shown by the
+Examples tab without GPU work. The results are also added to the result cache, so
+generating an example with the default settings of the UI doesn't need the GPU either.
+
+Usage (from the project root):
+    python tools/render_examples.py                      # GENERATION_MODEL and SELECTABLE_MODELS
+    python tools/render_examples.py --models "flux1:schnell" --images 2
+"""
+import argparse
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app import AppConfig, setup_logging  # noqa: E402
+from app.generators import (ExampleGallery, GenerationParameters, GenerationResultCache, ModelConfig,  # noqa: E402
+                            cleanup_prompt, example_seed, get_generator, load_examples)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-render the examples of the models")
+    parser.add_argument("--models", nargs="*", help="model names of the modelconfig (default: GENERATION_MODEL and SELECTABLE_MODELS)")
+    parser.add_argument("--images", type=int, default=1, help="images per example (default: 1, as the default of the UI)")
+    parser.add_argument("--examples-file", default="./msgs/examples.json", help="examples used if the model has none")
+    parser.add_argument("--skip-existing", action="store_true", help="don't render examples which are already in the manifest")
+    return parser.parse_args()
+
+
+def create_parameters(modelconfig: ModelConfig, prompt: str, image_count: int) -> GenerationParameters:
+    """same parameters as the UI uses for an example with the default settings"""
+    # same cleanup as ImageGenerationHandler, the seed depends on the cleaned prompt
+    prompt = cleanup_prompt(prompt)
+    width, height = ModelConfig.split_aspect_ratio(next(iter(modelconfig.aspect_ratio.values())))
+    return GenerationParameters(
+        prompt=prompt,
+        negative_prompt="",
+        num_inference_steps=int(modelconfig.generation.get("steps", 30)),
+        guidance_scale=float(modelconfig.generation.get("guidance", 1)),
+        num_images_per_prompt=image_count,
+        width=width,
+        height=height,
+        seed=example_seed(prompt)
+    )
+
+
+def render_model(config: AppConfig, modelconfig: ModelConfig, args, gallery: ExampleGallery, result_cache: GenerationResultCache):
+    examples = load_examples(modelconfig, examples_file=args.examples_file)
+    existing = {example["prompt"] for example in gallery.examples(modelconfig.model)}
+    generator = get_generator(appconfig=config, modelconfig=modelconfig)
+
+    for index, example in enumerate(examples):
+        prompt = example[0] if isinstance(example, (list, tuple)) and len(example) > 0 else example
+        if not isinstance(prompt, str) or not prompt.strip():
+            continue
+        params = create_parameters(modelconfig, prompt, args.images)
+        if args.skip_existing and params.prompt in existing:
+            print(f"[{modelconfig.model}] {index + 1}/{len(examples)} skipped")
+            continue
+
+        # the generator adds the embedding keywords to the prompt of the parameters, the UI
+        # computes the fingerprint before scheduling the generation, so it's done here as well
+        fingerprint = result_cache.fingerprint(params, modelconfig)
+        generation = {
+            "prompt": params.prompt,
+            "negative_prompt": params.negative_prompt,
+            "seed": params.seed,
+            "width": params.width,
+            "height": params.height,
+            "num_inference_steps": params.num_inference_steps,
+            "guidance_scale": params.guidance_scale
+        }
+        started = time.time()
+        images = generator.generate_images(params=params)
+        gallery.add_example(model=modelconfig.model, generation=generation, images=images)
+        result_cache.put(fingerprint, images)
+        # save after every example, so an interrupted run keeps the finished examples
+        gallery.save()
+        print(f"[{modelconfig.model}] {index + 1}/{len(examples)} rendered in {time.time() - started:.1f}s")
+
+
+def main():
+    load_dotenv(override=True)
+    setup_logging()
+    args = parse_args()
+    config = AppConfig()
+
+    with open(config.modelconfig_json, "r") as f:
+        modelconfigs = ModelConfig.create_config_list_from_json(f.read())
+
+    gallery = ExampleGallery(directory=config.example_gallery_directory)
+    result_cache = GenerationResultCache(
+        directory=config.result_cache_directory,
+        max_megabytes=config.result_cache_mb,
+        seeded_only=config.result_cache_seeded_only
+    )
+
+    models = args.models or [config.selected_model] + config.selectable_models
+    for model in dict.fromkeys(models):
+        modelconfig = ModelConfig.get_config(model=model, configs=modelconfigs)
+        if modelconfig is None or modelconfig.sanity_check() is False:
+            print(f"Model '{model}' is not valid and will be ignored")
+            continue
+        render_model(config, modelconfig, args, gallery, result_cache)
+
+    print(f"Manifest written to {gallery.manifest_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Train the optional classifier of the prompt pre-filter.
+
+Reads labeled prompts, one per line as '<label><TAB><prompt>' with the label 1/nsfw or 0/sfw.
+Unlabeled prompt files (one prompt per line) can be labeled by the LLM check with --label-with-llm,
+which requires a running Ollama server. A part of the prompts is held back to report how many
+prompts the classifier decides with the given thresholds and how many of them are wrong.
+
+Usage (from the project root):
+    python tools/train_prompt_classifier.py labeled_prompts.tsv --output models/prompt_classifier.npz
+    python tools/train_prompt_classifier.py tools/prompts.txt --label-with-llm --output models/prompt_classifier.npz
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.validators import PromptClassifier, PromptRefiner  # noqa: E402
+from app.validators.prompt_prefilter import prompt_words  # noqa: E402
+
+
+def read_labeled(path: str):
+    prompts, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            label, _, prompt = line.rstrip("\n").partition("\t")
+            if not prompt.strip():
+                continue
+            prompts.append(prompt.strip())
+            labels.append(label.strip().lower() in ("1", "nsfw", "true", "yes"))
+    return prompts, labels
+
+
+def label_with_llm(path: str):
+    refiner = PromptRefiner()
+    if not refiner.validate_refiner_is_ready():
+        raise SystemExit("Ollama is not available")
+    prompts, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            prompt = line.strip()
+            if prompt:
+                prompts.append(prompt)
+                labels.append(refiner.check_contains_nsfw(prompt)[0])
+    return prompts, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the classifier of the prompt pre-filter")
+    parser.add_argument("prompts", help="labeled prompts (label<TAB>prompt) or plain prompts with --label-with-llm")
+    parser.add_argument("--label-with-llm", action="store_true", help="label the prompts with the LLM check")
+    parser.add_argument("--output", default="models/prompt_classifier.npz")
+    parser.add_argument("--holdout", type=float, default=0.2, help="part of the prompts used for the evaluation")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--safe-below", type=float, default=0.1)
+    parser.add_argument("--unsafe-above", type=float, default=0.95)
+    args = parser.parse_args()
+
+    prompts, labels = label_with_llm(args.prompts) if args.label_with_llm else read_labeled(args.prompts)
+    samples = list(zip(prompts, labels))
+    random.Random(0).shuffle(samples)
+    split = int(len(samples) * (1 - args.holdout))
+    train, test = samples[:split], samples[split:]
+    print(f"{len(samples)} prompts, {sum(labels)} NSFW, {len(train)} for training, {len(test)} for evaluation")
+
+    classifier = PromptClassifier.fit([p for p, _ in train], [l for _, l in train], epochs=args.epochs)
+    decided = wrong = 0
+    for prompt, label in test:
+        score = classifier.score(prompt_words(prompt))
+        if score <= args.safe_below or score >= args.unsafe_above:
+            decided += 1
+            wrong += (score >= args.unsafe_above) != label
+    if test:
+        print(f"evaluation: {decided}/{len(test)} decided without LLM, {wrong} of them wrong")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    classifier.save(args.output)
+    print(f"saved to {args.output}, set PROMPT_PREFILTER_CLASSIFIER={args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from PIL import Image
+from app.validators import AnalysisCache
+
+
+class TestAnalysisCache(unittest.TestCase):
+    def setUp(self):
+        # raw class, the singleton would share the entries between the tests
+        self.cache = AnalysisCache.__wrapped__(max_entries=2, ttl_seconds=60)
+
+    def test_get_or_compute_caches_per_validator(self):
+        calls = []
+        compute = lambda: calls.append(1) or "result"  # noqa: E731
+        self.assertEqual(self.cache.get_or_compute("nsfw", "abc", compute), "result")
+        self.assertEqual(self.cache.get_or_compute("nsfw", "abc", compute), "result")
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(self.cache.get("faces", "abc"))
+        self.assertEqual(self.cache.hit_ratio("nsfw"), 0.5)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put("nsfw", "a", 1)
+        self.cache.put("nsfw", "b", 2)
+        self.cache.get("nsfw", "a")
+        self.cache.put("nsfw", "c", 3)
+        self.assertEqual(self.cache.get("nsfw", "a"), 1)
+        self.assertIsNone(self.cache.get("nsfw", "b"))
+
+    def test_expired_results_are_computed_again(self):
+        with patch("app.validators.analysis_cache.time.monotonic", return_value=1000.0):
+            self.cache.put("nsfw", "a", 1)
+        with patch("app.validators.analysis_cache.time.monotonic", return_value=1061.0):
+            self.assertIsNone(self.cache.get("nsfw", "a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_disabled_cache(self):
+        cache = AnalysisCache.__wrapped__(max_entries=0)
+        cache.put("nsfw", "a", 1)
+        self.assertIsNone(cache.get("nsfw", "a"))
+
+    def test_file_hash_matches_image_hash(self):
+        image = Image.new("RGB", (32, 16), "red")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "upload.png")
+            image.save(path)
+            self.assertEqual(self.cache.file_hash(path), self.cache.image_hash(image))
+            with patch("app.validators.analysis_cache.Image.open") as image_open:
+                self.cache.file_hash(path)
+                image_open.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import torch
+from app.generators.embedding_cache import PromptEmbeddingCache
+
+
+def create_embeddings(size_bytes: int) -> dict:
+    return {"prompt_embeds": torch.zeros(size_bytes // 4, dtype=torch.float32)}
+
+
+class TestPromptEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        # bypass the singleton to get an isolated cache per test
+        self.cache = PromptEmbeddingCache.__wrapped__(max_megabytes=1000 / 1024**2)
+
+    def test_hit_and_miss(self):
+        key = ("model", "a dog", "", None)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, create_embeddings(400))
+        self.assertIs(self.cache.get(key)["prompt_embeds"].dtype, torch.float32)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertIsNone(self.cache.get(("other model", "a dog", "", None)))
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        self.cache.put("a", create_embeddings(400))
+        self.cache.put("b", create_embeddings(400))
+        self.cache.get("a")
+        self.cache.put("c", create_embeddings(400))
+        self.assertEqual(self.cache.used_bytes, 800)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_too_large_and_disabled(self):
+        self.cache.put("large", create_embeddings(2000))
+        self.assertEqual(len(self.cache), 0)
+        disabled = PromptEmbeddingCache.__wrapped__(max_megabytes=0)
+        self.assertFalse(disabled.enabled)
+        disabled.put("a", create_embeddings(4))
+        self.assertEqual(len(disabled), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+from app.generators import ExampleGallery
+
+
+class TestExampleGallery(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_missing_manifest_is_empty(self):
+        gallery = ExampleGallery(directory=self.directory)
+        self.assertEqual(gallery.thumbnails("flux1:schnell"), [])
+        self.assertEqual(gallery.images("flux1:schnell", 0), [])
+
+    def test_add_save_and_load(self):
+        gallery = ExampleGallery(directory=self.directory)
+        images = [Image.new("RGB", (512, 256), "red"), Image.new("RGB", (512, 256), "blue")]
+        gallery.add_example(model="flux1:schnell", generation={"prompt": "a dog", "seed": 1}, images=images)
+        gallery.add_example(model="flux1:schnell", generation={"prompt": "a dog", "seed": 2}, images=images[:1])
+        gallery.save()
+
+        loaded = ExampleGallery(directory=self.directory)
+        self.assertEqual(len(loaded.examples("flux1:schnell")), 1)
+        self.assertEqual(loaded.examples("flux1:schnell")[0]["seed"], 2)
+        thumbnail, caption = loaded.thumbnails("flux1:schnell")[0]
+        self.assertEqual(caption, "a dog")
+        with Image.open(thumbnail) as image:
+            self.assertEqual(image.size, (256, 128))
+        paths = loaded.images("flux1:schnell", 0)
+        self.assertEqual(len(paths), 1)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import unittest
+import numpy as np
+from insightface.model_zoo.scrfd import SCRFD
+from app.validators.FaceDetector import FaceAnalysisEnhanced, FaceAnalysisPool
+
+
+class FakeDetector:
+    """finds one face at the two smallest sizes, at slightly different positions"""
+    det_thresh = 0.5
+    nms_thresh = 0.4
+    use_kps = False
+    nms = SCRFD.nms
+
+    def __init__(self):
+        self.sizes = []
+
+    def forward(self, det_img, threshold):
+        size = det_img.shape[0]
+        self.sizes.append(size)
+        if size > 384:
+            return [np.empty((0, 1), dtype=np.float32)], [np.empty((0, 4), dtype=np.float32)], []
+        # face box in the coordinates of the detection image, the image is scaled to fit into it
+        offset = 2 if size == 256 else 0
+        box = np.array([[10 + offset, 10, size // 2, size // 2]], dtype=np.float32)
+        return [np.array([[0.9 if size == 256 else 0.8]], dtype=np.float32)], [box], []
+
+
+class FakeAgeModel:
+    def get(self, img, face):
+        face.age = 30
+
+
+class TestFaceAnalysisPool(unittest.TestCase):
+    def test_sessions_are_created_on_demand(self):
+        pool = FaceAnalysisPool(factory=object, max_size=2)
+        first = pool.checkout()
+        pool.checkin(first)
+        self.assertIs(pool.checkout(), first)
+        self.assertEqual(pool.size, 1)
+        second = pool.checkout()
+        self.assertIsNot(second, first)
+        self.assertEqual(pool.size, 2)
+
+    def test_full_pool_waits_for_returned_session(self):
+        pool = FaceAnalysisPool(factory=object, max_size=1)
+        session = pool.checkout()
+        threading.Timer(0.1, pool.checkin, args=(session,)).start()
+        self.assertIs(pool.checkout(timeout=2), session)
+        self.assertEqual(pool.size, 1)
+
+    def test_failed_creation_is_not_counted(self):
+        def factory():
+            raise RuntimeError("model missing")
+        pool = FaceAnalysisPool(factory=factory, max_size=1)
+        with self.assertRaises(RuntimeError):
+            pool.checkout()
+        self.assertEqual(pool.size, 0)
+
+
+class TestMultiScaleDetection(unittest.TestCase):
+    def setUp(self):
+        # no models are loaded, only the detector stage and the attribute models are replaced
+        self.face_analysis = FaceAnalysisEnhanced.__new__(FaceAnalysisEnhanced)
+        self.face_analysis.det_model = FakeDetector()
+        self.face_analysis.models = {"detection": self.face_analysis.det_model, "genderage": FakeAgeModel()}
+
+    def test_candidates_of_all_scales_are_merged(self):
+        image = np.zeros((1024, 768, 3), dtype=np.uint8)
+        faces = self.face_analysis.get_multi_scale(image, det_sizes=[(512, 512), (384, 384), (256, 256)])
+        self.assertEqual(self.face_analysis.det_model.sizes, [512, 384, 256])
+        self.assertEqual(len(faces), 1)
+        self.assertAlmostEqual(float(faces[0].det_score), 0.9)
+        self.assertEqual(faces[0].age, 30)
+        # box in coordinates of the original image
+        np.testing.assert_allclose(faces[0].bbox, np.array([12, 10, 128, 128]) * 4, rtol=1e-5)
+
+    def test_no_face(self):
+        image = np.zeros((512, 512, 3), dtype=np.uint8)
+        self.assertEqual(self.face_analysis.get_multi_scale(image, det_sizes=[(640, 640)]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
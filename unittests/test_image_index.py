@@ -0,0 +1,73 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image, ImageFilter
+from app.validators import ImageHashIndex, image_fingerprint
+from app.validators.image_index import hamming_distance
+
+
+def create_image(seed: int) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((640, 480), Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(4))
+
+
+class TestImageFingerprint(unittest.TestCase):
+    def test_altered_image_has_similar_hash(self):
+        image = create_image(1)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=70)
+        buffer.seek(0)
+        fingerprint = image_fingerprint(image)
+        for altered in (Image.open(buffer), image.resize((320, 240)), image.crop((5, 4, 635, 476))):
+            altered_fingerprint = image_fingerprint(altered)
+            self.assertLessEqual(hamming_distance(fingerprint[0], altered_fingerprint[0]), 6)
+            self.assertLessEqual(hamming_distance(fingerprint[1], altered_fingerprint[1]), 6)
+
+    def test_different_images_are_far_apart(self):
+        self.assertGreater(hamming_distance(image_fingerprint(create_image(1))[0], image_fingerprint(create_image(2))[0]), 12)
+
+
+class TestImageHashIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "image_hashes.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_find_matches_brute_force(self):
+        rnd = random.Random(0)
+        index = ImageHashIndex(max_distance=7)
+        entries = [(rnd.getrandbits(64), rnd.getrandbits(64)) for _ in range(2000)]
+        for key, fingerprint in enumerate(entries):
+            index.add(fingerprint, kind="upload", key=str(key))
+        for key in range(0, 2000, 100):
+            # flip 7 random bits of both hashes
+            phash, dhash = entries[key]
+            for bit in rnd.sample(range(64), 7):
+                phash ^= 1 << bit
+            for bit in rnd.sample(range(64), 7):
+                dhash ^= 1 << bit
+            self.assertEqual(index.find((phash, dhash)), (str(key), 7))
+            self.assertIsNone(index.find((phash, dhash), max_distance=6))
+
+    def test_kind_filter_and_persistence(self):
+        fingerprint = image_fingerprint(create_image(1))
+        index = ImageHashIndex(path=self.path)
+        self.assertTrue(index.add(fingerprint, kind="created", key="abc"))
+        self.assertFalse(index.add(fingerprint, kind="created", key="abc"))
+        self.assertIsNone(index.find(fingerprint, kind="upload"))
+
+        loaded = ImageHashIndex(path=self.path)
+        self.assertEqual(len(loaded), 1)
+        self.assertIn(("created", "abc"), loaded)
+        self.assertEqual(loaded.find(image_fingerprint(create_image(1).resize((320, 240))), kind="created")[0], "abc")
+
+
+if __name__ == '__main__':
+    unittest.main()
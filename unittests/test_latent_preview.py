@@ -0,0 +1,26 @@
+import unittest
+import torch
+from app.generators.latent_preview import get_latent_format, latents_to_images
+
+
+class TestLatentPreview(unittest.TestCase):
+    def test_latent_format(self):
+        self.assertEqual(get_latent_format("flux"), "flux")
+        self.assertEqual(get_latent_format("SDXL"), "sdxl")
+        self.assertEqual(get_latent_format("sd1.5"), "sd1.5")
+        self.assertIsNone(get_latent_format("unknown"))
+
+    def test_preview_size(self):
+        previews = latents_to_images(torch.randn(2, 4, 8, 16), "sd1.5")
+        self.assertEqual(len(previews), 2)
+        self.assertEqual(previews[0].size, (16, 8))
+        self.assertEqual(previews[0].mode, "RGB")
+        self.assertEqual(latents_to_images(torch.zeros(1, 16, 4, 4), "flux")[0].size, (4, 4))
+
+    def test_channel_mismatch(self):
+        with self.assertRaises(ValueError):
+            latents_to_images(torch.zeros(1, 16, 4, 4), "sdxl")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
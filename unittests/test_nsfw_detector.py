@@ -4,7 +4,7 @@ import numpy as np
 import os
 import tempfile
 from pathlib import Path
-from app.validators import NSFWDetector, NSFWCategory, NSFWDetectionResult
+from app.validators import NSFWDetector, NSFWCategory, NSFWDetectionResult, CensorMethod
 
 class TestNSFWDetector(unittest.TestCase):
     @classmethod
@@ -82,6 +82,26 @@ class TestNSFWDetector(unittest.TestCase):
         self.assertIsInstance(result, NSFWDetectionResult)
         self.assertIsInstance(result.is_safe, bool)
 
+    def test_detect_numpy_array(self):
+        """Test detection on RGB arrays gives the same result as on PIL images"""
+        image = Image.open("examples/disneystyle.png").convert("RGB")
+        from_image = self.detector.detect(image)
+        from_array = self.detector.detect(np.asarray(image))
+
+        self.assertEqual(from_image.details, from_array.details)
+        self.assertGreater(len(from_array.details), 0)
+
+    def test_detect_batch(self):
+        """Test batch detection maps the detections back to the images"""
+        images = [Image.open("examples/disneystyle.png"), Image.new('RGB', (300, 200), color='white')]
+        results = self.detector.detect_batch(images)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual([d['box'] for d in results[0].details],
+                         [d['box'] for d in self.detector.detect(images[0]).details])
+        self.assertEqual(results[1].details, [])
+        self.assertEqual(self.detector.detect_batch([]), [])
+
     def test_detect_invalid_image(self):
         """Test detection with invalid image"""
         invalid_img = Image.new('RGB', (1, 1))  # Too small image
@@ -167,6 +187,34 @@ class TestNSFWDetector(unittest.TestCase):
         # Results should be different due to different thresholds
         self.assertNotEqual(strict_result.category, lenient_result.category)
 
+    def test_censor_detected_regions(self):
+        """Test only the pixels of the (overlapping) boxes are censored"""
+        image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (256, 256, 3), dtype=np.uint8))
+        detection = NSFWDetectionResult(is_safe=False, category=NSFWCategory.EXPLICIT, confidence=0.9, details=[
+            {'class': 'FEMALE_BREAST_EXPOSED', 'score': 0.9, 'box': [10, 10, 100, 50]},
+            {'class': 'BUTTOCKS_EXPOSED', 'score': 0.9, 'box': [60, 40, 100, 100]},
+            {'class': 'FACE_FEMALE', 'score': 0.9, 'box': [200, 200, 50, 50]}
+        ])
+        mask = np.zeros((256, 256), dtype=bool)
+        mask[10:60, 10:110] = True
+        mask[40:140, 60:160] = True
+        original = np.asarray(image)
+
+        for method in CensorMethod:
+            censored = np.asarray(self.detector.censor_detected_regions(image, detection, method=method))
+            self.assertEqual(censored.shape, original.shape)
+            # outside of the boxes (incl. the not censored face) nothing changed
+            np.testing.assert_array_equal(censored[~mask], original[~mask])
+            self.assertFalse(np.array_equal(censored[mask], original[mask]), method)
+            if method == CensorMethod.BLACK:
+                self.assertEqual(censored[mask].max(), 0)
+
+    def test_merge_boxes(self):
+        """Test overlapping boxes are merged transitively"""
+        merged = self.detector._merge_boxes([(0, 0, 10, 10), (50, 50, 60, 60), (5, 5, 20, 20), (15, 15, 55, 52)])
+        self.assertEqual(merged, [(0, 0, 60, 60)])
+        self.assertEqual(len(self.detector._merge_boxes([(0, 0, 10, 10), (10, 0, 20, 10)])), 2)
+
     def test_multiple_detections(self):
         """Test multiple consecutive detections"""
         with Image.open(self.test_images['color']) as img:
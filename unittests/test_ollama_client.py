@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import ANY, MagicMock
+
+import httpx
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.validators import CircuitBreaker, OllamaClient, OllamaUnavailableException, PromptPrefilter, PromptRefiner
+from app.validators.ollama_client import CircuitOpenException
+
+
+class FakeOllamaServer:
+    """handler of httpx.MockTransport with the chat and pull API"""
+
+    def __init__(self, content: str = "yes", delay: float = 0, status: int = 200):
+        self.content = content
+        self.delay = delay
+        self.status = status
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        with self._lock:
+            self.requests.append((request.url.path, payload))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if request.url.path == "/api/pull":
+                return httpx.Response(200, json={"status": "success"})
+            return httpx.Response(self.status, json={
+                "message": {"role": "assistant", "content": self.content},
+                "prompt_eval_count": 30, "eval_count": 5,
+            })
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_and_reset(self):
+        states = []
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05, on_state_change=states.append)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+        # only one trial call
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(states, ["open", "half_open", "open", "half_open", "closed"])
+
+
+class TestOllamaClient(unittest.TestCase):
+    def create_client(self, server: FakeOllamaServer, **kwargs) -> OllamaClient:
+        self.analytics = MagicMock()
+        client = OllamaClient(server="ollama:11434", model="llava", analytics=self.analytics,
+                              transport=httpx.MockTransport(server), **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_chat(self):
+        server = FakeOllamaServer(content='{"nudity": false}')
+        client = self.create_client(server)
+        ai_msg = client.chat([SystemMessage("system"), HumanMessage("question"), AIMessage("answer")],
+                             temperature=0.6, format="json")
+
+        self.assertEqual(client.server, "http://ollama:11434")
+        self.assertEqual(ai_msg.content, '{"nudity": false}')
+        self.assertEqual(ai_msg.usage_metadata["total_tokens"], 35)
+        path, payload = server.requests[0]
+        self.assertEqual(path, "/api/chat")
+        self.assertEqual([message["role"] for message in payload["messages"]], ["system", "user", "assistant"])
+        self.assertEqual((payload["model"], payload["format"], payload["options"]["temperature"]), ("llava", "json", 0.6))
+        self.analytics.record_llm_call.assert_called_with(outcome="success", duration_seconds=ANY)
+        self.analytics.update_llm_circuit_state.assert_called_with(state="closed")
+
+    def test_pull(self):
+        server = FakeOllamaServer()
+        client = self.create_client(server)
+        self.assertTrue(client.wait_for_model(timeout_seconds=5))
+        self.assertEqual(server.requests[0], ("/api/pull", {"model": "llava", "stream": False}))
+
+    def test_timeout_opens_circuit(self):
+        server = FakeOllamaServer(delay=0.5)
+        client = self.create_client(server, timeout_seconds=0.05,
+                                    breaker=CircuitBreaker(failure_threshold=2, reset_seconds=60))
+        for _ in range(2):
+            with self.assertRaises(OllamaUnavailableException):
+                client.chat([HumanMessage("question")])
+        self.assertEqual(client.breaker.state, "open")
+
+        started = time.perf_counter()
+        with self.assertRaises(CircuitOpenException):
+            client.chat([HumanMessage("question")])
+        self.assertLess(time.perf_counter() - started, 0.05)
+        self.assertEqual(len(server.requests), 2)
+        self.analytics.record_llm_call.assert_any_call(outcome="timeout", duration_seconds=ANY)
+        self.analytics.record_llm_call.assert_called_with(outcome="rejected", duration_seconds=0)
+
+    def test_server_error(self):
+        client = self.create_client(FakeOllamaServer(status=500))
+        with self.assertRaises(OllamaUnavailableException):
+            client.chat([HumanMessage("question")])
+        self.analytics.record_llm_call.assert_called_with(outcome="error", duration_seconds=ANY)
+
+    def test_bounded_concurrency(self):
+        server = FakeOllamaServer(delay=0.05)
+        client = self.create_client(server, max_concurrency=2)
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            answers = list(executor.map(lambda _: client.chat([HumanMessage("question")]).content, range(6)))
+        self.assertEqual(answers, ["yes"] * 6)
+        self.assertEqual(server.max_in_flight, 2)
+
+
+class TestPromptRefinerFallback(unittest.TestCase):
+    """Ollama is down, the circuit breaker is open"""
+
+    def setUp(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+        breaker.record_failure()
+        self.server = FakeOllamaServer()
+        client = OllamaClient(server=None, model="llava", breaker=breaker, transport=httpx.MockTransport(self.server))
+        self.addCleanup(client.close)
+        self.refiner = PromptRefiner(classification_mode="structured", client=client, prefilter=PromptPrefilter())
+
+    def test_check_falls_back_to_prefilter(self):
+        self.assertEqual(self.refiner.check_contains_nsfw("naked man"), (True, "nudity: naked man"))
+        # ambiguous terms are NSFW while the LLM can't decide them
+        self.assertEqual(self.refiner.check_contains_nsfw("woman in underwear"), (True, "llm unavailable, ambiguous terms: underwear"))
+        self.assertEqual(self.refiner.check_contains_nsfw("naked teen"), (True, "llm unavailable, ambiguous terms: naked"))
+        self.assertEqual(self.refiner.check_contains_nsfw("a d.o.g on a beach"), (False, "llm unavailable"))
+
+    def test_prompt_unchanged(self):
+        self.assertEqual(self.refiner.make_prompt_sfw("naked man"), "naked man")
+        self.assertEqual(self.refiner.magic_enhance("a dog"), "a dog")
+        chat_requests = [path for path, _ in self.server.requests if path == "/api/chat"]
+        self.assertEqual(chat_requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
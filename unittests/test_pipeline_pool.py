@@ -0,0 +1,176 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+import torch
+from app.generators import ModelConfig
+from app.generators.pipeline_pool import PipelinePool, Residency, estimate_pipeline_bytes
+
+
+class FakePipeline:
+    """pipeline replacement with one torch module of the given size in bytes (float32)"""
+
+    def __init__(self, size_bytes: int = 400):
+        self.components = {"unet": torch.nn.Linear(size_bytes // 4, 1, bias=False), "scheduler": object()}
+
+    def to(self, device):
+        for component in self.components.values():
+            if isinstance(component, torch.nn.Module):
+                component.to(device)
+        return self
+
+
+def create_modelconfig(name: str, path: str = None) -> ModelConfig:
+    return ModelConfig(model=name, path=path or f"models/{name}", model_type="StableDiffusion", parent="", description=name,
+                       generation={}, aspect_ratio={}, embeddings={}, loras=[], examples=[])
+
+
+class TestPipelinePool(unittest.TestCase):
+    def setUp(self):
+        self.loaded = []
+
+    def _loader(self, name: str, size_bytes: int = 400):
+        def load():
+            self.loaded.append(name)
+            return FakePipeline(size_bytes)
+        return load
+
+    def test_resident_pipeline_is_reused(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        model = create_modelconfig("a")
+        first = pool.get_or_load(model, self._loader("a"))
+        second = pool.get_or_load(model, self._loader("a"))
+        self.assertIs(first, second)
+        self.assertEqual(self.loaded, ["a"])
+
+    def test_least_recently_used_is_evicted(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        a, b, c = create_modelconfig("a"), create_modelconfig("b"), create_modelconfig("c")
+        pool.get_or_load(a, self._loader("a"))
+        pool.get_or_load(b, self._loader("b"))
+        pool.get_or_load(a, self._loader("a"))
+        pool.get_or_load(c, self._loader("c"))
+        self.assertEqual(pool.resident_models, ["a", "c"])
+        self.assertFalse(pool.contains(b))
+
+    def test_memory_budget(self):
+        pool = PipelinePool.__wrapped__(max_models=5, memory_budget_gb=1000 / 1024**3)
+        pool.get_or_load(create_modelconfig("a"), self._loader("a", 400))
+        pool.get_or_load(create_modelconfig("b"), self._loader("b", 400))
+        self.assertEqual(pool.used_bytes, 800)
+        pool.get_or_load(create_modelconfig("c"), self._loader("c", 400))
+        self.assertEqual(pool.resident_models, ["b", "c"])
+        # a single pipeline above the budget stays resident
+        pool.get_or_load(create_modelconfig("d"), self._loader("d", 2000))
+        self.assertEqual(pool.resident_models, ["d"])
+
+    def test_same_pipeline_for_models_with_same_path(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        pool.get_or_load(create_modelconfig("a", path="models/shared"), self._loader("a"))
+        pool.get_or_load(create_modelconfig("b", path="models/shared"), self._loader("b"))
+        self.assertEqual(self.loaded, ["a"])
+
+    def test_failed_loading_is_not_stored(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        self.assertIsNone(pool.get_or_load(create_modelconfig("a"), lambda: None))
+        self.assertEqual(pool.resident_models, [])
+
+    def test_unload(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        a, b = create_modelconfig("a"), create_modelconfig("b")
+        pool.get_or_load(a, self._loader("a"))
+        pool.get_or_load(b, self._loader("b"))
+        pool.unload(a)
+        self.assertEqual(pool.resident_models, ["b"])
+        pool.unload_all()
+        self.assertEqual(pool.used_bytes, 0)
+
+    def test_idle_pipeline_is_offloaded_and_promoted(self):
+        with tempfile.TemporaryDirectory() as offload_directory:
+            pool = PipelinePool.__wrapped__(max_models=2, offload_directory=offload_directory)
+            model = create_modelconfig("a")
+            pipeline = pool.get_or_load(model, self._loader("a"), device="cpu")
+            weights = pipeline.components["unet"].weight.detach().clone()
+
+            pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+            self.assertEqual(pool.residency_of(model), Residency.DEVICE)
+
+            pool._pipelines[pool.key_for(model)].last_used = datetime.now() - timedelta(minutes=20)
+            pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+            self.assertEqual(pool.residency_of(model), Residency.CPU)
+
+            pool._pipelines[pool.key_for(model)].last_used = datetime.now() - timedelta(minutes=50)
+            pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+            self.assertEqual(pool.residency_of(model), Residency.DISK)
+            self.assertEqual(pipeline.components["unet"].weight.numel(), 0)
+            self.assertEqual(pool.used_bytes, 0)
+
+            promoted = pool.get_or_load(model, self._loader("a"), device="cpu")
+            self.assertIs(promoted, pipeline)
+            self.assertEqual(self.loaded, ["a"])
+            self.assertEqual(pool.residency_of(model), Residency.DEVICE)
+            self.assertTrue(torch.equal(promoted.components["unet"].weight, weights))
+            self.assertEqual(os.listdir(offload_directory), [])
+
+    def test_idle_pipeline_without_device_is_unloaded(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        model = create_modelconfig("a")
+        pool.get_or_load(model, self._loader("a"))
+        pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+        self.assertEqual(pool.residency_of(model), Residency.DEVICE)
+        pool._pipelines[pool.key_for(model)].last_used = datetime.now() - timedelta(days=1)
+        pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+        self.assertFalse(pool.contains(model))
+
+    def test_failed_offload_removes_pipeline(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        model = create_modelconfig("a")
+        pipeline = pool.get_or_load(model, self._loader("a"), device="cuda")
+
+        def fail(device):
+            raise RuntimeError("out of memory")
+        pipeline.to = fail
+        pool._pipelines[pool.key_for(model)].last_used = datetime.now() - timedelta(minutes=20)
+        pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+        self.assertFalse(pool.contains(model))
+        pool.get_or_load(model, self._loader("a"), device="cpu")
+        self.assertEqual(self.loaded, ["a", "a"])
+
+    def test_pipeline_in_use_is_not_evicted(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        a, b, c = create_modelconfig("a"), create_modelconfig("b"), create_modelconfig("c")
+        pool.get_or_load(a, self._loader("a"), checkout=True)
+        pool.get_or_load(b, self._loader("b"))
+        pool.get_or_load(c, self._loader("c"))
+        self.assertEqual(pool.resident_models, ["a", "c"])
+        pool.checkin(a)
+        pool.get_or_load(b, self._loader("b"))
+        self.assertEqual(pool.resident_models, ["c", "b"])
+
+    def test_pipeline_in_use_is_not_offloaded(self):
+        pool = PipelinePool.__wrapped__(max_models=2)
+        model = create_modelconfig("a")
+        pipeline = pool.get_or_load(model, self._loader("a"), device="cpu", checkout=True)
+        entry = pool._pipelines[pool.key_for(model)]
+        # generation runs longer than the idle time
+        entry.last_used = datetime.now() - timedelta(minutes=20)
+        pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+        self.assertEqual(pool.residency_of(model), Residency.DEVICE)
+        self.assertEqual(pipeline.components["unet"].weight.numel(), 100)
+
+        # the idle time starts when the generation ends
+        pool.checkin(model)
+        self.assertEqual(entry.in_use, 0)
+        pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+        self.assertEqual(pool.residency_of(model), Residency.DEVICE)
+        entry.last_used = datetime.now() - timedelta(minutes=20)
+        pool.offload_idle(cpu_after_minutes=15, disk_after_minutes=30)
+        self.assertEqual(pool.residency_of(model), Residency.CPU)
+
+    def test_estimate_pipeline_bytes(self):
+        self.assertEqual(estimate_pipeline_bytes(FakePipeline(400)), 400)
+        self.assertEqual(estimate_pipeline_bytes(object()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,66 @@
+import unittest
+import threading
+from PIL import Image
+from app.generators import GenerationParameters, ModelConfig, ModelPreloader, ReadinessState
+from app.generators.scheduler import GenerationScheduler
+
+
+class WarmupGenerator:
+    """generator replacement recording the warmup calls"""
+
+    def __init__(self, fail: bool = False):
+        self.modelconfig = ModelConfig(model="test", path="models/test", model_type="sd1.5", parent="", description="test",
+                                       generation={"guidance": 5}, aspect_ratio={"Square": "64x64", "Portrait": "64x96", "Other": "64x64"},
+                                       embeddings={}, loras=[], examples=[])
+        self.release = threading.Event()
+        self.fail = fail
+        self.calls = []
+
+    def warmup(self):
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("model not found")
+        self.calls.append("load")
+
+    def generate_images(self, params: GenerationParameters, step_callback=None, cancel_token=None):
+        self.calls.append((params.prompt, params.width, params.height))
+        return [Image.new("RGB", (params.width, params.height))]
+
+
+class TestModelPreloader(unittest.TestCase):
+    def test_preload_and_warmup_resolutions(self):
+        generator = WarmupGenerator()
+        generator.release.set()
+        # bypass the singleton to get an isolated preloader per test
+        preloader = ModelPreloader.__wrapped__(generator=generator, warmup_steps=1)
+        self.assertEqual(preloader.state, ReadinessState.COLD)
+        preloader.start()
+        self.assertTrue(preloader.wait_until_ready(5))
+        self.assertEqual(preloader.state, ReadinessState.READY)
+        warmup_prompt = ModelPreloader.WARMUP_PROMPT
+        self.assertEqual(generator.calls, ["load", (warmup_prompt, 64, 64), (warmup_prompt, 64, 96)])
+
+    def test_failed_preload_opens_gate(self):
+        generator = WarmupGenerator(fail=True)
+        generator.release.set()
+        preloader = ModelPreloader.__wrapped__(generator=generator)
+        preloader.start()
+        self.assertTrue(preloader.wait_until_ready(5))
+        self.assertEqual(preloader.state, ReadinessState.FAILED)
+
+    def test_jobs_wait_for_preload(self):
+        generator = WarmupGenerator()
+        preloader = ModelPreloader.__wrapped__(generator=generator, warmup_steps=0)
+        scheduler = GenerationScheduler.__wrapped__(generator=generator, ready=preloader.ready_event)
+        preloader.start()
+        job = scheduler.submit(GenerationParameters(prompt="a dog", width=64, height=64), session="s1")
+        self.assertFalse(job.wait(0.3))
+        self.assertEqual(scheduler.get_position(job)[0], 1)
+
+        generator.release.set()
+        self.assertTrue(job.wait(5))
+        self.assertEqual(generator.calls, ["load", ("a dog", 64, 64)])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
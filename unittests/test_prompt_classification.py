@@ -0,0 +1,44 @@
+import unittest
+import sys, os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.validators import PromptRefiner
+
+
+class TestParseNSFWVerdict(unittest.TestCase):
+    """Parser of the structured NSFW check, no Ollama required"""
+
+    def test_valid_answer(self):
+        verdict = PromptRefiner.parse_nsfw_verdict(
+            '{"nudity": {"flag": true, "reason": "naked woman"}, "genitals": {"flag": false, "reason": ""},'
+            ' "death": {"flag": false, "reason": ""}}')
+        self.assertEqual(verdict["nudity"], (True, "naked woman"))
+        self.assertEqual(verdict["genitals"], (False, ""))
+        self.assertEqual(verdict["death"], (False, ""))
+
+    def test_text_and_code_fence_around_json(self):
+        content = 'Here is the answer:\n```json\n{"Nudity": false, "genitals": "no", "death": "Yes, dead body"}\n```\nDone.'
+        verdict = PromptRefiner.parse_nsfw_verdict(content)
+        self.assertEqual(verdict["nudity"], (False, ""))
+        self.assertEqual(verdict["genitals"], (False, ""))
+        self.assertEqual(verdict["death"], (True, ""))
+
+    def test_alternative_flag_keys(self):
+        verdict = PromptRefiner.parse_nsfw_verdict(
+            '{"nudity": {"answer": "yes", "reason": "nude"}, "genitals": {"value": 0}, "death": {"flag": "false"}}')
+        self.assertEqual(verdict["nudity"], (True, "nude"))
+        self.assertFalse(verdict["genitals"][0])
+        self.assertFalse(verdict["death"][0])
+
+    def test_invalid_answers(self):
+        self.assertIsNone(PromptRefiner.parse_nsfw_verdict(""))
+        self.assertIsNone(PromptRefiner.parse_nsfw_verdict("No, the text is fine."))
+        self.assertIsNone(PromptRefiner.parse_nsfw_verdict('{"nudity": false, "genitals": false'))
+        # missing category
+        self.assertIsNone(PromptRefiner.parse_nsfw_verdict('{"nudity": false, "genitals": false}'))
+        # undecidable flag
+        self.assertIsNone(PromptRefiner.parse_nsfw_verdict('{"nudity": "maybe", "genitals": false, "death": false}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import ANY, MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.validators import PromptRefiner, PromptPrefilter, PromptClassifier
+from app.validators.prompt_prefilter import TermAutomaton, prompt_words
+
+
+class TestTermAutomaton(unittest.TestCase):
+    def test_overlapping_terms(self):
+        automaton = TermAutomaton([(("a", "b", "c"), 1), (("b", "c"), 2), (("b",), 3), (("c", "d"), 4)])
+        self.assertEqual(sorted(automaton.find("a b c d".split())), [1, 2, 3, 4])
+        self.assertEqual(sorted(automaton.find("x a b x b c".split())), [2, 3, 3])
+        self.assertEqual(automaton.find("ab bc cd".split()), [])
+
+    def test_prompt_words(self):
+        self.assertEqual(prompt_words("A P0rn-Star, 3 dogs"), ["a", "porn", "star", "3", "dogs"])
+        self.assertEqual(prompt_words("style #!!#a cat#!!# style", "#!!#"), ["a", "cat"])
+
+
+class TestPromptPrefilter(unittest.TestCase):
+    def setUp(self):
+        self.prefilter = PromptPrefilter(promptmarker="#!!#")
+
+    def test_lexical_tier(self):
+        decision = self.prefilter.classify("Naked image of a man and a woman")
+        self.assertTrue(decision.nsfw)
+        self.assertEqual(decision.reason, "nudity: naked image")
+        self.assertTrue(self.prefilter.classify("image of a woman without clothes").nsfw)
+        self.assertTrue(self.prefilter.classify("killed people in a house").nsfw)
+        # the context decides
+        self.assertIsNone(self.prefilter.classify("woman in underwear").nsfw)
+        self.assertIsNone(self.prefilter.classify("bloody brain").nsfw)
+        self.assertIsNone(self.prefilter.classify("naked mole rat").nsfw)
+        self.assertIsNone(self.prefilter.classify("nude color dress").nsfw)
+
+    def test_lexical_safe_tier(self):
+        decision = self.prefilter.classify("a dog on a beach")
+        self.assertEqual((decision.nsfw, decision.tier), (False, "lexical"))
+        # hints of implicit phrasings and spelled out words are checked by the LLM
+        for prompt in ["a woman wearing nothing", "girl in her birthday suit", "n.a.k.e.d woman"]:
+            decision = self.prefilter.classify(prompt)
+            self.assertIsNone(decision.nsfw, f"'{prompt}' has to be checked by the LLM")
+        prefilter = PromptPrefilter(lexical_safe=False)
+        self.assertIsNone(prefilter.classify("a dog on a beach").nsfw)
+
+    def test_custom_term_list(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "terms.txt")
+            with open(path, "w") as f:
+                f.write("# comment\nunsafe animals angry dog\nambiguous animals cat\ninvalid line\n")
+            prefilter = PromptPrefilter(terms_path=path)
+            self.assertTrue(prefilter.classify("an angry dog").nsfw)
+            self.assertEqual(prefilter.classify("a cat").reason, "cat")
+            self.assertFalse(prefilter.classify("a dog").nsfw)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def test_classifier_tier(self):
+        prompts = ["a red car", "a dog on a beach", "a tree in autumn", "sexy girl in lingerie on the bed",
+                   "sexy woman in the shower", "seductive girl in bed"]
+        labels = [False, False, False, True, True, True]
+        classifier = PromptClassifier.fit(prompts, labels, buckets=1024, epochs=50)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "classifier.npz")
+            classifier.save(path)
+            classifier = PromptClassifier.load(path)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        prefilter = PromptPrefilter(classifier=classifier, safe_below=0.2, unsafe_above=0.8)
+        decision = prefilter.classify("sexy girl in bed")
+        self.assertEqual((decision.nsfw, decision.tier), (True, "classifier"))
+        decision = prefilter.classify("a red car")
+        self.assertEqual((decision.nsfw, decision.tier), (False, "classifier"))
+        # unsafe terms decide before the classifier
+        self.assertEqual(prefilter.classify("a naked woman").tier, "lexical")
+
+
+class TestPromptRefinerPrefilter(unittest.TestCase):
+    def setUp(self):
+        self.analytics = MagicMock()
+        self.refiner = PromptRefiner(classification_mode="structured", client=MagicMock(),
+                                     prefilter=PromptPrefilter(), analytics=self.analytics)
+        self.refiner.llm = MagicMock()
+        self.refiner.llm_json = MagicMock()
+        self.refiner.llm_json.invoke.return_value = MagicMock(
+            content='{"nudity": false, "genitals": false, "death": false}')
+
+    def test_decided_without_llm(self):
+        self.assertEqual(self.refiner.check_contains_nsfw("naked man"), (True, "nudity: naked man"))
+        self.refiner.llm_json.invoke.assert_not_called()
+        self.analytics.record_prompt_check.assert_any_call(tier="lexical", verdict="nsfw", duration_seconds=ANY)
+
+    def test_safe_prompt_decided_without_llm(self):
+        self.assertEqual(self.refiner.check_contains_nsfw("a dog on a beach"), (False, ""))
+        self.refiner.llm_json.invoke.assert_not_called()
+        self.analytics.record_prompt_check.assert_any_call(tier="lexical", verdict="sfw", duration_seconds=ANY)
+
+    def test_ambiguous_prompt_checked_by_llm(self):
+        self.assertEqual(self.refiner.check_contains_nsfw("woman in underwear"), (False, ""))
+        self.assertEqual(self.refiner.check_contains_nsfw("a woman wearing nothing"), (False, ""))
+        self.assertEqual(self.refiner.llm_json.invoke.call_count, 2)
+        self.analytics.record_prompt_check.assert_any_call(tier="lexical", verdict="ambiguous", duration_seconds=ANY)
+        self.analytics.record_prompt_check.assert_any_call(tier="llm", verdict="sfw", duration_seconds=ANY)
+
+
+if __name__ == '__main__':
+    unittest.main()
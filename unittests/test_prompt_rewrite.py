@@ -0,0 +1,89 @@
+import os
+import sys
+import unittest
+from unittest.mock import ANY, MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.validators import PromptRefiner
+
+SFW_ANSWER = '{"nudity": false, "genitals": false, "death": false}'
+NSFW_ANSWER = '{"nudity": {"flag": true, "reason": "naked"}, "genitals": false, "death": false}'
+
+
+def ai_message(content: str, tokens: int = 100):
+    return MagicMock(content=content, usage_metadata={"total_tokens": tokens})
+
+
+class TestMakePromptSFW(unittest.TestCase):
+    """Bounded rewrite of make_prompt_sfw with mocked llms"""
+
+    def setUp(self):
+        self.analytics = MagicMock()
+        self.refiner = PromptRefiner(classification_mode="structured", client=MagicMock(), analytics=self.analytics,
+                                     max_rewrite_iterations=3, max_rewrite_calls=10, max_rewrite_seconds=30)
+        self.refiner.llm = MagicMock()
+        self.refiner.llm_json = MagicMock()
+        self.refiner.llm_creative = MagicMock()
+        self.refiner.llm_creative.invoke.return_value = ai_message("'A woman wearing a bikini on the beach.'")
+
+    def test_one_rewrite_call_per_iteration(self):
+        self.refiner.llm_json.invoke.side_effect = [ai_message(NSFW_ANSWER), ai_message(SFW_ANSWER)]
+        prompt = self.refiner.make_prompt_sfw("A naked woman on the beach")
+
+        self.assertEqual(prompt, "A woman wearing a bikini on the beach.")
+        self.assertEqual(self.refiner.llm_creative.invoke.call_count, 1)
+        # all rules and the reasons of the check are in the rewrite request
+        rewrite_request = self.refiner.llm_creative.invoke.call_args[0][0]
+        self.assertIn("6. If the image is related to People", rewrite_request[0].content)
+        self.assertIn("nudity: naked", rewrite_request[-1].content)
+        self.analytics.record_prompt_rewrite.assert_called_once_with(
+            outcome="sfw", iterations=1, llm_calls=3, tokens=300, duration_seconds=ANY)
+
+    def test_iteration_budget(self):
+        self.refiner.llm_json.invoke.return_value = ai_message(NSFW_ANSWER)
+        self.refiner.make_prompt_sfw("A naked woman on the beach", is_nsfw=True)
+
+        self.assertEqual(self.refiner.llm_creative.invoke.call_count, 3)
+        self.analytics.record_prompt_rewrite.assert_called_once_with(
+            outcome="budget_exhausted", iterations=3, llm_calls=6, tokens=600, duration_seconds=ANY)
+
+    def test_call_budget(self):
+        self.refiner.max_rewrite_calls = 9
+        self.refiner.llm_json.invoke.return_value = ai_message(NSFW_ANSWER)
+        self.refiner.make_prompt_sfw("A naked woman on the beach")
+
+        # first check, two iterations of rewrite and check, the worst case of a third iteration would exceed 9 calls
+        self.assertEqual(self.refiner.llm_creative.invoke.call_count, 2)
+        self.assertEqual(self.refiner.llm_json.invoke.call_count, 3)
+
+    def test_call_budget_with_unparsable_answers(self):
+        # every structured answer fails, the check asks all questions one by one
+        self.refiner.llm_json.invoke.return_value = ai_message("I can't answer in JSON")
+        self.refiner.llm.invoke.side_effect = [ai_message("No"), ai_message("No"), ai_message("Yes, killed people")] * 5
+        self.refiner.make_prompt_sfw("A naked woman on the beach")
+
+        calls = (self.refiner.llm_json.invoke.call_count + self.refiner.llm.invoke.call_count
+                 + self.refiner.llm_creative.invoke.call_count)
+        self.assertLessEqual(calls, self.refiner.max_rewrite_calls)
+        # first check with 4 calls, one iteration with 5 calls, a second one would exceed 10 calls
+        self.assertEqual(self.refiner.llm_creative.invoke.call_count, 1)
+        self.analytics.record_prompt_rewrite.assert_called_once_with(
+            outcome="budget_exhausted", iterations=1, llm_calls=9, tokens=900, duration_seconds=ANY)
+
+    def test_time_budget(self):
+        self.refiner.max_rewrite_seconds = 0
+        self.refiner.llm_json.invoke.return_value = ai_message(NSFW_ANSWER)
+        prompt = self.refiner.make_prompt_sfw("A naked woman on the beach", is_nsfw=True)
+
+        self.assertEqual(prompt, "A naked woman on the beach")
+        self.refiner.llm_creative.invoke.assert_not_called()
+
+    def test_sfw_prompt_not_rewritten(self):
+        self.refiner.llm_json.invoke.return_value = ai_message(SFW_ANSWER)
+        self.assertEqual(self.refiner.make_prompt_sfw("a dog on a beach"), "a dog on a beach")
+        self.refiner.llm_creative.invoke.assert_not_called()
+        self.analytics.record_prompt_rewrite.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.validators import PromptRefiner, PromptVerdictCache, normalize_prompt
+
+
+class TestNormalizePrompt(unittest.TestCase):
+    def test_case_whitespace_and_punctuation(self):
+        self.assertEqual(normalize_prompt("  A Cat,  on the\tSOFA!! "), "a cat on the sofa")
+        self.assertEqual(normalize_prompt("a cat on the sofa"), normalize_prompt("A cat - on the sofa."))
+
+    def test_style_is_stripped(self):
+        styled = "cinematic photo of #!!#A cat on the sofa#!!#, 35mm, bokeh"
+        self.assertEqual(normalize_prompt(styled, "#!!#"), "a cat on the sofa")
+        self.assertNotEqual(normalize_prompt(styled), "a cat on the sofa")
+
+
+class TestPromptVerdictCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "prompt_verdicts.db")
+        self.analytics = MagicMock()
+        self.cache = PromptVerdictCache(self.path, model="llava", max_entries=3, promptmarker="#!!#", analytics=self.analytics)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_get_and_put(self):
+        self.assertIsNone(self.cache.get("a naked man"))
+        self.cache.put("a naked man", True, "nudity: naked man")
+        self.assertEqual(self.cache.get("A naked man."), (True, "nudity: naked man"))
+        self.assertEqual(self.cache.get("style #!!#a naked   man#!!# style"), (True, "nudity: naked man"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+        self.analytics.record_cache_access.assert_any_call(cache="prompt_verdict", hit=True)
+        self.analytics.record_cache_access.assert_any_call(cache="prompt_verdict", hit=False)
+
+    def test_size_bound_removes_least_recently_used(self):
+        for prompt in ["a", "b", "c"]:
+            self.cache.put(prompt, False)
+        self.cache.get("a")
+        self.cache.put("d", False)
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.analytics.update_cache_size.assert_called_with(cache="prompt_verdict", entries=3)
+
+    def test_ttl(self):
+        cache = PromptVerdictCache(":memory:", model="llava", ttl_seconds=0.01)
+        cache.put("a cat", False)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a cat"))
+        self.assertEqual(len(cache), 0)
+
+    def test_persistent_and_dropped_on_model_change(self):
+        self.cache.put("a cat", False)
+        self.cache.close()
+        reopened = PromptVerdictCache(self.path, model="llava")
+        self.assertEqual(reopened.get("a cat"), (False, ""))
+        reopened.close()
+        other_model = PromptVerdictCache(self.path, model="llama3.2")
+        self.assertIsNone(other_model.get("a cat"))
+        other_model.close()
+
+    def test_disabled(self):
+        cache = PromptVerdictCache(":memory:", model="llava", max_entries=0)
+        cache.put("a cat", False)
+        self.assertIsNone(cache.get("a cat"))
+
+
+class TestPromptRefinerVerdictCache(unittest.TestCase):
+    def test_repeated_prompt_skips_llm(self):
+        refiner = PromptRefiner(classification_mode="structured", client=MagicMock(),
+                                verdict_cache=PromptVerdictCache(":memory:", model="llava"))
+        refiner.llm = MagicMock()
+        refiner.llm_json = MagicMock()
+        refiner.llm_json.invoke.return_value = MagicMock(
+            content='{"nudity": {"flag": true, "reason": "naked"}, "genitals": false, "death": false}')
+
+        self.assertEqual(refiner.check_contains_nsfw("a naked man"), (True, "nudity: naked"))
+        self.assertEqual(refiner.check_contains_nsfw("A naked man!"), (True, "nudity: naked"))
+        self.assertEqual(refiner.llm_json.invoke.call_count, 1)
+        refiner.llm.invoke.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
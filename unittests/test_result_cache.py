@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+from app.generators import GenerationParameters, ModelConfig
+from app.generators.result_cache import GenerationResultCache, cleanup_prompt, example_seed
+
+
+def create_modelconfig(path: str = "stabilityai/sdxl") -> ModelConfig:
+    return ModelConfig.from_dict({"Model": "test", "Path": path, "ModelType": "sdxl"})
+
+
+def create_params(prompt: str = "a dog", seed: int = 42) -> GenerationParameters:
+    return GenerationParameters(prompt=prompt, negative_prompt="", num_inference_steps=4, guidance_scale=1,
+                                width=64, height=64, num_images_per_prompt=2, seed=seed)
+
+
+def create_images(color: str = "red") -> list:
+    return [Image.new("RGB", (64, 64), color), Image.new("RGB", (64, 64), "blue")]
+
+
+class TestGenerationResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # bypass the singleton to get an isolated cache per test
+        self.cache = GenerationResultCache.__wrapped__(directory=self.directory, max_megabytes=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_fingerprint(self):
+        modelconfig = create_modelconfig()
+        fingerprint = self.cache.fingerprint(create_params(), modelconfig)
+        self.assertEqual(fingerprint, self.cache.fingerprint(create_params(), create_modelconfig()))
+        self.assertNotEqual(fingerprint, self.cache.fingerprint(create_params(seed=43), modelconfig))
+        self.assertNotEqual(fingerprint, self.cache.fingerprint(create_params(prompt="a cat"), modelconfig))
+        self.assertNotEqual(fingerprint, self.cache.fingerprint(create_params(), create_modelconfig(path="other")))
+        # random seeds are only cached if turned on
+        self.assertIsNone(self.cache.fingerprint(create_params(seed=None), modelconfig))
+        self.cache.seeded_only = False
+        self.assertIsNotNone(self.cache.fingerprint(create_params(seed=None), modelconfig))
+
+    def test_hit_and_miss(self):
+        fingerprint = self.cache.fingerprint(create_params(), create_modelconfig())
+        self.assertIsNone(self.cache.get(fingerprint))
+        self.cache.put(fingerprint, create_images())
+        images = self.cache.get(fingerprint)
+        self.assertEqual(len(images), 2)
+        self.assertEqual(images[0].getpixel((0, 0)), (255, 0, 0))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_size_cap_evicts_least_recently_used(self):
+        self.cache.put("a", create_images())
+        self.cache.max_bytes = self.cache.used_bytes * 2
+        self.cache.put("b", create_images("green"))
+        self.cache.get("a")
+        self.cache.put("c", create_images("yellow"))
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "b")))
+
+    def test_index_is_restored_from_disk(self):
+        self.cache.put("a", create_images())
+        restored = GenerationResultCache.__wrapped__(directory=self.directory, max_megabytes=1)
+        self.assertEqual(len(restored), 1)
+        self.assertEqual(len(restored.get("a")), 2)
+
+    def test_example_seed_is_stable(self):
+        self.assertEqual(example_seed("a dog"), example_seed("a dog"))
+        self.assertNotEqual(example_seed("a dog"), example_seed("a cat"))
+
+    def test_example_seed_of_cleaned_prompt(self):
+        self.assertEqual(cleanup_prompt("  a dog's ball "), "a dog-s ball")
+        self.assertEqual(example_seed(cleanup_prompt(" a dog ")), example_seed("a dog"))
+
+
+if __name__ == '__main__':
+    unittest.main()
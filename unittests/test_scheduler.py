@@ -0,0 +1,210 @@
+import unittest
+import threading
+import time
+from PIL import Image
+from app.generators import GenerationParameters, JobPriority, QueueFullException, SessionLimitException
+from app.generators.cancellation import CancellationToken, GenerationCancelledException
+from app.generators.scheduler import GenerationScheduler, JobState, JobUpdate
+
+
+class BlockingGenerator:
+    """generator replacement which waits until the test releases it"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.prompts = []
+        self.batches = []
+
+    def generate_images(self, params: GenerationParameters, step_callback=None, cancel_token=None):
+        return self.generate_images_batch([params], [step_callback], [cancel_token])[0]
+
+    def generate_images_batch(self, params_list, step_callbacks=None, cancel_tokens=None):
+        self.started.set()
+        self.release.wait(5)
+        if cancel_tokens and all(token is not None and token.is_cancelled for token in cancel_tokens):
+            raise GenerationCancelledException("cancelled")
+        for step_callback, p in zip(step_callbacks or [], params_list):
+            if step_callback:
+                step_callback(1, 2, [Image.new("RGB", (p.width // 8, p.height // 8))])
+                step_callback(2, 2, None)
+        self.batches.append([p.prompt for p in params_list])
+        self.prompts.extend(p.prompt for p in params_list)
+        return [[Image.new("RGB", (p.width, p.height)) for _ in range(p.num_images_per_prompt)] for p in params_list]
+
+
+class FailingGenerator:
+    def generate_images(self, params: GenerationParameters, step_callback=None, cancel_token=None):
+        raise RuntimeError("cuda out of memory")
+
+
+class TestGenerationScheduler(unittest.TestCase):
+    def setUp(self):
+        self.generator = BlockingGenerator()
+        # bypass the singleton to get an isolated scheduler per test
+        self.scheduler = GenerationScheduler.__wrapped__(generator=self.generator, max_queue_size=3, max_jobs_per_session=1)
+
+    def tearDown(self):
+        self.generator.release.set()
+
+    def _params(self, prompt: str, count: int = 1, width: int = 64) -> GenerationParameters:
+        return GenerationParameters(prompt=prompt, width=width, height=64, num_images_per_prompt=count)
+
+    def _block_worker(self):
+        job = self.scheduler.submit(self._params("blocker"), session="blocker")
+        self.assertTrue(self.generator.started.wait(5))
+        return job
+
+    def test_run_returns_images(self):
+        self.generator.release.set()
+        images = self.scheduler.run(self._params("a dog", count=2), session="s1")
+        self.assertEqual(len(images), 2)
+
+    def test_queue_full_rejects(self):
+        self._block_worker()
+        for i in range(3):
+            self.scheduler.submit(self._params(f"p{i}"), session=f"s{i}")
+        with self.assertRaises(QueueFullException) as context:
+            self.scheduler.submit(self._params("too much"), session="s9")
+        self.assertNotIsInstance(context.exception, SessionLimitException)
+
+    def test_session_limit_rejects(self):
+        self._block_worker()
+        self.scheduler.submit(self._params("first"), session="s1")
+        with self.assertRaises(SessionLimitException):
+            self.scheduler.submit(self._params("second"), session="s1")
+
+    def test_priority_and_fairness_order(self):
+        scheduler = GenerationScheduler.__wrapped__(generator=self.generator, max_queue_size=10, max_jobs_per_session=5)
+        scheduler.submit(self._params("blocker"), session="blocker")
+        self.assertTrue(self.generator.started.wait(5))
+        scheduler.submit(self._params("a1"), session="a")
+        scheduler.submit(self._params("a2"), session="a")
+        scheduler.submit(self._params("b1"), session="b")
+        scheduler.submit(self._params("low"), session="c", priority=JobPriority.LOW)
+        high = scheduler.submit(self._params("high"), session="d", priority=JobPriority.HIGH)
+
+        ordered = [job.params.prompt for job in scheduler._ordered_queue()]
+        self.assertEqual(ordered, ["high", "a1", "b1", "a2", "low"])
+        self.assertEqual(scheduler.get_position(high)[0], 1)
+
+        self.generator.release.set()
+        self.assertTrue(high.wait(5))
+        self.assertEqual(high.state, JobState.DONE)
+
+    def test_position_and_eta(self):
+        self._block_worker()
+        first = self.scheduler.submit(self._params("first", count=2), session="s1")
+        second = self.scheduler.submit(self._params("second"), session="s2")
+        position, eta = self.scheduler.get_position(second)
+        self.assertEqual(position, 2)
+        self.assertGreaterEqual(eta, self.scheduler.get_position(first)[1])
+
+    def test_stream_yields_progress_and_result(self):
+        self._block_worker()
+        stream = self.scheduler.stream(self._params("a dog"), session="s1", poll_interval=0.05)
+        first = next(stream)
+        self.assertEqual((first.state, first.position), (JobState.QUEUED, 1))
+
+        self.generator.release.set()
+        updates = [first] + list(stream)
+        running = [u for u in updates if u.state == JobState.RUNNING]
+        self.assertEqual([(u.step, u.total_steps) for u in running], [(1, 2), (2, 2)])
+        self.assertEqual(running[0].previews[0].size, (8, 8))
+        self.assertIsNone(running[1].previews)
+        self.assertIsInstance(updates[-1], JobUpdate)
+        self.assertEqual(updates[-1].state, JobState.DONE)
+        self.assertEqual(len(updates[-1].images), 1)
+
+    def test_cancel_waiting_job(self):
+        self._block_worker()
+        job = self.scheduler.submit(self._params("a dog"), session="s1")
+        self.scheduler.cancel(job)
+        self.assertEqual(job.state, JobState.CANCELLED)
+        self.assertEqual(self.scheduler.queue_length, 0)
+
+    def test_closed_stream_cancels_job(self):
+        self._block_worker()
+        stream = self.scheduler.stream(self._params("a dog"), session="s1", poll_interval=0.05)
+        self.assertEqual(next(stream).state, JobState.QUEUED)
+        stream.close()
+        self.assertEqual(self.scheduler.queue_length, 0)
+
+    def test_cancel_running_job(self):
+        job = self.scheduler.submit(self._params("a dog"), session="s1")
+        self.assertTrue(self.generator.started.wait(5))
+        self.scheduler.cancel(job)
+        self.generator.release.set()
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.state, JobState.CANCELLED)
+        self.assertEqual(self.generator.prompts, [])
+
+    def test_timeout_cancels_job(self):
+        self._block_worker()
+        with self.assertRaises(GenerationCancelledException):
+            self.scheduler.run(self._params("a dog"), session="s1", cancel_token=CancellationToken(timeout_seconds=0.1),
+                               poll_interval=0.05)
+
+    def test_generator_error_is_raised(self):
+        scheduler = GenerationScheduler.__wrapped__(generator=FailingGenerator())
+        with self.assertRaises(RuntimeError):
+            scheduler.run(self._params("a cat"), session="s1")
+
+    def test_compatible_jobs_are_batched(self):
+        scheduler = GenerationScheduler.__wrapped__(generator=self.generator, max_queue_size=10, max_batch_images=4)
+        scheduler.submit(self._params("blocker"), session="blocker")
+        self.assertTrue(self.generator.started.wait(5))
+        a = scheduler.submit(self._params("a", count=2), session="a")
+        b = scheduler.submit(self._params("b"), session="b")
+        other_size = scheduler.submit(self._params("c", width=128), session="c")
+        d = scheduler.submit(self._params("d", count=2), session="d")
+
+        self.generator.release.set()
+        for job in (a, b, other_size, d):
+            self.assertTrue(job.wait(5))
+        self.assertEqual(self.generator.batches, [["blocker"], ["a", "b"], ["c"], ["d"]])
+        self.assertEqual(len(a.result), 2)
+        self.assertEqual(len(b.result), 1)
+        self.assertEqual(other_size.result[0].width, 128)
+
+    def test_batch_window_collects_late_jobs(self):
+        self.generator.release.set()
+        scheduler = GenerationScheduler.__wrapped__(generator=self.generator, max_batch_images=2, batch_window_ms=2000)
+        first = scheduler.submit(self._params("first"), session="s1")
+        second = scheduler.submit(self._params("second"), session="s2")
+        self.assertTrue(first.wait(5))
+        self.assertTrue(second.wait(5))
+        self.assertIn(["first", "second"], self.generator.batches)
+
+    def test_cancel_within_batch_window(self):
+        self.generator.release.set()
+        scheduler = GenerationScheduler.__wrapped__(generator=self.generator, max_batch_images=4, batch_window_ms=1000)
+        first = scheduler.submit(self._params("first"), session="s1")
+        member = scheduler.submit(self._params("member"), session="s2")
+        # let the worker pick the jobs and wait in the batch window
+        time.sleep(0.2)
+        scheduler.cancel(member)
+        scheduler.cancel(first)
+        self.assertEqual(first.state, JobState.CANCELLED)
+        # the worker survived the cancelled batch and runs later jobs
+        later = scheduler.submit(self._params("later"), session="s3")
+        self.assertTrue(later.wait(5))
+        self.assertEqual(later.state, JobState.DONE)
+        self.assertEqual(self.generator.batches, [["later"]])
+
+    def test_batch_dict(self):
+        params = [
+            GenerationParameters(prompt="a", seed=10, num_images_per_prompt=2),
+            GenerationParameters(prompt="b", negative_prompt="ugly"),
+        ]
+        batch = GenerationParameters.to_batch_dict(params)
+        self.assertEqual(batch["prompt"], ["a", "a", "b"])
+        self.assertEqual(batch["negative_prompt"], ["", "", "ugly"])
+        self.assertEqual(batch["num_images_per_prompt"], 1)
+        self.assertEqual(len(batch["generator"]), 3)
+        self.assertEqual(batch["generator"][1].initial_seed(), 11)
+        self.assertIsNone(GenerationParameters(prompt="x", image=Image.new("RGB", (64, 64))).batch_key())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
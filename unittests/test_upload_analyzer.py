@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from PIL import Image
+from app.validators import AnalysisCache, NSFWCategory, NSFWDetectionResult, UploadAnalyzer
+
+
+class FakeAIImageDetector:
+    def __init__(self, result=(False, "No clear AI generation indicators found")):
+        self.result = result
+        self.calls = 0
+
+    def is_ai_image(self, image_path):
+        self.calls += 1
+        return self.result
+
+
+class FakeFaceDetector:
+    def __init__(self, faces, delay=0.0, release: threading.Event = None):
+        self.faces = faces
+        self.delay = delay
+        self.release = release
+
+    def get_faces(self, image):
+        if self.release is not None:
+            self.release.wait(5)
+        time.sleep(self.delay)
+        return self.faces, "cv2 image"
+
+
+class FakeNSFWDetector:
+    def __init__(self, delay=0.0, release: threading.Event = None):
+        self.delay = delay
+        self.release = release
+        self.calls = 0
+
+    def detect(self, image):
+        self.calls += 1
+        if self.release is not None:
+            self.release.wait(5)
+        time.sleep(self.delay)
+        return NSFWDetectionResult(is_safe=True, category=NSFWCategory.SAFE, confidence=1.0, details={})
+
+
+class TestUploadAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.directory, "upload.png")
+        Image.new("RGB", (1024, 1024), "white").save(self.image_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_checks_run_in_parallel(self):
+        analyzer = UploadAnalyzer(face_detector=FakeFaceDetector(faces=["face"], delay=0.3),
+                                  ai_image_detector=FakeAIImageDetector(),
+                                  nsfw_detector=FakeNSFWDetector(delay=0.3))
+        verdict = analyzer.analyze(self.image_path, "hash")
+        self.assertEqual(verdict.faces, ["face"])
+        self.assertTrue(verdict.nsfw.is_safe)
+        self.assertEqual(verdict.decided_by, "nsfw")
+        self.assertLess(verdict.timings["total"], 0.55)
+        self.assertGreaterEqual(verdict.timings["faces"], 0.3)
+
+    def test_ai_image_short_circuits(self):
+        release = threading.Event()
+        analyzer = UploadAnalyzer(face_detector=FakeFaceDetector(faces=["face"], release=release),
+                                  ai_image_detector=FakeAIImageDetector(result=(True, "AI size")),
+                                  nsfw_detector=FakeNSFWDetector(release=release))
+        try:
+            verdict = analyzer.analyze(self.image_path, "hash")
+        finally:
+            release.set()
+        self.assertTrue(verdict.is_ai_image)
+        self.assertEqual(verdict.decided_by, "ai_image")
+        self.assertIsNone(verdict.faces)
+        self.assertIsNone(verdict.nsfw)
+
+    def test_no_face_does_not_wait_for_nsfw(self):
+        release = threading.Event()
+        analyzer = UploadAnalyzer(face_detector=FakeFaceDetector(faces=[]),
+                                  ai_image_detector=FakeAIImageDetector(),
+                                  nsfw_detector=FakeNSFWDetector(release=release))
+        try:
+            verdict = analyzer.analyze(self.image_path, "hash")
+        finally:
+            release.set()
+        self.assertEqual(verdict.decided_by, "faces")
+        self.assertIsNone(verdict.nsfw)
+
+    def test_cached_results_skip_the_detectors(self):
+        cache = AnalysisCache.__wrapped__(max_entries=16)
+        ai_image_detector, nsfw_detector = FakeAIImageDetector(), FakeNSFWDetector()
+        analyzer = UploadAnalyzer(face_detector=FakeFaceDetector(faces=["face"]),
+                                  ai_image_detector=ai_image_detector,
+                                  nsfw_detector=nsfw_detector,
+                                  analysis_cache=cache)
+        analyzer.analyze(self.image_path, "hash")
+        verdict = analyzer.analyze(self.image_path, "hash")
+        self.assertEqual((ai_image_detector.calls, nsfw_detector.calls), (1, 1))
+        self.assertEqual(verdict.faces, ["face"])
+        self.assertIsNone(verdict.face_image)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from app.utils.upload_history import UploadHistory
+
+
+class TestUploadHistory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = UploadHistory(os.path.join(self.directory, "upload_history.db"))
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_record_and_update_upload(self):
+        self.assertEqual(self.history.get_upload("abc"), {})
+        self.history.record_upload("abc", "session1", token=20)
+        self.history.record_upload("abc", "session1", token=5, msg="No face", timestamp="2025-01-01T00:00:00")
+        self.history.record_upload("abc", "session2", token=0)
+        upload = self.history.get_upload("abc")
+        self.assertEqual(upload["session1"], {"token": 5, "msg": "No face", "timestamp": "2025-01-01T00:00:00"})
+        self.assertEqual(upload["session2"]["token"], 0)
+
+    def test_created_images(self):
+        self.history.add_created(["a", "b"])
+        self.history.add_created(["a"])
+        self.assertTrue(self.history.is_created("a"))
+        self.assertFalse(self.history.is_created("c"))
+
+    def test_import_json(self):
+        uploaded_path = os.path.join(self.directory, "uploaded_images.json")
+        created_path = os.path.join(self.directory, "created_images.json")
+        with open(uploaded_path, "w") as f:
+            json.dump({"abc": {"session1": {"token": 20, "msg": "", "timestamp": "2025-01-01T00:00:00"}}}, f)
+        with open(created_path, "w") as f:
+            json.dump({"def": True}, f)
+
+        self.assertTrue(self.history.is_empty())
+        self.assertEqual(self.history.import_json(uploaded_path, created_path), (1, 1))
+        # a second import keeps the existing rows
+        self.history.record_upload("abc", "session1", token=3)
+        self.history.import_json(uploaded_path, created_path)
+        self.assertEqual(self.history.get_upload("abc")["session1"]["token"], 3)
+        self.assertTrue(self.history.is_created("def"))
+
+        reopened = UploadHistory(self.history.path)
+        self.assertFalse(reopened.is_empty())
+        reopened.close()
+
+
+if __name__ == '__main__':
+    unittest.main()